@@ -5,19 +5,53 @@ import asyncio
 import multiprocessing
 import threading
 import tool
+import latency
+import telemetryHistory
+import flightRecorder
+import traceLog
+import metrics
+import profiler
+import secrets
+import os
+import time
 
 
 HOST = "0.0.0.0" #localhost allowing external connections
 PORT = 8080
 MAIN_PAGE = "indexV2.html"
 JS_PATH = "javaScript/"
+START_METHOD = None  # Démarrage du processus serveur : None (défaut de la plateforme), "fork", "spawn" ou "forkserver"
+# en forkserver, ces modules sont importés une fois dans le serveur de fork : les (re)démarrages partent d'une image chaude
+PRELOAD_MODULES = ["serverV3", "aiortc", "videoFanout", "mjpegStreamer"]
+STATIC_RELOAD = False  # True : relire index/scripts modifiés sur le disque (développement)
 SUIVI_SERVER_URL = "http://proj103.r2.enst.fr"  # URL du serveur de suivi
 SUIVI_SERVER_PORT = 80 # Port du serveur de suivi
 SUIVI_UPDATE_INTERVAL = 1.0  # Intervalle en secondes pour l'envoi des mises à jour de suivi
+SUIVI_BATCH_CONCURRENCY = clientInServer.BATCH_CONCURRENCY  # Requêtes simultanées au plus pour batch()
+VIDEO_SOURCE = 0  # Index de la caméra (ou chemin/URL accepté par cv2.VideoCapture), None pour désactiver la vidéo
+VIDEO_WIDTH = 640
+VIDEO_HEIGHT = 480
+VIDEO_FPS = 30
+VIDEO_FOURCC = None  # Format de capture demandé à la caméra, ex. "MJPG" ; None : format par défaut du pilote
+VIDEO_MAX_VIEWERS = 4  # Nombre maximal de pairs WebRTC recevant la vidéo
+VIDEO_JPEG_QUALITY = 80  # Qualité JPEG du flux /video.mjpeg et de /snapshot.jpg
+VIDEO_LADDER = None  # Profils (largeur, hauteur, fps) parcourus par le contrôle adaptatif ; None : échelle par défaut plafonnée au profil ci-dessus
+TELEMETRY_MIN_RATE = 1.0  # Hz : scrutation (et point d'historique) au minimum à cette cadence quand rien ne change
+TELEMETRY_MAX_RATE = 20.0  # Hz : scrutation au maximum à cette cadence tant que la valeur change
+TELEMETRY_HISTORY = telemetryHistory.CAPACITY  # Échantillons gardés par métrique pour /telemetry/history
+RECORDER_DIR = None  # Enregistreur de vol : dossier racine (ex. flightRecorder.RECORDER_DIR), un sous-dossier par démarrage ; None : désactivé
+RECORDER_KEEP = flightRecorder.RECORDER_KEEP  # Enregistrements gardés dans RECORDER_DIR, les plus anciens sont supprimés au démarrage
+TRACE_LEVEL = "INFO"  # Niveau minimal des traces (DEBUG, INFO, WARNING, ERROR), cf. /debug/trace
+TRACE_SAMPLING = traceLog.SAMPLING  # Catégorie -> une trace DEBUG/INFO gardée sur N (ex. "command" à 100 Hz)
+TRACE_DIR = "logs"  # Fichiers api.log et server.log ; None : traces en mémoire seulement
+PROFILE_TOKEN = None  # Jeton exigé par /debug/profile ; None : un jeton aléatoire est tiré et affiché au démarrage
+SLOW_CALLBACK_THRESHOLD = profiler.SLOW_CALLBACK  # Secondes de blocage d'une boucle avant trace de la pile ; None pour désactiver
+SESSION_CONTROL_TIMEOUT = 2.0  # Secondes sans commande avant qu'un autre client puisse prendre le contrôle
+SESSION_IDLE_TIMEOUT = 30.0  # Secondes sans message avant la fermeture d'une session
+SESSION_SHARED_CONTROL = False  # True : toutes les sessions pilotent (pas d'arbitrage)
 
 
 #TODO: intégrer le contexte  de main_application pour acces aux fonction externes(get_position_function, command_function, etc.)
-#TODO: intégrer le retour vidéo
 
 class webAPI:
     def __init__(self,
@@ -25,10 +59,32 @@ class webAPI:
             port=PORT,
             main_page=MAIN_PAGE,
             js_path=JS_PATH,
+            static_reload=STATIC_RELOAD,
+            start_method=START_METHOD,
             suivi_server_url=SUIVI_SERVER_URL,
             suivi_server_port=SUIVI_SERVER_PORT,
             main_application = None,
-
+            video_source=VIDEO_SOURCE,
+            video_width=VIDEO_WIDTH,
+            video_height=VIDEO_HEIGHT,
+            video_fps=VIDEO_FPS,
+            video_fourcc=VIDEO_FOURCC,
+            video_max_viewers=VIDEO_MAX_VIEWERS,
+            video_ladder=VIDEO_LADDER,
+            video_jpeg_quality=VIDEO_JPEG_QUALITY,
+            session_control_timeout=SESSION_CONTROL_TIMEOUT,
+            session_idle_timeout=SESSION_IDLE_TIMEOUT,
+            session_shared_control=SESSION_SHARED_CONTROL,
+            telemetry_min_rate=TELEMETRY_MIN_RATE,
+            telemetry_max_rate=TELEMETRY_MAX_RATE,
+            telemetry_history=TELEMETRY_HISTORY,
+            recorder_dir=RECORDER_DIR,
+            recorder_keep=RECORDER_KEEP,
+            trace_level=TRACE_LEVEL,
+            trace_sampling=TRACE_SAMPLING,
+            trace_dir=TRACE_DIR,
+            profile_token=PROFILE_TOKEN,
+            slow_callback_threshold=SLOW_CALLBACK_THRESHOLD,
         ):
             self.host = host
             self.port = port
@@ -42,10 +98,44 @@ class webAPI:
             self.client_running = False
             self.server_running = False
             self.main_application = main_application
-            self.command_queue = None
-            self.toggle_queue = None
+            self.command_mailbox = None
+            self.toggle_mailbox = None
             self.js_path = js_path
-            self.shared = multiprocessing.Manager().dict()
+            self.static_reload = static_reload
+            self.start_method = start_method
+            self.video_source = video_source
+            self.video_width = video_width
+            self.video_height = video_height
+            self.video_fps = video_fps
+            self.video_fourcc = video_fourcc
+            self.video_max_viewers = video_max_viewers
+            self.video_ladder = video_ladder
+            self.video_jpeg_quality = video_jpeg_quality
+            self.session_control_timeout = session_control_timeout
+            self.session_idle_timeout = session_idle_timeout
+            self.session_shared_control = session_shared_control
+            # segments de mémoire partagée : créés par start(), libérés à la fermeture de la boucle
+            self.telemetry = None
+            self.telemetry_min_rate = telemetry_min_rate
+            self.telemetry_max_rate = telemetry_max_rate
+            self.telemetry_history = telemetry_history
+            self.history = None
+            self.recorder_dir = recorder_dir
+            self.recorder_keep = recorder_keep
+            self.recorder = None
+            self.trace_level = trace_level
+            self.trace_sampling = trace_sampling
+            self.trace_dir = trace_dir
+            self.trace = None
+            self.metrics = None
+            self.profile_token_generated = profile_token is None
+            self.profile_token = profile_token or secrets.token_urlsafe(16)
+            self.slow_callback_threshold = slow_callback_threshold
+            self.profile_mailbox = None
+            self.profile = None
+            self.watchdog = None
+            self.aio = asyncWebAPI(self)
+            self.latency = None
 
 
     def start(self):
@@ -53,6 +143,14 @@ class webAPI:
             print("webAPI is already running")
             return
         self.loop = asyncio.new_event_loop()
+        self._create_shared()
+        traceLog.configure(self.trace, "api", self._trace_path("api"), self.trace_level, self.trace_sampling)
+        if self.profile_token_generated:
+            print(f"Profiling token for /debug/profile: {self.profile_token}")
+        if self.recorder_dir is not None:
+            flightRecorder.prune(self.recorder_dir, self.recorder_keep - 1)  # place pour celui-ci
+            self.recorder = flightRecorder.flightRecorder(os.path.join(self.recorder_dir, time.strftime("%Y%m%d-%H%M%S")), "api")
+            print(f"Recording flight to {self.recorder.path}")
         self.thread = threading.Thread(target=self.loop_init, daemon=False)
         self.thread.start()
         self.running = True
@@ -69,12 +167,38 @@ class webAPI:
             print("Closing webAPI...")
             if self.loop.is_running():
                 self.loop.stop()
+            if self.watchdog is not None:
+                self.watchdog.stop()
+                self.watchdog = None
             self.loop.close()
             self.loop = None
             asyncio.run(self._close_client())
             self.close_server()
+            self._close_mailboxes()
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
+            traceLog.shutdown()
+            self._release_shared()
             print("webAPI closed")
 
+    def _create_shared(self):
+        """Create the shared-memory blocks shared with the server process, once per start()."""
+        self.telemetry = tool.TelemetryBlock()
+        self.history = telemetryHistory.telemetryHistory(capacity=self.telemetry_history)
+        self.latency = latency.latencyTracker()
+        self.trace = traceLog.traceBuffer()
+        self.metrics = metrics.metricsBlock()
+        self.profile = profiler.profileBuffer()
+
+    def _release_shared(self):
+        for name in ("telemetry", "history", "latency", "trace", "metrics", "profile"):
+            block = getattr(self, name)
+            if block is not None:
+                block.close()
+                block.unlink()
+                setattr(self, name, None)
+
     def start_workers(self):
         if not self.running:
             print("webAPI is not running. Start webAPI before starting workers.")
@@ -84,50 +208,132 @@ class webAPI:
             return
         asyncio.run_coroutine_threadsafe(self.command_worker(), self.loop)
         asyncio.run_coroutine_threadsafe(self.toggle_worker(), self.loop)
+        asyncio.run_coroutine_threadsafe(self.energy_worker(), self.loop)
+        asyncio.run_coroutine_threadsafe(self.movement_status_worker(), self.loop)
+        asyncio.run_coroutine_threadsafe(metrics.monitor_loop_lag(self.metrics, "api"), self.loop)
+        asyncio.run_coroutine_threadsafe(self.profile_worker(), self.loop)
+        if self.slow_callback_threshold is not None and self.watchdog is None:
+            self.watchdog = profiler.loopWatchdog("api", self.slow_callback_threshold)
+            self.loop.call_soon_threadsafe(self.watchdog.start)
 
-    async def energy_worker(self):
-        print("Energy worker started")
+    async def telemetry_worker(self, metric, sample):
+        """Publish `sample()` to the telemetry block and the history only when it changes.
+
+        The polling rate adapts: telemetry_max_rate while the value keeps changing,
+        backing off to telemetry_min_rate when it is stable. A history point is
+        still recorded at telemetry_min_rate while nothing changes, for plots.
+        Changes are detected on the serialized JSON, so a dict the application
+        updates in place is still seen to change. A failing sample (exception, or
+        a document too large for its slot) is traced and skipped.
+        """
+        traceLog.info("worker", "Telemetry worker started: %s", metric)
+        fast, slow = 1.0 / self.telemetry_max_rate, 1.0 / self.telemetry_min_rate
+        interval = slow
+        previous = None
+        recorded = 0.0
+        failing = False
         while self.running:
-            await asyncio.sleep(1)  # Adjust the interval as needed
-            if self.main_application is not None:
-                self.shared["energy_data"] = json.dumps(self.main_application.energy.get_energy_data())
-                print(f"Energy data: {self.shared['energy_data']}")
+            await asyncio.sleep(interval)
+            if self.main_application is None:
+                interval = slow
+                continue
+            try:
+                value = sample()
+                payload = json.dumps(value).encode()
+                if payload != previous:
+                    self.telemetry.write(metric, payload)
+            except Exception as e:
+                if not failing:
+                    traceLog.error("worker", "Telemetry sample %s failed: %r", metric, e)
+                failing = True
+                interval = slow
+                continue
+            if failing:
+                traceLog.info("worker", "Telemetry sample %s recovered", metric)
+                failing = False
+            now = time.monotonic()
+            if payload != previous:
+                previous = payload
+                self.history.append(metric, now, value)
+                if self.recorder is not None:
+                    self.recorder.telemetry(metric, value)
+                recorded = now
+                interval = fast
             else:
-                print("No main_application defined; cannot retrieve energy data")
+                interval = min(interval * 2, slow)
+                if now - recorded >= slow:
+                    self.history.append(metric, now, value)
+                    recorded = now
+
+    async def energy_worker(self):
+        await self.telemetry_worker("energy_data", lambda: self.main_application.energy.get_energy_data())
 
     async def movement_status_worker(self):
-        print("Movement status worker started")
-        while self.running:
-            await asyncio.sleep(1)  # Adjust the interval as needed
-            if self.main_application is not None:
-                self.shared["movement_status"] = json.dumps(self.main_application.movement.get_movement_status())
-                print(f"Movement status: {self.shared['movement_status']}")
-            else:
-                print("No main_application defined; cannot retrieve movement status")
+        await self.telemetry_worker("movement_status", lambda: self.main_application.movement.get_movement_status())
 
     async def command_worker(self):
-        print("Command worker started")
+        traceLog.info("worker", "Command worker started")
+        applied = self.metrics.index("commands_applied_total")
+        coalesced = self.metrics.index("commands_coalesced_total")
+        read_version = self.metrics.index("command_mailbox_read_version")
+        last_version = self.command_mailbox.version
         while self.running:
-            await self.command_queue.event.wait()
-            self.command_queue.event.clear()
-            command = self.command_queue.latest_val
-            print("Processing command:", command)
+            await self.command_mailbox.event.wait()
+            self.command_mailbox.event.clear()
+            wake_ns = time.monotonic_ns()
+            latest = self.command_mailbox.get()
+            if latest is None:
+                continue
+            version, (x, y, transport_id, client_ns, recv_ns, put_ns) = latest
+            if version == last_version:
+                continue
+            # versions sautées : commandes remplacées dans la boîte avant d'être lues
+            self.metrics.inc(coalesced, version - last_version - 1)
+            self.metrics.set(read_version, version)
+            last_version = version
+            traceLog.debug("command", "Processing command: (%s, %s)", x, y)
             if self.main_application is not None:
-                self.main_application.movement.set_joystick_state(command['x'], command['y'])
+                self.main_application.movement.set_joystick_state(x, y)
             else:
                 #print("No main_application defined; cannot process command")
                 pass
+            done_ns = time.monotonic_ns()
+            self.metrics.inc(applied)
+            self.latency.record("ipc", transport_id, wake_ns - put_ns)
+            self.latency.record("apply", transport_id, done_ns - wake_ns)
+            self.latency.record("total", transport_id, done_ns - (client_ns or recv_ns))
         
     async def toggle_worker(self):
-        print("Toggle worker started")
+        traceLog.info("worker", "Toggle worker started")
+        processed = self.toggle_mailbox.version
+        applied = self.metrics.index("toggles_applied_total")
         while self.running:
-            toggle = await self.toggle_queue.event.wait()
-            self.toggle_queue.event.clear()
-            print("Processing toggle request")
-            if self.main_application is not None:
-                self.main_application.movement.toggle_mode()
-            else:
-                print("No main_application defined; cannot toggle mode")
+            await self.toggle_mailbox.event.wait()
+            self.toggle_mailbox.event.clear()
+            # chaque toggle compte : on rejoue ceux publiés depuis le dernier réveil
+            pending = self.toggle_mailbox.version - processed
+            processed += pending
+            self.metrics.inc(applied, pending)
+            for _ in range(pending):
+                traceLog.info("toggle", "Processing toggle request")
+                if self.main_application is not None:
+                    self.main_application.movement.toggle_mode()
+                else:
+                    traceLog.warning("toggle", "No main_application defined; cannot toggle mode")
+
+    async def profile_worker(self):
+        """Sample this process' stacks when the web server asks for it (/debug/profile)."""
+        loop = asyncio.get_running_loop()
+        while self.running:
+            await self.profile_mailbox.event.wait()
+            self.profile_mailbox.event.clear()
+            request = self.profile_mailbox.get()
+            if request is None:
+                continue
+            version, (seconds, interval) = request
+            traceLog.info("profile", "Profiling webAPI for %.1f s", seconds)
+            counts = await loop.run_in_executor(None, profiler.stackSampler(interval).sample, seconds)
+            self.profile.write(version, profiler.collapse(counts, "api", self.profile.capacity))
 
     def _ensure_loop(self):
         if self.loop is not None and self.loop.is_running():
@@ -151,12 +357,22 @@ class webAPI:
             print("Web server process is already running")
             return
         print("Starting web server process")
-        # ensure we have a command_queue to communicate with the child
-        if self.command_queue is None:
-            self.command_queue = tool.Queue(loop=self.loop)
-        if self.toggle_queue is None:
-            self.toggle_queue = tool.Queue(loop=self.loop)
-        self.server_process = multiprocessing.Process(target=serverV3.new_web_server_process, args=(self.export_config(), self.command_queue.mp_q, self.toggle_queue.mp_q, self.shared), daemon=False)
+        # ensure we have the shared-memory mailboxes to communicate with the child
+        if self.command_mailbox is None:
+            self.command_mailbox = tool.Mailbox("ddBqqq")  # x, y, transport, client/recv/put ns
+            self.command_mailbox.attach(self.loop)
+        if self.toggle_mailbox is None:
+            self.toggle_mailbox = tool.Mailbox()
+            self.toggle_mailbox.attach(self.loop)
+        if self.profile_mailbox is None:
+            self.profile_mailbox = tool.Mailbox("dd")  # durée, période d'échantillonnage (s)
+            self.profile_mailbox.attach(self.loop)
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == "forkserver":
+            context.set_forkserver_preload(PRELOAD_MODULES)
+        cfg = self.export_config()
+        cfg["spawned_ns"] = time.monotonic_ns()  # cf. /debug/startup
+        self.server_process = context.Process(target=serverV3.new_web_server_process, args=(cfg, self.command_mailbox, self.toggle_mailbox, self.telemetry, self.latency, self.history, self.trace, self.metrics, self.profile_mailbox, self.profile), daemon=False)
         self.server_process.start()
         self.server_running = True
         print("Web server process started")
@@ -169,6 +385,8 @@ class webAPI:
         self.client = clientInServer.webClient(
                 self.suivi_server_url,
                 self.suivi_server_port,
+                self.recorder,
+                self.metrics,
             )
             
     def start_client(self):
@@ -181,6 +399,15 @@ class webAPI:
         asyncio.run_coroutine_threadsafe(self._start_client(), self.loop).result()
 
 
+    def _close_mailboxes(self):
+        for mailbox in (self.command_mailbox, self.toggle_mailbox, self.profile_mailbox):
+            if mailbox is not None:
+                mailbox.close()
+                mailbox.unlink()
+        self.command_mailbox = None
+        self.toggle_mailbox = None
+        self.profile_mailbox = None
+
     def close_server(self):
          if self.server_process.is_alive():
             print("Terminating web server process")
@@ -217,6 +444,9 @@ class webAPI:
             self.thread.join()
         self.running = False
 
+    def _trace_path(self, source):
+        return None if self.trace_dir is None else os.path.join(self.trace_dir, f"{source}.log")
+
     def export_config(self):
         """Return a plain dict of the API configuration safe to pass to a child process. """
         return {
@@ -224,6 +454,26 @@ class webAPI:
             "port": self.port,
             "main_page": self.main_page,
             "js_path": self.js_path,
+            "static_reload": self.static_reload,
+            "start_method": self.start_method,
+            "recorder": None if self.recorder is None else {"path": self.recorder.path},
+            "trace": {"path": self._trace_path("server"), "level": self.trace_level, "sampling": self.trace_sampling},
+            "profile": {"token": self.profile_token, "slow_callback": self.slow_callback_threshold},
+            "sessions": {
+                "control_timeout": self.session_control_timeout,
+                "idle_timeout": self.session_idle_timeout,
+                "shared_control": self.session_shared_control,
+            },
+            "video": None if self.video_source is None else {
+                "source": self.video_source,
+                "width": self.video_width,
+                "height": self.video_height,
+                "fps": self.video_fps,
+                "fourcc": self.video_fourcc,
+                "max_viewers": self.video_max_viewers,
+                "ladder": self.video_ladder,
+                "jpeg_quality": self.video_jpeg_quality,
+            },
         }
 
     # --- Proxy methods: schedule clientInServer.webClient coroutines on server loop ---
@@ -233,12 +483,16 @@ class webAPI:
 
     def start_update_suivi(self, get_position_function, suivi_update_interval = SUIVI_UPDATE_INTERVAL  ,tid = None):
         if not self._ensure_client(): return
-        return asyncio.run_coroutine_threadsafe(self.client.update_suivi(get_position_function, suivi_update_interval, tid), self.loop)
+        return asyncio.run_coroutine_threadsafe(self.client.start_update_suivi(get_position_function, suivi_update_interval, tid), self.loop)
 
     def stop_update_suivi(self):
         if not self._ensure_client(): return
         return asyncio.run_coroutine_threadsafe(self.client.stop_update_suivi(), self.loop)
     
+    def get_position_metrics(self):
+        if not self._ensure_client(): return
+        return asyncio.run_coroutine_threadsafe(self.client.get_position_metrics(), self.loop)
+
     def get_flags(self):
         if not self._ensure_client(): return
         return asyncio.run_coroutine_threadsafe(self.client.get_flags(), self.loop)
@@ -274,4 +528,68 @@ class webAPI:
     def get_flag_pattern(self):
         if not self._ensure_client(): return
         return asyncio.run_coroutine_threadsafe(self.client.get_flag_pattern(), self.loop)
+
+    def batch(self, calls, max_concurrency=SUIVI_BATCH_CONCURRENCY):
+        """Run several tracking server operations concurrently, see clientInServer.webClient.batch."""
+        if not self._ensure_client(): return
+        return asyncio.run_coroutine_threadsafe(self.client.batch(calls, max_concurrency), self.loop)
+
+    async def _call(self, method, *args):
+        """Await webClient.`method`(*args) on the API loop: directly when already running on it, else through run_coroutine_threadsafe."""
+        if not self._ensure_client(): return
+        coro = getattr(self.client, method)(*args)
+        if asyncio.get_running_loop() is self.loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+
+class asyncWebAPI:
+    """
+    Façade asynchrone des méthodes proxy de webAPI, disponible en `api.aio`.
+    Depuis la boucle de webAPI (workers, callbacks), chaque appel attend
+    directement la coroutine de webClient, sans passage par un autre thread ;
+    depuis une autre boucle, le Future de run_coroutine_threadsafe est attendu
+    avec asyncio.wrap_future, sans bloquer de thread.
+    Usage :
+      flags = await api.aio.get_flags()
+      r0, r1, status = await api.aio.batch([("read_register", 0), ("read_register", 1), ("get_race_status",)])
+    """
+    def __init__(self, api : webAPI) -> None:
+        self.api = api
+
+    async def get_position_metrics(self):
+        return await self.api._call("get_position_metrics")
+
+    async def stop_update_suivi(self):
+        return await self.api._call("stop_update_suivi")
+
+    async def get_flags(self):
+        return await self.api._call("get_flags")
+
+    async def capture_flag(self, mid, msec, minner, tid=None, wait=True):
+        return await self.api._call("capture_flag", mid, msec, minner, tid, wait)
+
+    async def get_race_status(self):
+        return await self.api._call("get_race_status")
+
+    async def write_register(self, rid, val, tid=None):
+        return await self.api._call("write_register", rid, val, tid)
+
+    async def read_register(self, rid, team=None):
+        return await self.api._call("read_register", rid, team)
+
+    async def launch_race(self):
+        return await self.api._call("launch_race")
+
+    async def stop_race(self):
+        return await self.api._call("stop_race")
+
+    async def select_flag_pattern(self, n):
+        return await self.api._call("select_flag_pattern", n)
+
+    async def get_flag_pattern(self):
+        return await self.api._call("get_flag_pattern")
+
+    async def batch(self, calls, max_concurrency=SUIVI_BATCH_CONCURRENCY):
+        return await self.api._call("batch", calls, max_concurrency)
         
\ No newline at end of file
@@ -0,0 +1,97 @@
+import asyncio
+import traceLog
+
+# Échelle de profils (largeur, hauteur, images/s), du plus léger au plus lourd.
+DEFAULT_LADDER = (
+	(320, 240, 10),
+	(320, 240, 15),
+	(480, 360, 15),
+	(640, 480, 20),
+	(640, 480, 30),
+)
+CONTROL_INTERVAL = 1.0  # période de décision (s)
+
+# saturation : on descend d'un cran dès qu'un seuil haut est dépassé
+ENCODE_BUSY_HIGH = 0.8  # temps d'encodage / période d'image
+LOSS_HIGH = 0.05  # fraction de paquets perdus (rapports RTCP)
+LOOP_LAG_HIGH = 0.05  # retard de la boucle asyncio (s)
+# marge : on remonte d'un cran après UPGRADE_AFTER décisions sous tous les seuils bas
+ENCODE_BUSY_LOW = 0.5
+LOSS_LOW = 0.01
+LOOP_LAG_LOW = 0.01
+UPGRADE_AFTER = 5
+
+
+class videoQualityController:
+	"""
+	Ajuste la résolution et la cadence de la capture partagée (videoFanout).
+	Signaux observés à chaque période :
+	  - temps d'encodage par pair (fanoutTrack.encode_time, rapporté à la période d'image),
+	  - pertes remontées par les rapports RTCP des récepteurs (RTCRtpSender.getStats),
+	  - retard de la boucle asyncio (CPU saturé ou appel bloquant).
+	Descend d'un cran dès qu'un signal est saturé, remonte d'un cran après
+	UPGRADE_AFTER périodes consécutives avec de la marge.
+	"""
+	def __init__(self, fanout, ladder=DEFAULT_LADDER, interval=CONTROL_INTERVAL, start_level=None):
+		self.fanout = fanout
+		self.ladder = [tuple(rung) for rung in ladder]
+		self.interval = interval
+		self.level = len(self.ladder) - 1 if start_level is None else start_level
+		self._calm = 0
+		self.last_signals = {}
+		self.changes = 0
+
+	@property
+	def profile(self):
+		return self.ladder[self.level]
+
+	async def _loss(self):
+		loss = 0.0
+		for viewer in list(self.fanout.viewers):
+			if viewer.sender is None:
+				continue
+			try:
+				report = await viewer.sender.getStats()
+			except Exception:
+				continue
+			for stats in report.values():
+				if stats.type == "remote-inbound-rtp":
+					loss = max(loss, stats.fractionLost / 256.0)
+		return loss
+
+	def _encode_busy(self):
+		fps = self.profile[2]
+		return max((viewer.encode_time * fps for viewer in self.fanout.viewers), default=0.0)
+
+	def _set_level(self, level):
+		if level == self.level:
+			return
+		self.level = level
+		self.changes += 1
+		width, height, fps = self.profile
+		traceLog.info("video", "Video profile -> %dx%d@%d (%s)", width, height, fps, self.last_signals)
+		self.fanout.set_profile(width, height, fps)
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			start = loop.time()
+			await asyncio.sleep(self.interval)
+			lag = max(0.0, loop.time() - start - self.interval)
+			encode = self._encode_busy()
+			loss = await self._loss()
+			self.last_signals = {"encode_busy": round(encode, 3), "loss": round(loss, 3), "loop_lag": round(lag, 4)}
+			if encode > ENCODE_BUSY_HIGH or loss > LOSS_HIGH or lag > LOOP_LAG_HIGH:
+				self._calm = 0
+				self._set_level(max(self.level - 1, 0))
+			elif encode < ENCODE_BUSY_LOW and loss < LOSS_LOW and lag < LOOP_LAG_LOW:
+				self._calm += 1
+				if self._calm >= UPGRADE_AFTER:
+					self._calm = 0
+					self._set_level(min(self.level + 1, len(self.ladder) - 1))
+			else:
+				self._calm = 0
+
+	def stats(self):
+		width, height, fps = self.profile
+		return {"width": width, "height": height, "fps": fps, "level": self.level, "changes": self.changes, "signals": self.last_signals}
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+import aiohttp
+import API
+import commandProtocol
+
+# Banc de charge du chemin de commande : navigateur -> serverV3.webServer -> webAPI -> set_joystick_state.
+#   py benchControl.py --ws-clients 10 --rtc-clients 2 --rate 60 --duration 10 --output run.json
+# webAPI et le processus serveur tournent pour de vrai avec une main_application factice ;
+# les clients WebSocket / DataChannel tournent dans un processus séparé pour ne pas
+# fausser la mesure CPU. Les commandes sont horodatées sur l'horloge monotone commune,
+# donc l'étape `total` de /debug/latency mesure l'envoi -> retour de set_joystick_state.
+
+PORT = 8090
+
+
+class _stubMovement:
+    def __init__(self):
+        self.calls = 0
+        self.toggles = 0
+
+    def set_joystick_state(self, x, y):
+        self.calls += 1
+
+    def toggle_mode(self):
+        self.toggles += 1
+
+    def get_movement_status(self):
+        return {"calls": self.calls}
+
+
+class _stubEnergy:
+    def get_energy_data(self):
+        return {"voltage": 12.0}
+
+
+class stubApplication:
+    """main_application minimale : compte les commandes reçues."""
+    def __init__(self):
+        self.movement = _stubMovement()
+        self.energy = _stubEnergy()
+
+
+def _frame(protocol, seq, x, y):
+    now_ms = time.monotonic_ns() / 1e6
+    if protocol == commandProtocol.PROTOCOL_BINARY:
+        return commandProtocol.FRAME.pack(commandProtocol.MSG_COMMAND, commandProtocol.FLAG_CLOCK_SYNCED, seq, now_ms, x, y)
+    return json.dumps({"type": "command", "x": x, "y": y, "seq": seq, "ts": now_ms, "synced": True})
+
+
+async def _send_loop(send, protocol, rate, stop_at, counter):
+    loop = asyncio.get_running_loop()
+    period = 1.0 / rate
+    next_send = loop.time()
+    seq = 0
+    while loop.time() < stop_at:
+        seq += 1
+        send(_frame(protocol, seq, (seq % 200) / 100.0 - 1.0, 0.5))
+        counter["sent"] += 1
+        next_send += period
+        await asyncio.sleep(max(0.0, next_send - loop.time()))
+
+
+async def _ws_client(base_url, protocol, rate, duration, counter):
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(f"{base_url}/ws") as ws:
+            await ws.send_str(json.dumps({"type": "hello", "protocols": [protocol]}))
+            reply = json.loads((await ws.receive()).data)
+            protocol = reply.get("protocol", commandProtocol.PROTOCOL_JSON)
+
+            def send(data):
+                if isinstance(data, bytes):
+                    asyncio.ensure_future(ws.send_bytes(data))
+                else:
+                    asyncio.ensure_future(ws.send_str(data))
+            await _send_loop(send, protocol, rate, asyncio.get_running_loop().time() + duration, counter)
+            await asyncio.sleep(0.2)
+
+
+async def _rtc_client(base_url, protocol, rate, duration, counter):
+    import aiortc as rtc
+    pc = rtc.RTCPeerConnection()
+    channel = pc.createDataChannel("commands")
+    opened = asyncio.Event()
+    hello = asyncio.get_running_loop().create_future()
+    channel.on("open", opened.set)
+
+    @channel.on("message")
+    def on_message(message):
+        msg = json.loads(message)
+        if msg.get("type") == "hello" and not hello.done():
+            hello.set_result(msg.get("protocol", commandProtocol.PROTOCOL_JSON))
+
+    await pc.setLocalDescription(await pc.createOffer())
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{base_url}/rtcOffer_command", json={"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}) as resp:
+            answer = await resp.json()
+    await pc.setRemoteDescription(rtc.RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+    await asyncio.wait_for(opened.wait(), 10)
+    channel.send(json.dumps({"type": "hello", "protocols": [protocol]}))
+    protocol = await asyncio.wait_for(hello, 5)
+    await _send_loop(channel.send, protocol, rate, asyncio.get_running_loop().time() + duration, counter)
+    await asyncio.sleep(0.2)
+    await pc.close()
+
+
+def _driver(base_url, args, results):
+    async def main():
+        counters = {"ws": {"sent": 0}, "webrtc": {"sent": 0}}
+        clients = [_ws_client(base_url, args.protocol, args.rate, args.duration, counters["ws"]) for _ in range(args.ws_clients)]
+        clients += [_rtc_client(base_url, args.protocol, args.rate, args.duration, counters["webrtc"]) for _ in range(args.rtc_clients)]
+        errors = [repr(e) for e in await asyncio.gather(*clients, return_exceptions=True) if isinstance(e, BaseException)]
+        return counters, errors
+    started = time.process_time()
+    counters, errors = asyncio.run(main())
+    results.put({"counters": counters, "errors": errors, "cpu_s": time.process_time() - started})
+
+
+def _proc_cpu(pid):
+    """utime + stime of `pid` in seconds (Linux /proc)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return None
+
+
+async def _wait_for_server(base_url, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/debug/latency") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise TimeoutError("web server did not start")
+
+
+async def _get_json(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await resp.json()
+
+
+def run_benchmark(args):
+    app = stubApplication()
+    # sans --exclusive, toutes les sessions pilotent : on mesure le chemin de commande, pas l'arbitrage
+    api = API.webAPI(host="127.0.0.1", port=args.port, main_application=app, session_shared_control=not args.exclusive)
+    api.start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(_wait_for_server(base_url))
+        server_pid = api.server_process.pid
+        server_cpu0, api_cpu0 = _proc_cpu(server_pid), time.process_time()
+        results = multiprocessing.Queue()
+        driver = multiprocessing.Process(target=_driver, args=(base_url, args, results))
+        started = time.monotonic()
+        driver.start()
+        driven = results.get()
+        driver.join()
+        elapsed = time.monotonic() - started
+        server_cpu1, api_cpu1 = _proc_cpu(server_pid), time.process_time()
+        report = asyncio.run(_get_json(f"{base_url}/debug/latency"))
+        sessions = asyncio.run(_get_json(f"{base_url}/sessions"))
+    finally:
+        api.close()
+
+    sent = sum(c["sent"] for c in driven["counters"].values())
+    delivered = app.movement.calls
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "elapsed_s": elapsed,
+        "sent": driven["counters"],
+        "sent_per_s": sent / elapsed,
+        "delivered": delivered,
+        "delivered_per_s": delivered / elapsed,
+        # commandes remplacées avant d'être lues (dernière valeur seulement) ou rejetées comme périmées
+        "coalesced_or_dropped_ratio": 1.0 - delivered / sent if sent else None,
+        "cpu_s": {
+            "server_process": None if server_cpu0 is None or server_cpu1 is None else server_cpu1 - server_cpu0,
+            "api_process": api_cpu1 - api_cpu0,
+            "client_driver": driven["cpu_s"],
+        },
+        "latency_ms": report,
+        "sessions": {"opened": sessions["opened"], "rejected": sessions["rejected"]},
+        "client_errors": driven["errors"],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark of the joystick command path")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--ws-clients", type=int, default=4)
+    parser.add_argument("--rtc-clients", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=60.0, help="commands per second per client")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    parser.add_argument("--protocol", choices=commandProtocol.SUPPORTED_PROTOCOLS, default=commandProtocol.PROTOCOL_BINARY)
+    parser.add_argument("--exclusive", action="store_true", help="single-controller arbitration: only one client drives")
+    parser.add_argument("--output", default=None, help="write the JSON result to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = run_benchmark(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import time
+import warnings
+import clientInServer
+import latency
+import suiviSimulator
+
+# Banc de charge de clientInServer.webClient contre suiviSimulator (ou un serveur donné par --url).
+#   py benchSuivi.py --clients 20 --duration 10 --latency 0.02 --error-503 0.02
+# Chaque client envoie sa position à cadence fixe et enchaîne des opérations
+# tirées selon le mélange (captures de drapeaux, registres, statut...).
+# Le résultat (percentiles par opération, requêtes/s, erreurs) est écrit en JSON.
+
+# poids des opérations dans le mélange
+MIX = {
+    "get_flags": 3,
+    "capture_flag": 1,
+    "get_race_status": 2,
+    "read_register": 4,
+    "write_register": 2,
+    "get_flag_pattern": 1,
+}
+
+
+async def _operation(client, name, rng):
+    match name:
+        case "get_flags":
+            return await client.get_flags()
+        case "capture_flag":
+            return await client.capture_flag(rng.randrange(8), rng.randrange(4), rng.randrange(2))
+        case "get_race_status":
+            return await client.get_race_status()
+        case "read_register":
+            return await client.read_register(rng.randrange(8))
+        case "write_register":
+            return await client.write_register(rng.randrange(8), rng.randrange(1000))
+        case "get_flag_pattern":
+            return await client.get_flag_pattern()
+
+
+async def _client_worker(client, args, rng, histograms, outcomes, stop_at):
+    names = list(MIX)
+    weights = [MIX[n] for n in names]
+    period = 1.0 / args.op_rate
+    loop = asyncio.get_running_loop()
+    next_op = loop.time() + rng.uniform(0, period)
+    while loop.time() < stop_at:
+        await asyncio.sleep(max(0.0, next_op - loop.time()))
+        next_op += period
+        name = rng.choices(names, weights)[0]
+        t0 = time.monotonic_ns()
+        try:
+            result = await _operation(client, name, rng)
+        except Exception as e:
+            outcomes[name]["exceptions"] += 1
+            outcomes[name].setdefault("last_exception", repr(e))
+            continue
+        histograms[name].record_ns(time.monotonic_ns() - t0)
+        # None/False : échec signalé par le client ; 0 est une valeur de registre valide
+        outcomes[name]["failed" if result is None or result is False else "ok"] += 1
+
+
+async def run_benchmark(args):
+    runner = None
+    url, port = args.url, args.port
+    simulator = None
+    if url is None:
+        simulator = suiviSimulator.simulator_from_args(args)
+        runner = await simulator.start_server("127.0.0.1", args.port)
+        url = "http://127.0.0.1"
+        simulator.race_running = True
+    clients = [clientInServer.webClient(url, port) for _ in range(args.clients)]
+    histograms = {name: latency.latencyHistogram() for name in MIX}
+    outcomes = {name: {"ok": 0, "failed": 0, "exceptions": 0} for name in MIX}
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    stop_at = loop.time() + args.duration
+    position_tasks = [
+        asyncio.create_task(c.start_update_suivi(lambda: (rng.uniform(0, 300), rng.uniform(0, 200)), 1.0 / args.pos_rate, tid=i))
+        for i, c in enumerate(clients)
+    ]
+    workers = [
+        asyncio.create_task(_client_worker(c, args, random.Random(rng.random()), histograms, outcomes, stop_at))
+        for c in clients
+    ]
+    await asyncio.gather(*workers)
+    for c in clients:
+        await c.stop_update_suivi()
+    await asyncio.gather(*position_tasks, return_exceptions=True)
+    elapsed = time.monotonic() - started
+
+    positions = {}
+    for c in clients:
+        for key, value in c.position_metrics.items():
+            positions[key] = positions.get(key, 0) + value
+    cache = {"hits": sum(c.cache.hits for c in clients), "misses": sum(c.cache.misses for c in clients), "coalesced": sum(c.cache.coalesced for c in clients)}
+    operations = {name: dict(outcomes[name], **histograms[name].summary()) for name in MIX}
+    completed = sum(o["ok"] + o["failed"] for o in outcomes.values())
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "elapsed_s": elapsed,
+        "operations": operations,
+        "operations_per_s": completed / elapsed,
+        "positions": positions,
+        "cache": cache,
+    }
+    if simulator is not None:
+        result["server"] = {
+            "requests": simulator.stats["requests"],
+            "requests_per_s": simulator.stats["requests"] / elapsed,
+            "throttled": simulator.stats["throttled"],
+            "status": {str(k): v for k, v in simulator.stats["status"].items()},
+        }
+    for c in clients:
+        await c.session.close()
+    if runner is not None:
+        await runner.cleanup()
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load benchmark for clientInServer.webClient")
+    parser.add_argument("--url", default=None, help="tracking server URL; a local suiviSimulator is started if omitted")
+    parser.add_argument("--port", type=int, default=suiviSimulator.PORT)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--pos-rate", type=float, default=5.0, help="position reports per second per client")
+    parser.add_argument("--op-rate", type=float, default=10.0, help="other operations per second per client")
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--error-400", type=float, default=0.0)
+    parser.add_argument("--error-401", type=float, default=0.0)
+    parser.add_argument("--error-503", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=float, default=None)
+    parser.add_argument("--require-race", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the JSON result to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # les clients affichent chaque requête : on garde la sortie pour le résultat JSON
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore")
+        result = asyncio.run(run_benchmark(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
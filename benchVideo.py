@@ -0,0 +1,81 @@
+import argparse
+import json
+import time
+import av
+import numpy as np
+import latency
+import videoSender
+
+# Micro-banc de la conversion des frames caméra pour l'encodeur WebRTC.
+#   py benchVideo.py --width 640 --height 480 --frames 500
+# "bgr24" : ancien chemin de videoSender.recv (from_ndarray puis conversion yuv420p
+#           faite par l'encodeur aiortc) ; "pool" : videoSender.yuvFramePool.
+# Avec --encode, chaque frame est aussi encodée en VP8 comme le ferait un pair.
+# Le résultat (percentiles par frame en ms) est écrit en JSON.
+
+
+def _bgr24(pool, frame):
+    video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+    return video_frame.reformat(format="yuv420p")  # ce que fait l'encodeur avant d'encoder
+
+
+def _pool(pool, frame):
+    return pool.convert(frame)
+
+
+def run_path(name, convert, frames, args):
+    encoder = None
+    if args.encode:
+        from aiortc.codecs.vpx import Vp8Encoder
+        encoder = Vp8Encoder()
+    pool = videoSender.yuvFramePool(args.width, args.height)
+    histogram = latency.latencyHistogram()
+    started = time.process_time()
+    for i in range(args.frames):
+        t0 = time.perf_counter_ns()
+        video_frame = convert(pool, frames[i % len(frames)])
+        if encoder is not None:
+            video_frame.pts = i * 3000
+            video_frame.time_base = videoSender.VIDEO_TIME_BASE
+            encoder.encode(video_frame)
+        histogram.record_ns(time.perf_counter_ns() - t0)
+        del video_frame
+    result = histogram.summary()
+    result["cpu_s"] = time.process_time() - started
+    if name == "pool":
+        result["frames_allocated"] = pool.allocated
+    return result
+
+
+def run_benchmark(args):
+    rng = np.random.default_rng(args.seed)
+    # quelques images différentes pour ne pas mesurer un cache chaud sur une seule
+    frames = [rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8) for _ in range(4)]
+    paths = {"bgr24": _bgr24, "pool": _pool}
+    for name, convert in paths.items():
+        run_path(name, convert, frames, argparse.Namespace(**dict(vars(args), frames=20)))  # chauffe
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "per_frame_ms": {name: run_path(name, convert, frames, args) for name, convert in paths.items()},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-frame cost of converting camera frames for the WebRTC encoder")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--encode", action="store_true", help="include VP8 encoding in the measure")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the JSON result to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = run_benchmark(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
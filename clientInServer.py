@@ -1,19 +1,108 @@
 import aiohttp as web
-import warnings
+import time
+import traceLog
+import metrics as metricsModule
 import asyncio
 import json
 
 SUIVI_SERVER_URL = "http://proj103.r2.enst.fr"  # URL du serveur de suivi
 SUIVI_SERVER_PORT = 80 # Port du serveur de suivi
 SUIVI_UPDATE_INTERVAL = 1.0  # Intervalle en secondes pour l'envoi des mises à jour de suivi
+POSITION_MAX_IN_FLIGHT = 2  # Nombre maximal de requêtes de position simultanées
+POSITION_REQUEST_TIMEOUT = 2.0  # Délai maximal d'une requête de position (s)
+POSITION_BACKOFF_MAX = 8.0  # Attente maximale après des erreurs 5xx successives (s)
+READ_CACHE_TTL = {  # Durée de fraîcheur (s) des lectures mises en cache, par point d'accès
+    "flags": 1.0,
+    "race_status": 0.5,
+    "flag_pattern": 5.0,
+    "register": 0.5,
+}
+BATCH_CONCURRENCY = 8  # Requêtes simultanées au plus pendant une opération groupée (batch)
+# opérations acceptées par webClient.batch
+BATCH_OPERATIONS = ("get_flags", "capture_flag", "get_race_status", "read_register", "write_register", "get_flag_pattern", "select_flag_pattern", "launch_race", "stop_race")
+READ_CACHE_STALE = 2.0  # Une valeur expirée depuis moins que ça est servie pendant sa revalidation (s)
+
+
+class readCache:
+    """Cache de lecture pour les points d'accès du serveur de suivi.
+
+    Les clés sont des tuples dont le premier élément nomme le point d'accès
+    ("flags", "register", ...) et donne la durée de fraîcheur (READ_CACHE_TTL).
+    Les appelants simultanés d'une même clé partagent une seule requête en cours ;
+    une valeur expirée depuis moins de `stale` secondes est renvoyée tout de suite
+    pendant qu'une requête de revalidation part en arrière-plan. Les échecs (None)
+    ne sont pas mis en cache. `invalidate` oublie les entrées et ignore le résultat
+    des requêtes parties avant l'invalidation.
+    """
+    def __init__(self, ttls=READ_CACHE_TTL, stale=READ_CACHE_STALE):
+        self.ttls = ttls
+        self.stale = stale
+        self.entries = {}  # clé -> (valeur, instant de la lecture)
+        self.in_flight = {}  # clé -> tâche de lecture en cours
+        self.generations = {}  # point d'accès -> nombre d'invalidations
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key, fetch):
+        now = asyncio.get_running_loop().time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            age = now - entry[1]
+            ttl = self.ttls.get(key[0], 0.0)
+            if age < ttl:
+                self.hits += 1
+                return entry[0]
+            if age < ttl + self.stale:
+                self.hits += 1
+                self._fetch(key, fetch)
+                return entry[0]
+        self.misses += 1
+        return await asyncio.shield(self._fetch(key, fetch))
+
+    def _fetch(self, key, fetch):
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        generation = self.generations.get(key[0], 0)
+        task = asyncio.create_task(fetch())
+        self.in_flight[key] = task
+
+        def _done(t):
+            self.in_flight.pop(key, None)
+            if t.cancelled() or t.exception() is not None:
+                return
+            value = t.result()
+            if value is not None and self.generations.get(key[0], 0) == generation:
+                self.entries[key] = (value, asyncio.get_running_loop().time())
+        task.add_done_callback(_done)
+        return task
+
+    def invalidate(self, endpoint, *prefix):
+        """Forget the entries of `endpoint` whose key starts with `prefix` (all of them if empty)."""
+        self.generations[endpoint] = self.generations.get(endpoint, 0) + 1
+        n = len(prefix)
+        for key in [k for k in self.entries if k[0] == endpoint and k[1:1 + n] == prefix]:
+            del self.entries[key]
 
 
 class webClient:
-    def __init__(self, suivi_server_url = SUIVI_SERVER_URL, suivi_server_port = SUIVI_SERVER_PORT):
+    def __init__(self, suivi_server_url = SUIVI_SERVER_URL, suivi_server_port = SUIVI_SERVER_PORT, recorder = None, metrics = None):
         self.session = web.ClientSession()
         self.suivi_server_url = suivi_server_url
         self.suivi_server_port = suivi_server_port
+        self.base_url = f"{suivi_server_url}:{suivi_server_port}"
+        self.recorder = recorder  # flightRecorder.flightRecorder : chaque position échantillonnée y est journalisée
+        self.metrics = metrics  # metrics.metricsBlock : statuts et latence des requêtes au serveur de suivi
         self.send_position = True
+        self.cache = readCache()
+        self.position_metrics = {"sampled": 0, "sent": 0, "failed": 0, "dropped": 0, "coalesced": 0}
+        self._pending_position = None
+        self._position_ready = asyncio.Event()
+        self._position_backoff = 0.0
+        self._position_retry_at = 0.0
+        self._background = set()  # captures envoyées sans attente (wait=False)
 
 
     async def close(self):
@@ -23,99 +112,245 @@ class webClient:
         print("Web client closed")
     
 
+    def _observe(self, status, started):
+        """Count one tracking server request (status None: no response) and its latency."""
+        if self.metrics is None:
+            return
+        label = "error" if status is None else str(status) if str(status) in metricsModule.SUIVI_STATUSES else "other"
+        self.metrics.inc(self.metrics.index("suivi_requests_total", label))
+        self.metrics.observe(self.metrics.index("suivi_request_seconds"), metricsModule.SUIVI_BUCKETS, time.monotonic() - started)
+
     async def http_status_handler(self, status_code, context, response_text=None):
         match status_code:
             case 200:
-                print(f"{context} succeeded")
+                traceLog.debug("suivi", "%s succeeded", context)
                 return True 
             case 400:
-                warnings.warn(f"Bad request when {context}: {response_text}")
+                traceLog.warning("suivi", "Bad request when %s: %s", context, response_text)
                 return False
             case 401:
-                warnings.warn(f"Unauthorized access when {context}")
+                traceLog.warning("suivi", "Unauthorized access when %s", context)
                 return False
             case 404:
-                warnings.warn(f"API command not recognized when {context}")
+                traceLog.warning("suivi", "API command not recognized when %s", context)
                 return False
             case 500:
-                warnings.warn(f"Internal server error when {context}")
+                traceLog.warning("suivi", "Internal server error when %s", context)
                 return False
             case 503:
-                warnings.warn(f"{context} command received but no exam is running")
+                traceLog.warning("suivi", "%s command received but no exam is running", context)
                 return False
             case _:
-                warnings.warn(f"Unexpected status code {status_code} when {context}")
+                traceLog.warning("suivi", "Unexpected status code %s when %s", status_code, context)
                 return False
 
-    async def start_update_suivi(self, get_position_function, suivi_update_interval=SUIVI_UPDATE_INTERVAL, tid = None):
-        t = "" if tid is None else f"&t={tid}"
-        print(f"Starting location updates every {suivi_update_interval} seconds to {self.suivi_server_url}:{self.suivi_server_port} {"" if tid is None else f"as team {tid}"}")
-        while self.send_position:
-            x, y = get_position_function()
-            async with self.session.post(f"{self.suivi_server_url}/api/pos?x={x}&y={y}{t}:{self.suivi_server_port}") as resp:
-                self.http_status_handler(await resp.status, "Position update", await resp.text())
-            await asyncio.sleep(suivi_update_interval)
+    async def start_update_suivi(self, get_position_function, suivi_update_interval=SUIVI_UPDATE_INTERVAL, tid = None, max_in_flight=POSITION_MAX_IN_FLIGHT, request_timeout=POSITION_REQUEST_TIMEOUT):
+        """Échantillonne la position à période fixe et la publie sans attendre les réponses.
+
+        Seule la position la plus récente non envoyée est gardée (les suivantes la
+        remplacent, comptées dans `coalesced`) ; une tâche d'envoi la poste avec au plus
+        `max_in_flight` requêtes en cours, chacune limitée à `request_timeout` secondes.
+        Une position remplacée alors que l'envoi est retenu (attente après erreur, ou
+        `max_in_flight` requêtes en cours), ou encore en attente à l'arrêt, est comptée
+        dans `dropped` ; `failed` compte les envois tentés sans succès.
+        La fraîcheur côté serveur de suivi reste bornée par la période d'échantillonnage.
+        """
+        team = "" if tid is None else f" as team {tid}"
+        print(f"Starting location updates every {suivi_update_interval} seconds to {self.base_url}{team}")
+        self.send_position = True
+        self._pending_position = None
+        self._position_backoff = 0.0
+        self._position_retry_at = 0.0
+        self._position_slots = asyncio.Semaphore(max_in_flight)
+        sender = asyncio.create_task(self._position_sender(tid, max_in_flight, request_timeout, suivi_update_interval))
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        try:
+            while self.send_position:
+                position = get_position_function()
+                self.position_metrics["sampled"] += 1
+                if self.recorder is not None:
+                    self.recorder.position(*position)
+                if self._pending_position is not None:
+                    self.position_metrics["coalesced"] += 1
+                    if self._position_retry_at > loop.time() or self._position_slots.locked():
+                        self.position_metrics["dropped"] += 1
+                self._pending_position = position
+                self._position_ready.set()
+                # cadence fixe : on vise l'échéance suivante, sans accumuler de retard
+                next_tick += suivi_update_interval
+                delay = next_tick - loop.time()
+                if delay < 0:
+                    next_tick = loop.time()
+                    delay = 0
+                await asyncio.sleep(delay)
+        finally:
+            sender.cancel()
+            if self._pending_position is not None:
+                self.position_metrics["dropped"] += 1
+                self._pending_position = None
         print("Stopping location updates")
 
+    async def _position_sender(self, tid, max_in_flight, request_timeout, suivi_update_interval):
+        slots = self._position_slots
+        in_flight = set()
+        try:
+            while True:
+                await self._position_ready.wait()
+                self._position_ready.clear()
+                await slots.acquire()
+                delay = self._position_retry_at - asyncio.get_running_loop().time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # on prend la position la plus fraîche au moment d'envoyer
+                position = self._pending_position
+                self._pending_position = None
+                if position is None:
+                    slots.release()
+                    continue
+                task = asyncio.create_task(self._post_position(position, tid, request_timeout, suivi_update_interval))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def _post_position(self, position, tid, request_timeout, suivi_update_interval):
+        x, y = position
+        params = {"x": x, "y": y}
+        if tid is not None:
+            params["t"] = tid
+        started = time.monotonic()
+        try:
+            async with self.session.post(f"{self.base_url}/api/pos", params=params, timeout=web.ClientTimeout(total=request_timeout)) as resp:
+                ok = await self.http_status_handler(resp.status, "Position update", await resp.text())
+                status = resp.status
+        except (asyncio.TimeoutError, web.ClientError) as e:
+            traceLog.warning("suivi", "Position update failed: %r", e)
+            ok, status = False, None
+        self._observe(status, started)
+        if ok:
+            self.position_metrics["sent"] += 1
+            self._position_backoff = 0.0
+            return
+        self.position_metrics["failed"] += 1
+        if status is None or status >= 500:
+            # serveur indisponible (5xx/503) ou injoignable : on espace les envois
+            self._position_backoff = min(max(2 * self._position_backoff, suivi_update_interval), POSITION_BACKOFF_MAX)
+            self._position_retry_at = asyncio.get_running_loop().time() + self._position_backoff
+
+    async def get_position_metrics(self):
+        return dict(self.position_metrics)
+
     async def stop_update_suivi(self):
         self.send_position = False
 
+    async def _read_json(self, path, context, params=None):
+        started = time.monotonic()
+        try:
+            async with self.session.get(f"{self.base_url}{path}", params=params) as resp:
+                body = await resp.text()
+        except (asyncio.TimeoutError, web.ClientError):
+            self._observe(None, started)
+            raise
+        self._observe(resp.status, started)
+        if await self.http_status_handler(resp.status, context, body):
+            return json.loads(body)
+        else:
+            return None
+
+    async def _post(self, path, context, params=None):
+        started = time.monotonic()
+        try:
+            async with self.session.post(f"{self.base_url}{path}", params=params) as resp:
+                body = await resp.text()
+        except (asyncio.TimeoutError, web.ClientError):
+            self._observe(None, started)
+            raise
+        self._observe(resp.status, started)
+        return await self.http_status_handler(resp.status, context, body)
+
     async def get_flags(self):
-        async with self.session.get(f"{self.suivi_server_url}/api/list:{self.suivi_server_port}") as resp:
-            body = await resp.text()
-            if self.http_status_handler(await resp.status, "Flags retrieval", body):
-                return json.loads(body)
-            else:
-                return None
+        return await self.cache.get(("flags",), lambda: self._read_json("/api/list", "Flags retrieval"))
         
     async def capture_flag(self, mid, msec, minner, tid=None, wait=True):
-        t = "" if tid is None else f"&t={tid}"
-        async with self.session.post(f"{self.suivi_server_url}/api/marker?id={mid}&sector={msec}&inner={minner}{t}:{self.suivi_server_port}") as resp:
-            if wait:
-                return self.http_status_handler(await resp.status, "Flag capture", await resp.text())
-            else: 
-                return None
+        params = {"id": mid, "sector": msec, "inner": minner}
+        if tid is not None:
+            params["t"] = tid
+        if not wait:
+            task = asyncio.create_task(self._post("/api/marker", "Flag capture", params))
+            self._background.add(task)
+            task.add_done_callback(self._capture_done)
+            return None
+        try:
+            return await self._post("/api/marker", "Flag capture", params)
+        finally:
+            self.cache.invalidate("flags")
+
+    def _capture_done(self, task):
+        self._background.discard(task)
+        self.cache.invalidate("flags")
+        if not task.cancelled() and task.exception() is not None:
+            traceLog.warning("suivi", "Flag capture failed: %r", task.exception())
 
     async def get_race_status(self):
-        async with self.session.get(f"{self.suivi_server_url}/api/status:{self.suivi_server_port}") as resp:
-            body =  await resp.text()
-            if self.http_status_handler(await resp.status, "Race status retrieval", body):
-                return json.loads(body)
-            else:
-                return None
+        return await self.cache.get(("race_status",), lambda: self._read_json("/api/status", "Race status retrieval"))
 
     async def write_register(self, rid, val, tid = None):
-        t = "" if tid is None else f"&t={tid}"
-        async with self.session.post(f"{self.suivi_server_url}/api/udta?idx={rid}&all={val}{t}:{self.suivi_server_port}") as resp:
-            return self.http_status_handler(await resp.status, "Register write", await resp.text())
+        params = {"idx": rid, "all": val}
+        if tid is not None:
+            params["t"] = tid
+        try:
+            return await self._post("/api/udta", "Register write", params)
+        finally:
+            self.cache.invalidate("register", rid)
 
     async def read_register(self, rid, team = None):
-        t = "" if team is None else f"&t={team}"
-        async with self.session.get(f"{self.suivi_server_url}/api/udta?idx={rid}{t}:{self.suivi_server_port}") as resp:
-            body = await resp.text()
-            if self.http_status_handler(await resp.status, "Register read", body):
-                return json.loads(body)
-            else:
-                return None
+        params = {"idx": rid}
+        if team is not None:
+            params["t"] = team
+        return await self.cache.get(("register", rid, team), lambda: self._read_json("/api/udta", "Register read", params))
 
     async def launch_race(self):
-        async with self.session.post(f"{self.suivi_server_url}/api/start:{self.suivi_server_port}") as resp:
-            return self.http_status_handler(await resp.status, "Race launch", await resp.text())
+        try:
+            return await self._post("/api/start", "Race launch")
+        finally:
+            self.cache.invalidate("race_status")
+            self.cache.invalidate("flags")
 
     async def stop_race(self):
-        async with self.session.post(f"{self.suivi_server_url}/api/stop:{self.suivi_server_port}") as resp:
-            return self.http_status_handler(await resp.status, "Race stop", await resp.text())
+        try:
+            return await self._post("/api/stop", "Race stop")
+        finally:
+            self.cache.invalidate("race_status")
+            self.cache.invalidate("flags")
 
     async def select_flag_pattern(self, n):
-        async with self.session.post(f"{self.suivi_server_url}/api/pattern?idx={n}:{self.suivi_server_port}") as resp:
-            return self.http_status_handler(await resp.status, "Flag pattern selection", await resp.text())
+        try:
+            return await self._post("/api/pattern", "Flag pattern selection", {"idx": n})
+        finally:
+            self.cache.invalidate("flag_pattern")
+            self.cache.invalidate("flags")
 
     async def get_flag_pattern(self):
-        async with self.session.get(f"{self.suivi_server_url}/api/pattern:{self.suivi_server_port}") as resp:
-            body = await resp.text()
-            if self.http_status_handler(await resp.status, "Flag pattern retrieval", body):
-                return json.loads(body)
-            else:
-                return None
-        
+        return await self.cache.get(("flag_pattern",), lambda: self._read_json("/api/pattern", "Flag pattern retrieval"))
+
+    async def batch(self, calls, max_concurrency=BATCH_CONCURRENCY):
+        """Lance plusieurs opérations en parallèle et renvoie leurs résultats dans l'ordre.
+
+        `calls` est une liste de tuples (opération, *arguments), l'opération étant
+        une de BATCH_OPERATIONS, ex. [("read_register", 0), ("read_register", 1), ("get_race_status",)].
+        Au plus `max_concurrency` requêtes sont en cours à la fois ; le tout dure à peu
+        près l'aller-retour le plus lent plutôt que leur somme. Une opération qui échoue
+        donne son exception à la place de son résultat, sans annuler les autres.
+        """
+        for name, *_ in calls:
+            if name not in BATCH_OPERATIONS:
+                raise ValueError(f"{name!r} is not a batch operation (one of {', '.join(BATCH_OPERATIONS)})")
+        slots = asyncio.Semaphore(max_concurrency)
 
+        async def run(name, *args):
+            async with slots:
+                return await getattr(self, name)(*args)
+        return await asyncio.gather(*(run(*call) for call in calls), return_exceptions=True)
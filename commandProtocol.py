@@ -0,0 +1,57 @@
+import struct
+
+# Trame binaire de commande, taille fixe (22 octets, little-endian) :
+#   type (uint8), drapeaux (uint8), séquence (uint32), horodatage client en ms (float64), x, y (float32)
+FRAME = struct.Struct("<BBIdff")
+MSG_COMMAND = 1
+MSG_TOGGLE = 2
+FLAG_CLOCK_SYNCED = 0x01  # horodatage déjà recalé sur l'horloge monotone du serveur
+
+PROTOCOL_BINARY = "bin1"
+PROTOCOL_JSON = "json"
+SUPPORTED_PROTOCOLS = (PROTOCOL_BINARY, PROTOCOL_JSON)  # par ordre de préférence
+
+STALE_AFTER_MS = 250.0  # une commande plus vieille que ça (délai minimal observé déduit) est ignorée
+
+
+def negotiate(offered) -> str:
+    """Pick the preferred protocol among those offered by the client, JSON by default."""
+    for protocol in SUPPORTED_PROTOCOLS:
+        if offered and protocol in offered:
+            return protocol
+    return PROTOCOL_JSON
+
+
+def decode(data):
+    """Return (type, flags, seq, timestamp_ms, x, y) from a binary frame; raises struct.error if too short."""
+    return FRAME.unpack_from(data)
+
+
+class commandFilter:
+    """Rejette, pour une connexion, les commandes dupliquées, hors d'ordre ou périmées.
+
+    Les horloges client et serveur ne sont pas alignées : on garde le plus petit
+    écart (réception serveur - horodatage client) observé comme référence, et une
+    commande est périmée si son écart dépasse cette référence de `stale_after_ms`.
+    """
+    def __init__(self, stale_after_ms=STALE_AFTER_MS):
+        self.stale_after_ms = stale_after_ms
+        self.last_seq = None
+        self.min_delay = None
+        self.out_of_order = 0
+        self.stale = 0
+
+    def accept(self, seq, timestamp_ms, now_ms, check_stale=True) -> bool:
+        if self.last_seq is not None:
+            ahead = (seq - self.last_seq) & 0xFFFFFFFF
+            if ahead == 0 or ahead >= 0x80000000:
+                self.out_of_order += 1
+                return False
+        self.last_seq = seq
+        delay = now_ms - timestamp_ms
+        if self.min_delay is None or delay < self.min_delay:
+            self.min_delay = delay
+        if check_stale and delay - self.min_delay > self.stale_after_ms:
+            self.stale += 1
+            return False
+        return True
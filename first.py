@@ -14,40 +14,69 @@ except Exception:
 	websockets = None
 
 # Shared container holding only the most recent command.
-# Access protected by latest_cmd_lock.
+# Access protected by latest_cmd_lock; latest_cmd_cond wakes the worker when a new command is stored.
 latest_cmd = {'type': None, 'val': None}
+latest_cmd_version = 0  # incremented on every stored command
 latest_cmd_lock = threading.Lock()
+latest_cmd_cond = threading.Condition(latest_cmd_lock)
+
+
+def post_command(cmd_type, cmd_val):
+	"""Store the latest command (overwriting any unprocessed one) and wake the worker."""
+	global latest_cmd_version
+	with latest_cmd_cond:
+		latest_cmd['type'] = cmd_type
+		latest_cmd['val'] = cmd_val
+		latest_cmd_version += 1
+		latest_cmd_cond.notify()
+
+
+def load_index():
+	# index.html est lu une seule fois au démarrage puis servi depuis la mémoire
+	try:
+		with open('index.html', 'rb') as file:
+			return file.read()
+	except OSError as e:
+		print('Cannot read index.html:', e)
+		return None
+
+INDEX_HTML = load_index()
 
 # Classe permettant de gérer les requêtes HTTP. Elle étend la classe SimpleHTTPRequestHandler utilisée par le serveur HTTP
 class GestionnaireRequetes(http.server.SimpleHTTPRequestHandler):
+	# HTTP/1.1 : la connexion reste ouverte entre deux commandes (keep-alive)
+	protocol_version = 'HTTP/1.1'
+
 	def _set_headers(self, code):
 		self.send_response(code)
+		self.send_header('Content-Length', '0')
 		self.end_headers()
 
 	# traitement d'une requete GET: ici seul "/index.html" (ou "/") est traité, toute autre requète répond 404
 	# do_GET est une methode de la classe SimpleHTTPRequestHandler que nous surchargeons (remplaçons) ici
 	def do_GET(self):
 		if self.path == '/' or self.path == '' or self.path.startswith('/index'):
-			try:
-				self.send_response(200)
-				self.send_header('Content-type', 'text/html')
-				self.end_headers()
-
-				# Lire le contenu du fichier index.html
-				with open('index.html', 'rb') as file:
-					html_content = file.read()
-
-				# Mettre le fichier lu comme corps de la réponse
-				self.wfile.write(html_content)
-			# erreur de lecture, on renvoi un code "server error" au client
-			except:
+			# fichier illisible au démarrage, on renvoi un code "server error" au client
+			if INDEX_HTML is None:
 				self._set_headers(500)
+				return
+			self.send_response(200)
+			self.send_header('Content-type', 'text/html')
+			self.send_header('Content-Length', str(len(INDEX_HTML)))
+			self.end_headers()
+			# contenu de index.html gardé en mémoire comme corps de la réponse
+			self.wfile.write(INDEX_HTML)
 		else:
 			self._set_headers(404)
 
 	# traitement d'une requete POST: on stocke uniquement la dernière commande reçue et on répond immédiatement
 	# do_POST est une methode de la classe SimpleHTTPRequestHandler que nous surchargeons (remplaçons) ici
 	def do_POST(self):
+		# vider un éventuel corps pour que la requête suivante soit lue correctement sur la même connexion
+		length = int(self.headers.get('Content-Length') or 0)
+		if length:
+			self.rfile.read(length)
+
 		# If websockets support is available, prefer WebSocket transport and reject POST commands.
 		if websockets is not None:
 			self._set_headers(405)
@@ -61,9 +90,7 @@ class GestionnaireRequetes(http.server.SimpleHTTPRequestHandler):
 				cmd_type = params['type'][0]
 				user_val = int(params['val'][0])
 				# store latest command atomically and return quickly to avoid queueing
-				with latest_cmd_lock:
-					latest_cmd['type'] = cmd_type
-					latest_cmd['val'] = user_val
+				post_command(cmd_type, user_val)
 				# respond immediately: the background worker will process the latest_cmd
 				self._set_headers(200)
 			except Exception as e:
@@ -75,16 +102,22 @@ class GestionnaireRequetes(http.server.SimpleHTTPRequestHandler):
 
 
 def command_worker(stop_event):
-	"""Background thread that continuously checks for the latest command and processes only the most recent one.
-	This avoids building a queue of commands when POST requests arrive faster than they can be processed.
+	"""Background thread that sleeps until a new command is stored and processes only the most recent one.
+	This avoids building a queue of commands when POST requests arrive faster than they can be processed,
+	and uses no CPU while idle.
 	"""
 	last_processed = (None, None)
+	seen_version = 0
 	while not stop_event.is_set():
-		# capture and clear the latest command atomically
-		with latest_cmd_lock:
+		# wait for a new command, then capture it atomically
+		with latest_cmd_cond:
+			latest_cmd_cond.wait_for(lambda: latest_cmd_version != seen_version or stop_event.is_set())
+			if stop_event.is_set():
+				break
+			seen_version = latest_cmd_version
 			cmd_type = latest_cmd.get('type')
 			cmd_val = latest_cmd.get('val')
-			# do not clear here; keep the command until processed to avoid losing it if worker is busy
+			# do not clear here; commands arriving while we process are picked up on the next wakeup
 		if cmd_type is not None:
 			# if same as last processed, skip to avoid repeated processing
 			if (cmd_type, cmd_val) != last_processed:
@@ -101,16 +134,19 @@ def command_worker(stop_event):
 			# no command: reset last_processed so a future identical command will be processed
 			last_processed = (None, None)
 
-		# sleep a short while to avoid busy loop; tune as needed
-		#time.sleep(0.02)
+
+def stop_worker():
+	stop_event.set()
+	with latest_cmd_cond:
+		latest_cmd_cond.notify_all()
 
 
 # Créer un objet de la classe GestionnaireRequetes
 mon_gestionnaire = GestionnaireRequetes
 
-# créer un serveur HTTP sur le port 8080
+# créer un serveur HTTP sur le port 8080 ; un thread par connexion pour qu'un client lent ne bloque pas les autres
 PORT = 8080
-httpd = http.server.HTTPServer(("", PORT), mon_gestionnaire)
+httpd = http.server.ThreadingHTTPServer(("", PORT), mon_gestionnaire)
 
 # démarrer le worker en arrière-plan
 stop_event = threading.Event()
@@ -135,9 +171,7 @@ async def ws_handler(websocket, path=None):
 				cmd_val = int(data.get('val', 0))
 				# Log parsed command
 				print(f'WS parsed command: type={cmd_type} val={cmd_val}')
-				with latest_cmd_lock:
-					latest_cmd['type'] = cmd_type
-					latest_cmd['val'] = cmd_val
+				post_command(cmd_type, cmd_val)
 			except Exception as e:
 				# ignore malformed single messages but keep connection alive
 				print('WS message error:', e)
@@ -177,6 +211,6 @@ try:
 	httpd.serve_forever()
 except KeyboardInterrupt:
 	print('Stopping server...')
-	stop_event.set()
+	stop_worker()
 	httpd.shutdown()
 	worker_thread.join()
\ No newline at end of file
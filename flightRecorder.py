@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import collections
+import heapq
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import telemetryHistory
+
+# Enregistreur de vol : commandes, toggles, positions et télémétrie dans un journal binaire.
+# Désactivé par défaut : webAPI(recorder_dir=flightRecorder.RECORDER_DIR) l'active.
+#   py flightRecorder.py dump flights/20261018-142501
+#   py flightRecorder.py replay flights/20261018-142501 --speed 4 --output replay.json
+# Chaque processus (webAPI, serveur web) écrit ses propres segments dans le dossier
+# de l'enregistrement ; la lecture les fusionne par date.
+
+RECORDER_DIR = "flights"  # dossier racine des enregistrements (un sous-dossier par démarrage de webAPI)
+RECORDER_KEEP = 10  # enregistrements gardés dans le dossier racine ; les plus anciens sont supprimés
+SEGMENT_RECORDS = 65536  # enregistrements par fichier segment (2 Mio)
+FLUSH_INTERVAL = 0.05  # période d'écriture du thread d'écriture (s)
+QUEUE_LIMIT = 65536  # enregistrements en attente au-delà desquels les nouveaux sont perdus (comptés)
+
+KIND_COMMAND = 1  # a, b = x, y
+KIND_TOGGLE = 2
+KIND_POSITION = 3  # a, b = x, y envoyés au serveur de suivi
+KIND_TELEMETRY = 4  # field = identifiant du champ (cf. <source>.fields.json), a = valeur
+KINDS = {KIND_COMMAND: "command", KIND_TOGGLE: "toggle", KIND_POSITION: "position", KIND_TELEMETRY: "telemetry"}
+
+MAGIC = b"P103FLT1"
+HEADER = struct.Struct("<8sII")  # magique, taille d'un enregistrement, nombre d'enregistrements écrits
+RECORD = struct.Struct("<qBBHIdd")  # date (ns depuis l'epoch), type, transport, session, champ, a, b
+
+flightRecord = collections.namedtuple("flightRecord", "t_ns kind transport session field a b source")
+
+
+class flightRecorder:
+    """Journal binaire à enregistrements fixes (RECORD, 32 octets), écrit en arrière-plan.
+
+    Les appels (command, toggle, position, telemetry) ne font qu'ajouter un tuple à
+    une deque : un thread d'écriture les range toutes les `flush_interval` secondes
+    dans des fichiers segments de `segment_records` enregistrements, projetés en
+    mémoire (mmap), et met à jour le compteur d'en-tête après chaque lot. Un
+    segment plein est fermé et le suivant créé ; à la fermeture, le dernier est
+    tronqué à sa partie écrite. Un processus qui s'arrête brutalement laisse un
+    journal lisible jusqu'au dernier lot.
+    `source` préfixe les fichiers ("api", "server") : un écrivain par source.
+    """
+    def __init__(self, path : str, source : str, segment_records=SEGMENT_RECORDS, flush_interval=FLUSH_INTERVAL, queue_limit=QUEUE_LIMIT) -> None:
+        self.path = path
+        self.source = source
+        self.segment_records = segment_records
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        os.makedirs(path, exist_ok=True)
+        self.queue = collections.deque()
+        self.fields = load_fields(path, source)
+        self._field_names = sorted(self.fields, key=self.fields.get)  # ordre des identifiants, en ajout seul
+        self._fields_written = len(self._field_names)
+        self.recorded = 0
+        self.dropped = 0
+        self.segments = 0
+        # un redémarrage (du serveur web par exemple) continue la numérotation
+        self._index = len(_segment_files(path, source))
+        self._mm = None
+        self._file = None
+        self._count = 0
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"flightRecorder-{source}", daemon=True)
+        self.thread.start()
+
+    def record(self, kind, a=math.nan, b=math.nan, transport=0, session=0, field=0):
+        if len(self.queue) >= self.queue_limit:
+            self.dropped += 1
+            return
+        self.queue.append((time.time_ns(), kind, transport, session, field, a, b))
+
+    def command(self, x, y, transport_id=0, session_id=0):
+        self.record(KIND_COMMAND, x, y, transport_id, session_id)
+
+    def toggle(self, transport_id=0, session_id=0):
+        self.record(KIND_TOGGLE, transport=transport_id, session=session_id)
+
+    def position(self, x, y):
+        self.record(KIND_POSITION, x, y)
+
+    def telemetry(self, metric : str, document):
+        """Record each numeric field of `document` (see telemetryHistory.flatten) as one record."""
+        for name, value in telemetryHistory.flatten(document).items():
+            name = f"{metric}.{name}"
+            field = self.fields.get(name)
+            if field is None:
+                field = self.fields[name] = len(self._field_names)
+                self._field_names.append(name)
+            self.record(KIND_TELEMETRY, value, field=field)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _open_segment(self):
+        filename = os.path.join(self.path, f"{self.source}-{self._index:04d}.rec")
+        self._index += 1
+        self.segments += 1
+        self._file = open(filename, "w+b")
+        self._file.truncate(HEADER.size + RECORD.size * self.segment_records)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        self._count = 0
+        HEADER.pack_into(self._mm, 0, MAGIC, RECORD.size, 0)
+
+    def _close_segment(self):
+        self._mm.close()
+        self._file.truncate(HEADER.size + RECORD.size * self._count)
+        self._file.close()
+        self._mm = None
+        self._file = None
+
+    def _flush(self):
+        if len(self._field_names) != self._fields_written:
+            names = self._field_names[:]
+            with open(os.path.join(self.path, f"{self.source}.fields.json"), "w") as f:
+                json.dump(names, f)
+            self._fields_written = len(names)
+        queue = self.queue
+        while queue:
+            if self._mm is None or self._count == self.segment_records:
+                if self._mm is not None:
+                    self._close_segment()
+                self._open_segment()
+            start = self._count
+            while queue and self._count < self.segment_records:
+                RECORD.pack_into(self._mm, HEADER.size + RECORD.size * self._count, *queue.popleft())
+                self._count += 1
+            HEADER.pack_into(self._mm, 0, MAGIC, RECORD.size, self._count)
+            self.recorded += self._count - start
+
+    def stats(self) -> dict:
+        return {"path": self.path, "recorded": self.recorded, "dropped": self.dropped, "pending": len(self.queue), "segments": self.segments}
+
+    def close(self):
+        self._stop.set()
+        self.thread.join()
+        if self._mm is not None:
+            self._close_segment()
+
+
+def _segment_files(path, source):
+    prefix = f"{source}-"
+    return sorted(name for name in os.listdir(path) if name.startswith(prefix) and name.endswith(".rec"))
+
+
+def load_fields(path, source) -> dict:
+    """Telemetry field ids of `source`: {"energy_data.voltage": 0, ...}."""
+    try:
+        with open(os.path.join(path, f"{source}.fields.json")) as f:
+            return {name: i for i, name in enumerate(json.load(f))}
+    except FileNotFoundError:
+        return {}
+
+
+def read_segment(filename, source=None):
+    with open(filename, "rb") as f:
+        data = f.read()
+    magic, size, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or size != RECORD.size:
+        raise ValueError(f"{filename} is not a flight recorder segment")
+    # un segment interrompu peut annoncer plus d'enregistrements que le fichier n'en contient
+    count = min(count, (len(data) - HEADER.size) // RECORD.size)
+    for record in RECORD.iter_unpack(data[HEADER.size:HEADER.size + RECORD.size * count]):
+        yield flightRecord(*record, source)
+
+
+def sources(path):
+    return sorted({name.rsplit("-", 1)[0] for name in os.listdir(path) if name.endswith(".rec")})
+
+
+def read(path, kinds=None):
+    """All records of the recording in `path`, every source merged by date."""
+    def _source(source):
+        for name in _segment_files(path, source):
+            yield from read_segment(os.path.join(path, name), source)
+    for record in heapq.merge(*(_source(s) for s in sources(path)), key=lambda r: r.t_ns):
+        if kinds is None or record.kind in kinds:
+            yield record
+
+
+def recordings(root=RECORDER_DIR) -> list:
+    """Recording directories under `root`, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    return [os.path.join(root, name) for name in sorted(os.listdir(root)) if os.path.isdir(os.path.join(root, name))]
+
+
+def latest(root=RECORDER_DIR):
+    """Most recent recording directory under `root`."""
+    paths = recordings(root)
+    if not paths:
+        raise FileNotFoundError(f"no recording in {root}")
+    return paths[-1]
+
+
+def prune(root=RECORDER_DIR, keep=RECORDER_KEEP):
+    """Delete the oldest recordings under `root` so that at most `keep` remain."""
+    paths = recordings(root)
+    for path in paths[:max(0, len(paths) - keep)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+async def replay(api, path, speed=1.0, kinds=(KIND_COMMAND, KIND_TOGGLE)):
+    """Feed the recorded commands and toggles back to `api` (a started webAPI), on its loop.
+
+    They go through the same mailboxes as live traffic, so command_worker and
+    toggle_worker apply them to api.main_application. `speed` scales the recorded
+    pace (2.0: twice as fast); 0 sends them back to back. Commands closer than the
+    worker's wakeup are coalesced by the mailbox, exactly as live traffic. The web
+    server must not receive commands meanwhile (one writer per mailbox).
+    """
+    loop = asyncio.get_running_loop()
+    counts = {KINDS[k]: 0 for k in kinds}
+    start, first = loop.time(), None
+    for record in read(path, kinds):
+        if first is None:
+            first = record.t_ns
+        if speed > 0:
+            delay = start + (record.t_ns - first) / 1e9 / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if record.kind == KIND_COMMAND:
+            now_ns = time.monotonic_ns()
+            api.command_mailbox.put(record.a, record.b, record.transport, 0, now_ns, now_ns)
+        elif record.kind == KIND_TOGGLE:
+            api.toggle_mailbox.put()
+        counts[KINDS[record.kind]] += 1
+        if speed <= 0:
+            await asyncio.sleep(0)  # laisse command_worker lire chaque commande
+    counts["duration_s"] = loop.time() - start
+    return counts
+
+
+def summary(path) -> dict:
+    counts = collections.Counter()
+    first = last = None
+    for record in read(path):
+        counts[KINDS.get(record.kind, record.kind)] += 1
+        first = record.t_ns if first is None else first
+        last = record.t_ns
+    return {
+        "path": path,
+        "sources": sources(path),
+        "records": dict(counts),
+        "start": None if first is None else time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(first / 1e9)),
+        "duration_s": None if first is None else (last - first) / 1e9,
+    }
+
+
+def dump(path):
+    names = {source: sorted(fields := load_fields(path, source), key=fields.get) for source in sources(path)}
+    for r in read(path):
+        kind = KINDS.get(r.kind, r.kind)
+        detail = ""
+        if r.kind in (KIND_COMMAND, KIND_POSITION):
+            detail = f"x={r.a:.3f} y={r.b:.3f}"
+        elif r.kind == KIND_TELEMETRY:
+            source_names = names[r.source]
+            detail = f"{source_names[r.field] if r.field < len(source_names) else r.field}={r.a}"
+        if r.kind in (KIND_COMMAND, KIND_TOGGLE):
+            detail += f" transport={r.transport} session={r.session}"
+        print(f"{r.t_ns / 1e9:.6f} {r.source:<6} {kind:<9} {detail}")
+
+
+def run_replay(args):
+    import API
+    import benchControl
+    app = benchControl.stubApplication()
+    api = API.webAPI(host="127.0.0.1", port=args.port, main_application=app, video_source=None, recorder_dir=None)
+    api.start()
+    try:
+        time.sleep(0.5)  # démarrage de la boucle et des workers
+        counts = asyncio.run_coroutine_threadsafe(replay(api, args.path, args.speed), api.loop).result()
+        time.sleep(0.1)
+        report = api.latency.report()
+    finally:
+        api.close()
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "command")},
+        "replayed": counts,
+        "delivered": app.movement.calls,
+        "toggles": app.movement.toggles,
+        "latency_ms": report,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or replay a flight recording")
+    commands = parser.add_subparsers(dest="command", required=True)
+    subparsers = {}
+    for name, help in (("summary", "record counts and duration"), ("dump", "one line per record"), ("replay", "feed the recorded commands to a webAPI")):
+        subparsers[name] = commands.add_parser(name, help=help)
+        subparsers[name].add_argument("path", nargs="?", default=None, help=f"recording directory (default: latest in {RECORDER_DIR}/)")
+    replay_parser = subparsers["replay"]
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 for as fast as possible")
+    replay_parser.add_argument("--port", type=int, default=8091)
+    replay_parser.add_argument("--output", default=None, help="write the JSON result to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.path = args.path or latest()
+    match args.command:
+        case "summary":
+            print(json.dumps(summary(args.path), indent=2))
+        case "dump":
+            dump(args.path)
+        case "replay":
+            result = run_replay(args)
+            text = json.dumps(result, indent=2)
+            if args.output:
+                with open(args.output, "w") as f:
+                    f.write(text)
+            print(text)
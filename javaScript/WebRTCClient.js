@@ -1,3 +1,6 @@
+import { mergeTelemetry } from "./WebSocketClient.js";
+import { commandEncoder, KEEPALIVE_MS } from "./commandProtocol.js";
+
 const USING_STUN = true;
 
 const DEFAULT_PUBLIC_STUN = [
@@ -15,6 +18,9 @@ class webRTCClient {
 		this.dc = null;
 		this.dcReady = null;
 		this._sendBuffer = [];
+		this.telemetry = {};
+		this.onTelemetry = null;
+		this.encoder = new commandEncoder();
 		// ready est une Promise résolue quand la négociation est terminée
 		this.ready = this._init();
 	}
@@ -42,10 +48,19 @@ class webRTCClient {
 		return await res.json();
 	}
 
+	// négocie le format des commandes (binaire si le serveur l'accepte, sinon JSON)
+	async negotiateProtocol() {
+		await this.dcReady;
+		const protocol = await this.encoder.negotiate((text) => this.dc.send(text));
+		// recale l'horloge sur le serveur pour tracer la latence de bout en bout
+		await this.encoder.syncClock((text) => this.dc.send(text));
+		return protocol;
+	}
+
 	// méthode publique pour envoyer des commandes
 	sendCommand(x, y) {
 		let msg;
-		try { msg = JSON.stringify({ 'x': x, 'y': y, 'type'	: "command" }); } catch (e) { console.warn('Failed to serialize command', e); return false; }
+		try { msg = this.encoder.command(x, y); } catch (e) { console.warn('Failed to serialize command', e); return false; }
 		if (this.dc && this.dc.readyState === 'open') {
 			try { this.dc.send(msg); return true; } catch (e) { console.warn('Send failed', e); return false; }
 		} else { 
@@ -54,10 +69,50 @@ class webRTCClient {
 		}
 	}
 
+	// abonnement à la télémétrie poussée par le serveur sur le DataChannel
+	subscribeTelemetry(onUpdate, metrics = null, maxRate = 10) {
+		this.onTelemetry = onUpdate;
+		const msg = { 'type': "subscribe", 'max_rate': maxRate };
+		if (metrics) msg.metrics = metrics;
+		return this._sendJson(msg);
+	}
+
+	unsubscribeTelemetry() {
+		this.onTelemetry = null;
+		return this._sendJson({ 'type': "unsubscribe" });
+	}
+
+	// une seule session pilote à la fois ; les autres observent (télémétrie, vidéo)
+	claimControl(force = false) {
+		return this._sendJson({ 'type': "control", 'action': "claim", 'force': force });
+	}
+
+	releaseControl() {
+		return this._sendJson({ 'type': "control", 'action': "release" });
+	}
+
+	_sendJson(obj) {
+		if (this.dc && this.dc.readyState === 'open') {
+			try { this.dc.send(JSON.stringify(obj)); return true; } catch (e) { console.warn('Send failed', e); return false; }
+		}
+		console.warn('DataChannel not open');
+		return false;
+	}
+
+	_handleMessage(data) {
+		let msg;
+		try { msg = JSON.parse(data); } catch (e) { return; }
+		if (this.encoder.handleReply(msg)) return;
+		if (msg.type === 'telemetry') {
+			mergeTelemetry(this.telemetry, msg.data);
+			if (this.onTelemetry) this.onTelemetry(this.telemetry);
+		}
+	}
+
 	toggleCommands() {
 		this.mode = this.mode === 'manual' ? 'automatic' : 'manual';
 		let msg;
-		try { msg = JSON.stringify({ 'type': "toggle_commands" }); } catch (e) { console.warn('Failed to serialize toggle command', e); return false; }
+		try { msg = this.encoder.toggle(); } catch (e) { console.warn('Failed to serialize toggle command', e); return false; }
 		if (this.dc && this.dc.readyState === 'open') {
 			try { this.dc.send(msg); return true; } catch (e) { console.warn('Send failed', e); return false; }
 		} else { 
@@ -74,12 +129,27 @@ class webRTCClient {
 			const pcConfig = { iceServers };
 			this.pc = USING_STUN ? new RTCPeerConnection(pcConfig) : new RTCPeerConnection();
 
+			// retour vidéo facultatif : on ne fait que recevoir la piste caméra du robot
+			const videoElement = this.options.videoElement;
+			if (videoElement) {
+				this.pc.addTransceiver('video', { direction: 'recvonly' });
+				this.pc.ontrack = (ev) => {
+					if (ev.track.kind !== 'video') return;
+					videoElement.srcObject = ev.streams[0] || new MediaStream([ev.track]);
+				};
+			}
+
 			// create data channel AFTER pc created
 			this.dc = this.pc.createDataChannel('commands');
 			this.dcReady = new Promise((resolve, reject) =>{
 			this.dc.onopen = () => resolve();
 			this.dc.onerror = (err) => reject(err);
 			});
+			this.dcReady.then(() => {
+				const keepalive = setInterval(() => this._sendJson({ 'type': "ping" }), KEEPALIVE_MS);
+				this.dc.addEventListener('close', () => clearInterval(keepalive));
+			}, () => {});
+			this.dc.onmessage = (ev) => this._handleMessage(ev.data);
 
 			const offer = await this.pc.createOffer();
 			await this.pc.setLocalDescription(offer);
@@ -1,3 +1,16 @@
+import { commandEncoder, KEEPALIVE_MS } from "./commandProtocol.js";
+
+// fusionne les deltas reçus dans l'état local de la télémétrie
+function mergeTelemetry(state, changes) {
+	for (const [metric, delta] of Object.entries(changes)) {
+		if (delta !== null && typeof delta === 'object' && !Array.isArray(delta) && state[metric] !== null && typeof state[metric] === 'object') {
+			Object.assign(state[metric], delta);
+		} else {
+			state[metric] = delta;
+		}
+	}
+}
+
 //--- début de la classe WebSocketClient ---------------------------------------
 class WebSocketClient {
 	constructor(url, opts = {}) {
@@ -8,6 +21,11 @@ class WebSocketClient {
 		this.state = 'closed'; // 'connecting','open','closed'
 		this.onOpen = opts.onOpen || (()=>{});
 		this.onError = opts.onError || ((e)=>{ console.warn('WS error', e); });
+		this.onClose = opts.onClose || (()=>{});
+		this.telemetry = {};
+		this.onTelemetry = null;
+		this.encoder = new commandEncoder();
+		this._keepalive = null;
 		this.connect();
 	}
 
@@ -36,26 +54,51 @@ class WebSocketClient {
 		// nouveau: gestion de l'ouverture -> état, callback et vidange du buffer
 		this.ws.onopen = (ev) => {
 			this.state = 'open';
+			clearInterval(this._keepalive);
+			this._keepalive = setInterval(() => this._sendRaw(this.encoder.ping()), KEEPALIVE_MS);
 		};
 
 		this.ws.onerror = (ev) => {
 			this._handleError(ev);
 		};
 
+		this.ws.onmessage = (ev) => {
+			this._handleMessage(ev.data);
+		};
+
 		this.ws.onclose = (ev) => {
 			this.state = 'closed';
+			clearInterval(this._keepalive);
 			this.onClose(ev);
 		};
 	}
 
+	// négocie le format des commandes (binaire si le serveur l'accepte, sinon JSON)
+	async negotiateProtocol() {
+		await this.ready;
+		const protocol = await this.encoder.negotiate((text) => this.ws.send(text));
+		// recale l'horloge sur le serveur pour tracer la latence de bout en bout
+		await this.encoder.syncClock((text) => this.ws.send(text));
+		return protocol;
+	}
+
 	// méthode publique pour envoyer des commandes
 	sendCommand(x, y) {
-		return this.send({ 'x': x, 'y': y, 'type'	: "command" });
+		return this._sendRaw(this.encoder.command(x, y));
 	}
 
 	toggleCommands() {
 		this.mode = this.mode === 'manual' ? 'automatic' : 'manual';
-		return this.send(JSON.stringify({ 'type': "toggle_commands" }));
+		return this._sendRaw(this.encoder.toggle());
+	}
+
+	// une seule session pilote à la fois ; les autres observent (télémétrie, vidéo)
+	claimControl(force = false) {
+		return this._sendRaw(this.encoder.claim(force));
+	}
+
+	releaseControl() {
+		return this._sendRaw(this.encoder.release());
 	}
 
 	async get_energy() {
@@ -71,6 +114,29 @@ class WebSocketClient {
 	}
 
 
+	// abonnement à la télémétrie poussée par le serveur (deltas, au plus maxRate messages/s)
+	subscribeTelemetry(onUpdate, metrics = null, maxRate = 10) {
+		this.onTelemetry = onUpdate;
+		const msg = { 'type': "subscribe", 'max_rate': maxRate };
+		if (metrics) msg.metrics = metrics;
+		return this.send(msg);
+	}
+
+	unsubscribeTelemetry() {
+		this.onTelemetry = null;
+		return this.send({ 'type': "unsubscribe" });
+	}
+
+	_handleMessage(data) {
+		let msg;
+		try { msg = JSON.parse(data); } catch (e) { return; }
+		if (this.encoder.handleReply(msg)) return;
+		if (msg.type === 'telemetry') {
+			mergeTelemetry(this.telemetry, msg.data);
+			if (this.onTelemetry) this.onTelemetry(this.telemetry);
+		}
+	}
+
 	send(obj) {
 		let msg;
 		try {
@@ -79,6 +145,11 @@ class WebSocketClient {
 			console.warn('WS send: failed to serialize', e);
 			return false;
 		}
+		return this._sendRaw(msg);
+	}
+
+	// envoie un message déjà encodé (texte JSON ou ArrayBuffer)
+	_sendRaw(msg) {
 		if (this.state === 'open' && this.ws && this.ws.readyState === WebSocket.OPEN) {
 			try {
 				this.ws.send(msg);
@@ -108,4 +179,4 @@ class WebSocketClient {
 // --- fin de la classe WebSocketClient ---------------------------------------
 
 // exportation de la classe pour usage en module
-export { WebSocketClient };
+export { WebSocketClient, mergeTelemetry };
@@ -0,0 +1,146 @@
+// Trame binaire de commande (cf. commandProtocol.py) : 22 octets little-endian
+//   type (uint8), drapeaux (uint8), séquence (uint32), horodatage client ms (float64), x, y (float32)
+const FRAME_SIZE = 22;
+const MSG_COMMAND = 1;
+const MSG_TOGGLE = 2;
+const FLAG_CLOCK_SYNCED = 0x01;
+const CLOCK_SAMPLES = 5;
+const PROTOCOL_BINARY = 'bin1';
+const PROTOCOL_JSON = 'json';
+const HELLO_TIMEOUT_MS = 500;
+// le serveur ferme les sessions muettes (sessions.IDLE_TIMEOUT = 30 s) : on le rassure régulièrement
+const KEEPALIVE_MS = 10000;
+
+// --- classe commandEncoder ------------------------------------------------------
+// construit les messages de commande selon le protocole négocié avec le serveur
+class commandEncoder {
+	constructor() {
+		this.protocol = PROTOCOL_JSON;
+		this.seq = 0;
+		this._helloResolve = null;
+		this._clockResolve = null;
+		// décalage entre performance.now() et l'horloge monotone du serveur (ms)
+		this.clockOffset = 0;
+		this.clockSynced = false;
+		// session attribuée par le serveur et session qui pilote le robot (une seule à la fois)
+		this.sessionId = null;
+		this.controller = null;
+		this.onControl = null;
+	}
+
+	isController() {
+		return this.sessionId !== null && this.controller === this.sessionId;
+	}
+
+	ping() {
+		return JSON.stringify({ 'type': "ping" });
+	}
+
+	// prend le contrôle s'il est libre (ou de force), ou le rend
+	claim(force = false) {
+		return JSON.stringify({ 'type': "control", 'action': "claim", 'force': force });
+	}
+
+	release() {
+		return JSON.stringify({ 'type': "control", 'action': "release" });
+	}
+
+	// horodatage dans le repère du serveur si l'horloge est synchronisée
+	_now() {
+		return performance.now() + this.clockOffset;
+	}
+
+	_nextSeq() {
+		this.seq = (this.seq + 1) >>> 0;
+		return this.seq;
+	}
+
+	_frame(type, x, y) {
+		const buf = new ArrayBuffer(FRAME_SIZE);
+		const view = new DataView(buf);
+		view.setUint8(0, type);
+		view.setUint8(1, this.clockSynced ? FLAG_CLOCK_SYNCED : 0);
+		view.setUint32(2, this._nextSeq(), true);
+		view.setFloat64(6, this._now(), true);
+		view.setFloat32(14, Number(x), true);
+		view.setFloat32(18, Number(y), true);
+		return buf;
+	}
+
+	command(x, y) {
+		if (this.protocol === PROTOCOL_BINARY) return this._frame(MSG_COMMAND, x, y);
+		return JSON.stringify({ 'x': x, 'y': y, 'type': "command", 'seq': this._nextSeq(), 'ts': this._now(), 'synced': this.clockSynced });
+	}
+
+	toggle() {
+		if (this.protocol === PROTOCOL_BINARY) return this._frame(MSG_TOGGLE, 0, 0);
+		return JSON.stringify({ 'type': "toggle_commands" });
+	}
+
+	// envoie le hello via `sendText` et attend la réponse du serveur ; JSON par défaut
+	async negotiate(sendText, timeoutMs = HELLO_TIMEOUT_MS) {
+		const reply = new Promise((resolve) => {
+			this._helloResolve = resolve;
+			setTimeout(() => resolve(PROTOCOL_JSON), timeoutMs);
+		});
+		try {
+			sendText(JSON.stringify({ 'type': "hello", 'protocols': [PROTOCOL_BINARY, PROTOCOL_JSON] }));
+		} catch (e) {
+			console.warn('Protocol negotiation failed, using JSON', e);
+			this._helloResolve = null;
+			return this.protocol;
+		}
+		this.protocol = await reply;
+		this._helloResolve = null;
+		return this.protocol;
+	}
+
+	// échanges {type: clock} façon NTP ; garde le décalage de l'aller-retour le plus court
+	async syncClock(sendText, samples = CLOCK_SAMPLES, timeoutMs = HELLO_TIMEOUT_MS) {
+		let best = null;
+		for (let i = 0; i < samples; i++) {
+			const reply = new Promise((resolve) => {
+				this._clockResolve = resolve;
+				setTimeout(() => resolve(null), timeoutMs);
+			});
+			const t0 = performance.now();
+			try { sendText(JSON.stringify({ 'type': "clock", 't0': t0 })); } catch (e) { break; }
+			const msg = await reply;
+			const t1 = performance.now();
+			if (!msg) continue;
+			const rtt = t1 - t0;
+			if (best === null || rtt < best.rtt) best = { rtt: rtt, offset: msg.ts - (t0 + t1) / 2 };
+		}
+		this._clockResolve = null;
+		if (best !== null) {
+			this.clockOffset = best.offset;
+			this.clockSynced = true;
+		}
+		return this.clockSynced;
+	}
+
+	// à appeler avec chaque message serveur décodé ; true s'il répondait au hello ou à une synchro d'horloge
+	handleReply(msg) {
+		if (msg.type === 'hello' && 'session' in msg) {
+			this.sessionId = msg.session;
+			this.controller = msg.controller;
+		}
+		if (msg.type === 'control') {
+			this.controller = msg.controller;
+			if (this.onControl) this.onControl(this.isController(), msg.controller);
+			return true;
+		}
+		if (msg.type === 'hello' && this._helloResolve) {
+			this._helloResolve(msg.protocol === PROTOCOL_BINARY ? PROTOCOL_BINARY : PROTOCOL_JSON);
+			return true;
+		}
+		if (msg.type === 'clock' && this._clockResolve) {
+			this._clockResolve(msg);
+			return true;
+		}
+		return false;
+	}
+}
+// --- fin de la classe commandEncoder --------------------------------------------
+
+export { commandEncoder, PROTOCOL_BINARY, PROTOCOL_JSON, KEEPALIVE_MS };
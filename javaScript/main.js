@@ -2,14 +2,16 @@ import { webRTCClient } from "./WebRTCClient.js";
 import { WebSocketClient } from "./WebSocketClient.js";
 
 
-async function createClient(type = 'webrtc') {
+// options.videoElement : élément <video> où afficher la caméra du robot (WebRTC uniquement)
+async function createClient(type = 'webrtc', options = {}) {
     if (type === 'webrtc') {
         try {
-            const rtcClient = new webRTCClient({offerUrl: '/rtcOffer_command'});
+            const rtcClient = new webRTCClient({offerUrl: '/rtcOffer_command', ...options});
             await rtcClient.ready;
             console.log('WebRTC client initialized');
             await rtcClient.dcReady;
             console.log('WebRTC DataChannel is open');
+            console.log('Command protocol:', await rtcClient.negotiateProtocol());
             return rtcClient;
         } 
         catch (e) {
@@ -18,6 +20,7 @@ async function createClient(type = 'webrtc') {
             console.log('WebSocket client created as fallback');
             await wsClient.ready;
             console.log('WebSocket connection open');
+            console.log('Command protocol:', await wsClient.negotiateProtocol());
             return wsClient;
         }
     } 
@@ -26,6 +29,7 @@ async function createClient(type = 'webrtc') {
         console.log('WebSocket client created');
         await wsClient.ready;
         console.log('WebSocket connection open');
+        console.log('Command protocol:', await wsClient.negotiateProtocol());
         return wsClient;
     }
 }
@@ -0,0 +1,152 @@
+from multiprocessing import shared_memory
+
+# Étapes d'une commande joystick, de l'envoi navigateur à set_joystick_state :
+#   network : envoi client -> réception serveur (horloge client recalée sur le serveur)
+#   server  : réception -> dépôt dans la boîte aux lettres (décodage, filtrage)
+#   ipc     : dépôt -> réveil de command_worker dans le processus webAPI
+#   apply   : réveil -> retour de set_joystick_state
+#   total   : envoi client (ou réception si l'horloge client est inconnue) -> retour de set_joystick_state
+STAGES = ("network", "server", "ipc", "apply", "total")
+TRANSPORTS = ("ws", "webrtc")
+
+# Histogramme log-linéaire façon HDR sur des microsecondes : 32 seaux exacts
+# puis 16 sous-seaux par puissance de deux (~6 % de précision relative).
+_LINEAR = 32
+_SUB = 16
+_MAX_SHIFT = 32
+BUCKETS = _LINEAR + _MAX_SHIFT * _SUB
+
+
+def _bucket(us):
+    if us < _LINEAR:
+        return us
+    shift = min(us.bit_length() - 5, _MAX_SHIFT)
+    return _LINEAR + (shift - 1) * _SUB + min((us >> shift) - _SUB, _SUB - 1)
+
+
+def _bucket_value(idx):
+    """Upper bound in microseconds of bucket `idx`."""
+    if idx < _LINEAR:
+        return idx
+    shift, sub = divmod(idx - _LINEAR, _SUB)
+    return ((_SUB + sub + 1) << (shift + 1)) - 1
+
+
+class latencyHistogram:
+    """Histogramme de latences sur un buffer (bytearray ou mémoire partagée).
+
+    Layout : count (Q), max en µs (Q), puis BUCKETS compteurs (Q).
+    Un seul écrivain par histogramme ; les lecteurs peuvent être dans un autre processus.
+    """
+    SIZE = 8 * (2 + BUCKETS)
+
+    def __init__(self, buf=None):
+        self.buf = buf if buf is not None else bytearray(self.SIZE)
+        self.counters = memoryview(self.buf).cast("Q")
+
+    def record_ns(self, ns):
+        us = max(int(ns) // 1000, 0)
+        c = self.counters
+        c[2 + _bucket(us)] += 1
+        if us > c[1]:
+            c[1] = us
+        c[0] += 1
+
+    def merge(self, other):
+        c, o = self.counters, other.counters
+        for i in range(2, 2 + BUCKETS):
+            if o[i]:
+                c[i] += o[i]
+        c[0] += o[0]
+        c[1] = max(c[1], o[1])
+
+    def snapshot(self):
+        return latencyHistogram(bytearray(self.buf))
+
+    def percentile(self, p):
+        c = self.counters
+        total = c[0]
+        if total == 0:
+            return None
+        rank = max(1, -(-total * p // 100))
+        seen = 0
+        for i in range(BUCKETS):
+            seen += c[2 + i]
+            if seen >= rank:
+                return min(_bucket_value(i), c[1])
+        return c[1]
+
+    def summary(self):
+        """Count and p50/p95/p99/max in milliseconds."""
+        c = self.counters
+        if c[0] == 0:
+            return {"count": 0}
+        return {
+            "count": c[0],
+            "p50": self.percentile(50) / 1000.0,
+            "p95": self.percentile(95) / 1000.0,
+            "p99": self.percentile(99) / 1000.0,
+            "max": c[1] / 1000.0,
+        }
+
+
+class latencyTracker:
+    """Histogrammes par (étape, transport) dans un segment de mémoire partagée.
+
+    Le processus serveur écrit `network` et `server`, le processus webAPI écrit
+    `ipc`, `apply` et `total` : chacun garde ses histogrammes, et `report()`
+    les fusionne à la demande depuis n'importe lequel des deux processus.
+    """
+    def __init__(self):
+        self.shm = shared_memory.SharedMemory(create=True, size=latencyHistogram.SIZE * len(STAGES) * len(TRANSPORTS))
+        self._attach()
+
+    def __getstate__(self):
+        return {"shm": self.shm}
+
+    def __setstate__(self, state):
+        self.shm = state["shm"]
+        self._attach()
+
+    def _attach(self):
+        self._histograms = {}
+        i = 0
+        for stage in STAGES:
+            for transport in TRANSPORTS:
+                view = self.shm.buf[i * latencyHistogram.SIZE:(i + 1) * latencyHistogram.SIZE]
+                self._histograms[(stage, transport)] = latencyHistogram(view)
+                i += 1
+
+    def transport_id(self, transport):
+        return TRANSPORTS.index(transport)
+
+    def record(self, stage, transport_id, ns):
+        self._histograms[(stage, TRANSPORTS[transport_id])].record_ns(ns)
+
+    def snapshot(self, stage, transport):
+        """Copy of the histogram of one (stage, transport)."""
+        return self._histograms[(stage, transport)].snapshot()
+
+    def report(self):
+        report = {}
+        for stage in STAGES:
+            merged = latencyHistogram()
+            per_transport = {}
+            for transport in TRANSPORTS:
+                snap = self._histograms[(stage, transport)].snapshot()
+                per_transport[transport] = snap.summary()
+                merged.merge(snap)
+            per_transport["all"] = merged.summary()
+            report[stage] = per_transport
+        return report
+
+    def close(self):
+        for h in self._histograms.values():
+            h.counters.release()
+            if isinstance(h.buf, memoryview):
+                h.buf.release()
+        self._histograms.clear()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,165 @@
+import asyncio
+import bisect
+from multiprocessing import shared_memory
+import latency
+
+# Métriques Prometheus des deux processus, dans un segment de mémoire partagée.
+# La disposition découle de SCHEMA, identique dans les deux processus ; chaque
+# emplacement (float64) n'a qu'un écrivain, et /metrics (processus serveur) lit le
+# segment sans échange entre processus.
+
+PREFIX = "proj103_"
+LAG_INTERVAL = 0.25  # période de mesure du retard des boucles asyncio (s)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)  # s
+SUIVI_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)  # s
+SUIVI_STATUSES = ("200", "400", "401", "404", "500", "503", "other", "error")  # "error" : pas de réponse (délai, connexion)
+LOOPS = ("api", "server")
+TRANSPORTS = latency.TRANSPORTS
+DROP_REASONS = ("filtered", "not_controller")  # hors d'ordre / périmée, ou session sans le contrôle
+
+# nom, type, aide, (label, valeurs) ou None, seaux des histogrammes
+SCHEMA = (
+    ("messages_received_total", "counter", "WebSocket/DataChannel messages received", ("transport", TRANSPORTS), None),
+    ("parse_failures_total", "counter", "Messages that could not be decoded or handled", ("transport", TRANSPORTS), None),
+    ("commands_forwarded_total", "counter", "Commands put in the command mailbox", ("transport", TRANSPORTS), None),
+    ("commands_dropped_total", "counter", "Commands refused by the web server", ("reason", DROP_REASONS), None),
+    ("commands_applied_total", "counter", "Commands applied by webAPI.command_worker", None, None),
+    ("commands_coalesced_total", "counter", "Commands overwritten in the mailbox before command_worker read them", None, None),
+    ("command_mailbox_read_version", "gauge", "Last command mailbox version read by command_worker", None, None),
+    ("toggles_applied_total", "counter", "Toggle requests applied by webAPI.toggle_worker", None, None),
+    ("suivi_requests_total", "counter", "Tracking server requests by status code", ("status", SUIVI_STATUSES), None),
+    ("suivi_request_seconds", "histogram", "Tracking server request latency", None, SUIVI_BUCKETS),
+    ("event_loop_lag_seconds", "histogram", "Delay of a timer on the asyncio loop beyond its deadline", ("loop", LOOPS), LAG_BUCKETS),
+)
+
+
+class metricsBlock:
+    """Compteurs, jauges et histogrammes de SCHEMA en mémoire partagée.
+
+    `index(name, label)` donne l'emplacement d'une série (à calculer une fois,
+    hors du chemin critique) ; `inc`/`set`/`observe` l'écrivent. Le processus
+    qui écrit une série est le seul à l'écrire. `render(extra)` produit le
+    format texte Prometheus, avec des lignes supplémentaires calculées par
+    l'appelant (sessions, profondeur de la boîte aux lettres...).
+    """
+    def __init__(self):
+        self._layout()
+        self.shm = shared_memory.SharedMemory(create=True, size=8 * self.size)
+        self.shm.buf[:] = bytes(self.shm.size)
+        self.values = self.shm.buf.cast("d")
+
+    def __getstate__(self):
+        return {"shm": self.shm}
+
+    def __setstate__(self, state):
+        self._layout()
+        self.shm = state["shm"]
+        self.values = self.shm.buf.cast("d")
+
+    def _layout(self):
+        self._index = {}
+        i = 0
+        for name, kind, _, labels, buckets in SCHEMA:
+            for value in (labels[1] if labels else (None,)):
+                self._index[(name, value)] = i
+                # histogramme : un compteur par seau (+Inf compris), puis la somme et le nombre
+                i += len(buckets) + 3 if kind == "histogram" else 1
+        self.size = i
+
+    def index(self, name : str, label=None) -> int:
+        return self._index[(name, label)]
+
+    def inc(self, index : int, n=1):
+        self.values[index] += n
+
+    def set(self, index : int, value):
+        self.values[index] = value
+
+    def get(self, index : int):
+        return self.values[index]
+
+    def observe(self, index : int, buckets, value):
+        """Add `value` to the histogram at `index` with bucket bounds `buckets`."""
+        values = self.values
+        values[index + bisect.bisect_left(buckets, value)] += 1
+        end = index + len(buckets) + 1
+        values[end] += value
+        values[end + 1] += 1
+
+    def render(self, extra=()) -> str:
+        lines = []
+        for name, kind, help, labels, buckets in SCHEMA:
+            full = PREFIX + name
+            lines.append(f"# HELP {full} {help}")
+            lines.append(f"# TYPE {full} {kind}")
+            for value in (labels[1] if labels else (None,)):
+                i = self._index[(name, value)]
+                label = f'{labels[0]}="{value}"' if labels else ""
+                if kind != "histogram":
+                    lines.append(f"{full}{{{label}}} {_number(self.values[i])}" if label else f"{full} {_number(self.values[i])}")
+                    continue
+                cumulative = 0.0
+                sep = "," if label else ""
+                for bound, count in zip(buckets + ("+Inf",), self.values[i:i + len(buckets) + 1]):
+                    cumulative += count
+                    lines.append(f'{full}_bucket{{{label}{sep}le="{bound}"}} {_number(cumulative)}')
+                suffix = f"{{{label}}}" if label else ""
+                lines.append(f"{full}_sum{suffix} {_number(self.values[i + len(buckets) + 1])}")
+                lines.append(f"{full}_count{suffix} {_number(self.values[i + len(buckets) + 2])}")
+        lines.extend(extra)
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.values.release()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _number(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def gauge(name : str, help : str, value, label : str = None, kind : str = "gauge") -> list:
+    """Prometheus text lines for a gauge computed at scrape time.
+
+    With `label`, `value` is a dict {label value: value}, one series each.
+    """
+    full = PREFIX + name
+    lines = [f"# HELP {full} {help}", f"# TYPE {full} {kind}"]
+    if label is None:
+        lines.append(f"{full} {_number(value)}")
+    else:
+        lines += [f'{full}{{{label}="{k}"}} {_number(v)}' for k, v in value.items()]
+    return lines
+
+
+def counter(name : str, help : str, value, label : str = None) -> list:
+    """Like gauge, for a total kept by the caller that only increases (name ending in _total)."""
+    return gauge(name, help, value, label, "counter")
+
+
+def latency_summaries(tracker : latency.latencyTracker) -> list:
+    """The command path latency histograms of `tracker` as Prometheus summaries (seconds)."""
+    full = PREFIX + "command_latency_seconds"
+    lines = [f"# HELP {full} Command path latency per stage (see latency.STAGES)", f"# TYPE {full} summary"]
+    for stage in latency.STAGES:
+        for transport in latency.TRANSPORTS:
+            snap = tracker.snapshot(stage, transport)
+            labels = f'stage="{stage}",transport="{transport}"'
+            if snap.counters[0]:
+                for q in (50, 95, 99):
+                    lines.append(f'{full}{{{labels},quantile="{q / 100}"}} {snap.percentile(q) / 1e6}')
+            lines.append(f"{full}_count{{{labels}}} {snap.counters[0]}")
+    return lines
+
+
+async def monitor_loop_lag(block : metricsBlock, loop_name : str, interval=LAG_INTERVAL):
+    """Measure, every `interval`, how late the running loop wakes a timer."""
+    loop = asyncio.get_running_loop()
+    index = block.index("event_loop_lag_seconds", loop_name)
+    while True:
+        deadline = loop.time() + interval
+        await asyncio.sleep(interval)
+        block.observe(index, LAG_BUCKETS, max(0.0, loop.time() - deadline))
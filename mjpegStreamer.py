@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+import cv2
+
+BOUNDARY = "frame"
+JPEG_QUALITY = 80
+LINGER = 2.0  # secondes pendant lesquelles l'encodeur reste actif après le dernier spectateur / snapshot
+
+
+class mjpegClient:
+	"""
+	Spectateur HTTP du flux MJPEG.
+	Comme fanoutTrack, ne garde que la dernière image encodée : si la précédente
+	n'a pas encore été écrite sur la socket, elle est sautée pour ce client seulement.
+	"""
+	def __init__(self, name):
+		self.name = name
+		self._jpeg = None
+		self._ready = asyncio.Event()
+		self.frames_sent = 0
+		self.frames_skipped = 0
+		self.closed = False
+
+	def push(self, jpeg):
+		if self._jpeg is not None:
+			self.frames_skipped += 1
+		self._jpeg = jpeg
+		self._ready.set()
+
+	async def next(self):
+		while self._jpeg is None:
+			if self.closed:
+				return None
+			await self._ready.wait()
+			self._ready.clear()
+		jpeg, self._jpeg = self._jpeg, None
+		self.frames_sent += 1
+		return jpeg
+
+	def close(self):
+		self.closed = True
+		self._ready.set()
+
+	def stats(self):
+		return {"sent": self.frames_sent, "skipped": self.frames_skipped}
+
+
+class mjpegStreamer:
+	"""
+	Flux MJPEG (multipart/x-mixed-replace) encodé une seule fois par image.
+	Un thread d'encodage lit la capture partagée (videoFanout.acquire()), encode
+	chaque nouvelle image en JPEG et remet les mêmes octets à tous les spectateurs :
+	le coût d'encodage ne dépend pas du nombre de clients. La dernière image
+	encodée sert aussi de snapshot.
+	Usage :
+	  streamer = mjpegStreamer(fanout, quality=80)
+	  client = streamer.subscribe("viewer-1")
+	  jpeg = await client.next()
+	  streamer.unsubscribe(client)
+	"""
+	def __init__(self, fanout, quality=JPEG_QUALITY, fps=None, linger=LINGER):
+		self.fanout = fanout
+		self.params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+		self.fps = fps  # None : cadence de la capture
+		self.linger = linger
+		self.clients = set()
+		self.jpeg = None  # dernière image encodée
+		self.jpeg_seq = 0
+		self.frames_encoded = 0
+		self.encode_time = 0.0  # moyenne glissante (s)
+		self._last_demand = 0.0
+		self._waiters = []
+		self._thread = None
+		self._loop = None
+
+	def subscribe(self, name):
+		client = mjpegClient(name)
+		self.clients.add(client)
+		self._start()
+		if self.jpeg is not None:
+			client.push(self.jpeg)
+		return client
+
+	def unsubscribe(self, client):
+		client.close()
+		self.clients.discard(client)
+		self._last_demand = time.monotonic()
+
+	async def snapshot(self, timeout=2.0):
+		"""Return the latest encoded JPEG, starting the encoder if needed; None if no frame arrives in time."""
+		self._last_demand = time.monotonic()
+		if self.jpeg is not None and self._thread is not None:
+			return self.jpeg
+		self._start()
+		waiter = asyncio.get_running_loop().create_future()
+		self._waiters.append(waiter)
+		try:
+			return await asyncio.wait_for(waiter, timeout)
+		except asyncio.TimeoutError:
+			return None
+		finally:
+			if waiter in self._waiters:
+				self._waiters.remove(waiter)
+
+	def _start(self):
+		self._last_demand = time.monotonic()
+		if self._thread is not None:
+			return
+		self._loop = asyncio.get_running_loop()
+		grabber = self.fanout.acquire()
+		self._thread = threading.Thread(target=self._run, args=(grabber,), daemon=True, name="mjpegEncoder")
+		self._thread.start()
+
+	def _publish(self, seq, jpeg):
+		# appelé dans la boucle asyncio : une seule remise par image pour tous les clients
+		self.jpeg, self.jpeg_seq = jpeg, seq
+		for client in self.clients:
+			client.push(jpeg)
+		for waiter in self._waiters:
+			if not waiter.done():
+				waiter.set_result(jpeg)
+		self._waiters.clear()
+
+	def _stopped(self):
+		self._thread = None
+		self.jpeg = None
+		self.fanout.release()
+		if self.clients or self._waiters:
+			self._start()  # demande arrivée pendant l'arrêt
+
+	def _idle(self):
+		return not self.clients and not self._waiters and time.monotonic() - self._last_demand > self.linger
+
+	def _run(self, grabber):
+		last_seq = 0
+		next_tick = time.monotonic()
+		try:
+			while not self._idle():
+				next_tick += 1.0 / (self.fps or grabber.fps)
+				seq, frame = grabber.latest("mjpeg")
+				if seq != last_seq:
+					last_seq = seq
+					start = time.perf_counter()
+					ok, buf = cv2.imencode(".jpg", frame, self.params)
+					self.encode_time += 0.2 * ((time.perf_counter() - start) - self.encode_time)
+					if ok:
+						self.frames_encoded += 1
+						self._loop.call_soon_threadsafe(self._publish, seq, buf.tobytes())
+				delay = next_tick - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+				else:
+					next_tick = time.monotonic()  # encodeur en retard : on ne rattrape pas
+		finally:
+			grabber.release("mjpeg")
+			try:
+				self._loop.call_soon_threadsafe(self._stopped)
+			except RuntimeError:
+				pass  # boucle déjà fermée
+
+	def stats(self):
+		return {
+			"running": self._thread is not None,
+			"frames_encoded": self.frames_encoded,
+			"encode_ms": round(self.encode_time * 1000.0, 2),
+			"clients": {c.name: c.stats() for c in self.clients},
+		}
@@ -1,21 +1,127 @@
-from multiprocessing import Process, Queue
-import asyncio
+from multiprocessing import Process, Queue, Event, shared_memory
+import queue
+import time
 import control_moteur as moteur
+import latency
+
+CONTROL_HZ = 100  # fréquence de la boucle moteurs
+MAX_SLEW = 4.0  # variation maximale de la consigne par axe (pleine échelle / s)
+INTERPOLATION_MAX = 0.1  # durée maximale d'interpolation vers une nouvelle consigne (s)
+DEADMAN_TIMEOUT = 0.5  # s sans commande avant de ramener les moteurs à l'arrêt
+DEADMAN_RAMP = 0.3  # durée de la rampe vers zéro depuis la pleine échelle (s)
+
+_COUNTERS = ("ticks", "overruns", "commands", "coalesced", "deadman")
+
 
 class controlExecutor:
-    def __init__(self, command_queue : Queue):
+    """
+    Boucle moteurs à fréquence fixe dans un processus dédié.
+    À chaque tick (hz), la file est vidée sans attendre et seule la dernière
+    commande (x, y) est gardée : les rafales réseau sont fusionnées, les trous
+    ne figent pas les moteurs. La consigne est interpolée de la sortie courante
+    vers la nouvelle commande sur l'intervalle entre commandes (au plus
+    INTERPOLATION_MAX), puis limitée en pente (max_slew). Sans commande depuis
+    deadman_timeout, la sortie redescend à zéro en deadman_ramp.
+    moteur.joystick reçoit donc une consigne à chaque tick, quel que soit le trafic.
+    Le retard de chaque tick sur son échéance est mesuré (histogramme en mémoire
+    partagée, lisible depuis le processus parent avec stats()).
+    Usage :
+      executor = controlExecutor(Queue(), hz=100)
+      executor.push_command((x, y))
+      executor.stats()
+      executor.close()
+    """
+    def __init__(self, command_queue : Queue, hz=CONTROL_HZ, max_slew=MAX_SLEW, deadman_timeout=DEADMAN_TIMEOUT, deadman_ramp=DEADMAN_RAMP):
         self.command_queue = command_queue
+        self.hz = hz
+        self.max_slew = max_slew
+        self.deadman_timeout = deadman_timeout
+        self.deadman_ramp = deadman_ramp
+        self.shm = shared_memory.SharedMemory(create=True, size=latency.latencyHistogram.SIZE + 8 * len(_COUNTERS))
+        self.shm.buf[:] = bytes(self.shm.size)
+        self.jitter, self.counters = self._views()
+        self.stop_event = Event()
         self.process = Process(target=self.run, args=(command_queue,), daemon=True)
         self.process.start()
-    
+
+    def _views(self):
+        size = latency.latencyHistogram.SIZE
+        return latency.latencyHistogram(self.shm.buf[:size]), self.shm.buf[size:size + 8 * len(_COUNTERS)].cast("Q")
+
     def push_command(self, command):
         self.command_queue.put(command)
 
+    def _drain(self, command_queue):
+        """Latest command in the queue (None if empty) and how many were read."""
+        latest, count = None, 0
+        while True:
+            try:
+                latest = command_queue.get_nowait()
+            except queue.Empty:
+                return latest, count
+            count += 1
+
     def run(self, command_queue : Queue):
-        async def control_loop():
-            running = True
-            while running:
-                _command = await command_queue.get()
-                moteur.joystick(_command)
-        
-        asyncio.run(control_loop())
\ No newline at end of file
+        jitter, counters = self._views()
+        ticks, overruns, commands, coalesced, deadman = range(len(_COUNTERS))
+        period = 1.0 / self.hz
+        output = (0.0, 0.0)
+        # segment d'interpolation : départ, arrivée, début et fin (s)
+        origin, target, seg_start, seg_end = output, output, 0.0, 0.0
+        last_command = None
+        stopped = True
+        deadline = time.perf_counter()
+        while not self.stop_event.is_set():
+            deadline += period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.perf_counter()
+            late = now - deadline
+            jitter.record_ns(late * 1e9)
+            if late > period:
+                # tick(s) manqué(s) : on repart de maintenant plutôt que d'enchaîner des ticks en rafale
+                counters[overruns] += 1
+                deadline = now
+
+            latest, count = self._drain(command_queue)
+            if latest is not None:
+                counters[commands] += count
+                counters[coalesced] += count - 1
+                interval = now - last_command if last_command is not None else period
+                origin, target = output, (float(latest[0]), float(latest[1]))
+                seg_start, seg_end = now, now + min(max(interval, period), INTERPOLATION_MAX)
+                last_command = now
+
+            if last_command is None or now - last_command > self.deadman_timeout:
+                if not stopped and last_command is not None:
+                    counters[deadman] += 1
+                stopped = True
+                setpoint, slew = (0.0, 0.0), 1.0 / self.deadman_ramp
+            else:
+                stopped = False
+                t = min(1.0, (now - seg_start) / (seg_end - seg_start)) if seg_end > seg_start else 1.0
+                setpoint = tuple(o + (g - o) * t for o, g in zip(origin, target))
+                slew = self.max_slew
+            step = slew * period
+            output = tuple(out + min(max(sp - out, -step), step) for out, sp in zip(output, setpoint))
+
+            moteur.joystick(output)
+            counters[ticks] += 1
+
+    def stats(self):
+        stats = dict(zip(_COUNTERS, self.counters))
+        stats["hz"] = self.hz
+        stats["jitter_ms"] = self.jitter.snapshot().summary()
+        return stats
+
+    def close(self):
+        self.stop_event.set()
+        self.process.join(timeout=1.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.counters.release()
+        self.jitter.counters.release()
+        self.jitter.buf.release()
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,175 @@
+import asyncio
+import collections
+import os
+import struct
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+import traceLog
+
+SAMPLE_INTERVAL = 0.005  # période d'échantillonnage des piles (s)
+MAX_SECONDS = 60.0  # durée maximale d'un profil
+RESULT_SIZE = 1024 * 1024  # place pour le profil du processus webAPI (texte « collapsed »)
+SLOW_CALLBACK = 0.1  # une boucle bloquée plus longtemps que ça est signalée (s)
+STACK_DEPTH = 12  # frames gardées dans la trace d'un blocage
+
+
+def _frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse(counts : collections.Counter, root : str = None, limit : int = None) -> str:
+    """Collapsed-stack text ("a;b;c count" per line, most frequent first), as read by flamegraph.pl or speedscope.
+
+    With `limit`, the least frequent stacks are left out so the text fits in `limit` bytes.
+    """
+    lines = []
+    size = 0
+    for stack, count in counts.most_common():
+        line = f"{root};{stack} {count}\n" if root else f"{stack} {count}\n"
+        size += len(line.encode())
+        if limit is not None and size > limit:
+            break
+        lines.append(line)
+    return "".join(lines)
+
+
+class stackSampler:
+    """Échantillonneur de piles d'un processus, pendant une durée donnée.
+
+    Toutes les `interval` secondes, sys._current_frames() donne la frame courante
+    de chaque thread (sauf celui de l'échantillonneur) ; la pile est comptée sous
+    la forme « thread;module:fonction;... ». Rien n'est instrumenté : le coût
+    n'existe que pendant `sample()`.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+
+    def sample(self, seconds : float) -> collections.Counter:
+        counts = collections.Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        next_tick = time.monotonic()
+        while next_tick < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                counts[";".join(reversed(stack))] += 1
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return counts
+
+
+class profileBuffer:
+    """Résultat d'un profil du processus webAPI, lu par le processus serveur.
+
+    En-tête (numéro de la demande, longueur) puis le texte « collapsed ». L'écrivain
+    remet le numéro à zéro avant d'écrire, le lecteur relit l'en-tête après la copie.
+    """
+    _HEADER = struct.Struct("<QI")
+
+    def __init__(self, size=RESULT_SIZE):
+        self.shm = shared_memory.SharedMemory(create=True, size=self._HEADER.size + size)
+        self._HEADER.pack_into(self.shm.buf, 0, 0, 0)
+
+    def __getstate__(self):
+        return {"shm": self.shm}
+
+    def __setstate__(self, state):
+        self.shm = state["shm"]
+
+    @property
+    def capacity(self):
+        return self.shm.size - self._HEADER.size
+
+    def write(self, request : int, text : str):
+        data = text.encode()[:self.capacity]
+        self._HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        self.shm.buf[self._HEADER.size:self._HEADER.size + len(data)] = data
+        self._HEADER.pack_into(self.shm.buf, 0, request, len(data))
+
+    def read(self, request : int):
+        """The text written for `request`, or None if it is not there (yet)."""
+        version, length = self._HEADER.unpack_from(self.shm.buf, 0)
+        if version != request:
+            return None
+        data = bytes(self.shm.buf[self._HEADER.size:self._HEADER.size + length])
+        if self._HEADER.unpack_from(self.shm.buf, 0) != (version, length):
+            return None
+        return data.decode(errors="replace")
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class loopWatchdog:
+    """Signale les callbacks qui bloquent une boucle asyncio.
+
+    Une tâche de la boucle note l'heure toutes les `threshold / 4` secondes ; un
+    thread vérifie cette heure et, quand la boucle n'a plus avancé depuis
+    `threshold`, trace (traceLog, catégorie "slow") la pile du thread de la boucle
+    à cet instant, c'est-à-dire l'appel bloquant, puis la durée totale du blocage
+    quand la boucle repart. Sans mode debug d'asyncio, donc sans surcoût sur les
+    autres callbacks.
+    Usage (depuis le thread de la boucle) : loopWatchdog("api").start()
+    """
+    def __init__(self, name : str, threshold=SLOW_CALLBACK) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.stalls = 0
+        self.longest = 0.0
+        self.beat = time.monotonic()
+        self.task = None
+        self.thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start watching the running loop (call from its thread)."""
+        self._loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.task = asyncio.ensure_future(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name=f"loopWatchdog-{self.name}", daemon=True)
+        self.thread.start()
+
+    async def _heartbeat(self):
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        stalled_at = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self.beat
+            blocked = time.monotonic() - beat
+            if blocked > self.threshold and stalled_at != beat:
+                stalled_at = beat
+                self.stalls += 1
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = "".join(traceback.format_stack(frame, limit=STACK_DEPTH)) if frame is not None else "?"
+                traceLog.warning("slow", "%s loop blocked for %.0f ms, in:\n%s", self.name, blocked * 1000, stack)
+            elif stalled_at is not None and beat != stalled_at:
+                duration = beat - stalled_at
+                self.longest = max(self.longest, duration)
+                traceLog.warning("slow", "%s loop resumed after %.0f ms", self.name, duration * 1000)
+                stalled_at = None
+
+    def stats(self) -> dict:
+        return {"stalls": self.stalls, "longest_ms": self.longest * 1000, "threshold_ms": self.threshold * 1000}
+
+    def stop(self):
+        self._stop.set()
+        if self.task is not None and not self.task.get_loop().is_closed():
+            self.task.cancel()
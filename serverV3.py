@@ -1,157 +1,577 @@
+import time
+_IMPORT_START_NS = time.monotonic_ns()
+import asyncio
+import importlib
 import json
+import signal
+import sys
 from aiohttp import web
-import aiortc as rtc
-from multiprocessing import SimpleQueue, Manager
-import warnings
 import tool
+import telemetryHub
+import commandProtocol
+import latency
+import sessions
+import staticAssets
+import telemetryHistory
+import flightRecorder
+import traceLog
+import metrics
+import profiler
+import hmac
+# aiortc, videoFanout (cv2, av, numpy) et mjpegStreamer ne sont importés qu'au
+# premier usage (offre WebRTC, route vidéo) : cf. lazy_import
+WARMUP_MODULES = ("aiortc",)  # importés dans un thread juste après le bind, hors du chemin des requêtes
 
+SHUTDOWN_TIMEOUT = 1.0  # s laissées aux connexions ouvertes à l'arrêt, pour des redémarrages rapides
 
-def new_web_server_process(cfg : dict, command_queue : SimpleQueue, toggle_queue : SimpleQueue, shared) -> None:
+# temps de démarrage du processus serveur (ms), servis par /debug/startup
+STARTUP = {"module_import_ms": (time.monotonic_ns() - _IMPORT_START_NS) / 1e6, "lazy_imports_ms": {}}
+
+
+def lazy_import(name : str):
+    """Import `name` on first use and record how long it took."""
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.monotonic_ns()
+        module = importlib.import_module(name)
+        STARTUP["lazy_imports_ms"][name] = (time.monotonic_ns() - start) / 1e6
+    return module
+
+
+async def lazy_import_async(name : str):
+    """lazy_import in a worker thread, so the first import does not block the event loop."""
+    module = sys.modules.get(name)
+    if module is None:
+        module = await asyncio.get_running_loop().run_in_executor(None, lazy_import, name)
+    return module
+
+
+def new_web_server_process(cfg : dict, command_mailbox : tool.Mailbox, toggle_mailbox : tool.Mailbox, telemetry : tool.TelemetryBlock, latency_tracker : latency.latencyTracker, history : telemetryHistory.telemetryHistory = None, trace : traceLog.traceBuffer = None, metrics_block : metrics.metricsBlock = None, profile_mailbox : tool.Mailbox = None, profile_buffer : profiler.profileBuffer = None) -> None:
     '''Start a web server in a new process using the plain config dict.
 
-    `cfg` is expected to be a dict with keys: host, port, main_page, ...
-    `command_queue` is a multiprocessing.SimpleQueue used for parent-child IPC.
+    `cfg` is expected to be a dict with keys: host, port, main_page, js_path,
+    "sessions" (sessionRegistry arguments), "static_reload" (reload edited pages/scripts),
+    "spawned_ns" (monotonic time of Process.start(), for the startup report) and optionally
+    "video" (source, width, height, fps, fourcc, max_viewers, ladder, jpeg_quality, mjpeg_fps)
+    to serve the camera to WebRTC peers and over /video.mjpeg and /snapshot.jpg.
+    `command_mailbox` is a tool.Mailbox("ddBqqq") holding the latest joystick command:
+    x, y, transport id, client send time, server receive time and put time (monotonic ns, 0 if unknown).
+    `toggle_mailbox` is a tool.Mailbox() whose version counts toggle requests.
+    `telemetry` is the tool.TelemetryBlock written by the webAPI workers.
+    `latency_tracker` holds the per-stage latency histograms shared with webAPI.
+    `history` is the telemetryHistory ring written by the webAPI telemetry workers.
+    `trace` is the traceLog.traceBuffer shared with webAPI; "trace" in `cfg` sets path, level and sampling.
+    `metrics_block` is the metrics.metricsBlock shared with webAPI, served at /metrics.
+    `profile_mailbox` (tool.Mailbox("dd"): seconds, sampling interval) asks webAPI for a profile,
+    which it writes to `profile_buffer`; "profile" in `cfg` holds the /debug/profile token and
+    the slow callback threshold.
     '''
+    entered_ns = time.monotonic_ns()
     print("initializing web server process")
-    server = webServer(cfg["host"], cfg["port"], cfg["main_page"], cfg["js_path"], command_queue, toggle_queue, shared)
-    server.run() 
+    if cfg.get("spawned_ns"):
+        STARTUP["spawn_ms"] = (entered_ns - cfg["spawned_ns"]) / 1e6
+    STARTUP["start_method"] = cfg.get("start_method")
+    trace_cfg = cfg.get("trace") or {}
+    traceLog.configure(trace, "server", trace_cfg.get("path"), trace_cfg.get("level", traceLog.LEVEL), trace_cfg.get("sampling"))
+    recorder = flightRecorder.flightRecorder(cfg["recorder"]["path"], "server") if cfg.get("recorder") else None
+    server = webServer(cfg["host"], cfg["port"], cfg["main_page"], cfg["js_path"], command_mailbox, toggle_mailbox, telemetry, latency_tracker, cfg.get("video"), cfg.get("sessions"), cfg.get("static_reload", False), history, recorder, trace, metrics_block, profile_mailbox, profile_buffer, cfg.get("profile"))
+    STARTUP["init_ms"] = (time.monotonic_ns() - entered_ns) / 1e6
+    server.spawned_ns = cfg.get("spawned_ns") or entered_ns
+    server.run()
+    # libère les vues sur la mémoire partagée avant la fin de l'interpréteur (spawn/forkserver)
+    traceLog.shutdown()
+    for shared in (command_mailbox, toggle_mailbox, telemetry, latency_tracker, history, recorder, trace, metrics_block, profile_mailbox, profile_buffer):
+        if shared is not None:
+            shared.close()
 
 class webServer:
-    def __init__(self, host : str, port : int, main_page : str, js_path : str, command_queue : SimpleQueue, toggle_queue : SimpleQueue, shared) -> None:
+    def __init__(self, host : str, port : int, main_page : str, js_path : str, command_mailbox : tool.Mailbox, toggle_mailbox : tool.Mailbox, telemetry : tool.TelemetryBlock, latency_tracker : latency.latencyTracker = None, video_cfg : dict = None, session_cfg : dict = None, static_reload : bool = False, history : telemetryHistory.telemetryHistory = None, recorder : flightRecorder.flightRecorder = None, trace : traceLog.traceBuffer = None, metrics_block : metrics.metricsBlock = None, profile_mailbox : tool.Mailbox = None, profile_buffer : profiler.profileBuffer = None, profile_cfg : dict = None) -> None:
         self.host = host
         self.port = port
         self.main_page = main_page
         self.js_path = js_path
-        self.command_queue = command_queue
-        self.toggle_queue = toggle_queue
-        self.shared = shared
+        self.command_mailbox = command_mailbox
+        self.toggle_mailbox = toggle_mailbox
+        self.telemetry = telemetry
+        self.telemetry_hub = telemetryHub.telemetryHub(telemetry)
+        self.history = history
+        self.recorder = recorder
+        self.trace = trace
+        self.metrics = metrics_block
+        self.profile_mailbox = profile_mailbox
+        self.profile_buffer = profile_buffer
+        self.profile_cfg = profile_cfg or {}
+        self.profiling = False
+        self.watchdog = None
+        self.warmup = None
+        if metrics_block is not None:
+            self._m_received = [metrics_block.index("messages_received_total", t) for t in metrics.TRANSPORTS]
+            self._m_parse_failures = [metrics_block.index("parse_failures_total", t) for t in metrics.TRANSPORTS]
+            self._m_forwarded = [metrics_block.index("commands_forwarded_total", t) for t in metrics.TRANSPORTS]
+            self._m_dropped = {reason: metrics_block.index("commands_dropped_total", reason) for reason in metrics.DROP_REASONS}
+        self.latency = latency_tracker
+        self.sessions = sessions.sessionRegistry(**(session_cfg or {}))
+        self.assets = staticAssets.staticAssets(main_page, js_path, reload=static_reload)
+        self.video_cfg = video_cfg
+        self.video = None
+        self.mjpeg = None
+        self.spawned_ns = None
         self.app = web.Application()
         self.app.router.add_post("/rtcOffer_command", self.rtcOffer_command)
-        self.app.router.add_get("/", self.get_main_page_handler)
-        self.app.router.add_get("/javaScript/main.js", self.get_main_js_handler)
-        self.app.router.add_get("/javaScript/WebRTCClient.js", self.get_web_rtc_client_js_handler)
-        self.app.router.add_get("/javaScript/WebSocketClient.js", self.get_web_socket_client_js_handler)
+        self.app.router.add_get("/", self.assets.handler)
+        self.app.router.add_get(self.assets.prefix + "{name}", self.assets.handler)
         self.app.router.add_get("/energy", self.get_energy_handler)
         self.app.router.add_get("/movement_status", self.get_movement_status_handler)
+        self.app.router.add_get("/telemetry/history", self.get_telemetry_history_handler)
+        self.app.router.add_get("/debug/latency", self.get_latency_handler)
+        self.app.router.add_get("/sessions", self.get_sessions_handler)
+        self.app.router.add_get("/debug/startup", self.get_startup_handler)
+        self.app.router.add_get("/debug/trace", self.get_trace_handler)
+        self.app.router.add_get("/metrics", self.get_metrics_handler)
+        self.app.router.add_get("/debug/profile", self.get_profile_handler)
+        self.app.router.add_get("/video/stats", self.get_video_stats_handler)
+        self.app.router.add_get("/video.mjpeg", self.get_mjpeg_handler)
+        self.app.router.add_get("/snapshot.jpg", self.get_snapshot_handler)
         self.app.add_routes([web.get('/ws', self.ws_command)])
 
-    def command(self, cmd : dict):
-        """Handle a command received from a client."""
-        #print("Command received:", cmd)
-        if self.command_queue is not None:
-            self.command_queue.put(cmd)
+    def command(self, x, y, transport_id=0, client_ns=0, recv_ns=0, session_id=0):
+        """Handle a command received from a client.
+
+        `client_ns` (client send time, 0 if its clock is not synced) and `recv_ns`
+        are monotonic timestamps used to trace the command latency.
+        """
+        #print("Command received:", (x, y))
+        if self.recorder is not None:
+            self.recorder.command(x, y, transport_id, session_id)
+        if self.command_mailbox is not None:
+            put_ns = time.monotonic_ns()
+            self.command_mailbox.put(float(x), float(y), transport_id, client_ns, recv_ns, put_ns)
+            if self.metrics is not None:
+                self.metrics.inc(self._m_forwarded[transport_id])
+            if self.latency is not None and recv_ns:
+                self.latency.record("server", transport_id, put_ns - recv_ns)
+                if client_ns:
+                    self.latency.record("network", transport_id, recv_ns - client_ns)
+        else:
+            traceLog.warning("command", "No command mailbox defined; cannot forward command")
+
+    def handle_message(self, msg : dict, session : sessions.clientSession = None, recv_ns : int = 0):
+        """Dispatch a decoded JSON message coming from the WebSocket or the DataChannel.
+
+        `session` is the client session the message came from, `recv_ns` its monotonic receive time.
+        Commands and toggles are only applied for the session holding control.
+        """
+        match msg['type']:
+            case "command":
+                recv_ns = recv_ns or time.monotonic_ns()
+                if session is None:
+                    self.command(msg['x'], msg['y'], recv_ns=recv_ns)
+                elif 'seq' in msg and not session.filter.accept(int(msg['seq']), float(msg.get('ts', 0.0)), recv_ns / 1e6):
+                    self.count_dropped("filtered")
+                elif not self.sessions.may_command(session, recv_ns / 1e9):
+                    self.count_dropped("not_controller")
+                else:
+                    client_ns = int(float(msg['ts']) * 1e6) if msg.get('synced') else 0
+                    self.command(msg['x'], msg['y'], session.transport_id, client_ns, recv_ns, session.id)
+            case "toggle_commands":
+                if session is None:
+                    self.toggle_commands()
+                elif self.sessions.may_command(session, time.monotonic()):
+                    self.toggle_commands(session.transport_id, session.id)
+            case "clock" if session is not None:
+                # synchronisation d'horloge façon NTP : le client en déduit son décalage
+                session.send(json.dumps({"type": "clock", "t0": msg.get('t0'), "ts": time.monotonic_ns() / 1e6}))
+            case "hello" if session is not None:
+                session.protocol = commandProtocol.negotiate(msg.get('protocols'))
+                controller = self.sessions.controller
+                session.send(json.dumps({"type": "hello", "protocol": session.protocol, "session": session.id, "controller": controller.id if controller is not None else None}))
+            case "control" if session is not None:
+                match msg.get('action'):
+                    case "claim":
+                        self.sessions.claim(session, bool(msg.get('force')))
+                    case "release":
+                        self.sessions.release(session)
+            case "subscribe" if session is not None:
+                self.telemetry_hub.subscribe(session.subscriber, msg.get('metrics'), msg.get('max_rate'))
+            case "unsubscribe" if session is not None:
+                self.telemetry_hub.unsubscribe(session.subscriber)
+            case "ping":
+                pass  # maintien de session : seule la date du dernier message compte
+
+    def handle_frame(self, data : bytes, session : sessions.clientSession, recv_ns : int = 0):
+        """Decode a fixed-size binary command frame (see commandProtocol.FRAME)."""
+        kind, flags, seq, timestamp, x, y = commandProtocol.decode(data)
+        recv_ns = recv_ns or time.monotonic_ns()
+        now = recv_ns / 1e6
+        match kind:
+            case commandProtocol.MSG_COMMAND:
+                if not session.filter.accept(seq, timestamp, now):
+                    self.count_dropped("filtered")
+                elif not self.sessions.may_command(session, recv_ns / 1e9):
+                    self.count_dropped("not_controller")
+                else:
+                    client_ns = int(timestamp * 1e6) if flags & commandProtocol.FLAG_CLOCK_SYNCED else 0
+                    self.command(x, y, session.transport_id, client_ns, recv_ns, session.id)
+            case commandProtocol.MSG_TOGGLE:
+                if session.filter.accept(seq, timestamp, now, check_stale=False) and self.sessions.may_command(session, recv_ns / 1e9):
+                    self.toggle_commands(session.transport_id, session.id)
+
+    def receive(self, session : sessions.clientSession, data, recv_ns : int):
+        """Handle one WebSocket / DataChannel message (binary frame or JSON text)."""
+        session.touch(recv_ns / 1e9, len(data))
+        if self.metrics is not None:
+            self.metrics.inc(self._m_received[session.transport_id])
+        if isinstance(data, bytes):
+            self.handle_frame(data, session, recv_ns)
         else:
-            warnings.warn("No command queue defined; cannot forward command")
-            
+            self.handle_message(json.loads(data), session, recv_ns)
+
+    def count_dropped(self, reason : str):
+        if self.metrics is not None:
+            self.metrics.inc(self._m_dropped[reason])
+
+    def count_parse_failure(self, session : sessions.clientSession):
+        if self.metrics is not None:
+            self.metrics.inc(self._m_parse_failures[session.transport_id])
+
+    def close_session(self, session : sessions.clientSession):
+        self.telemetry_hub.unsubscribe(session.subscriber)
+        self.sessions.close(session)
 
     def run(self):
+        asyncio.run(self.serve())
+        print("Web server stopped")
+
+    async def serve(self):
+        """Bind, serve until SIGINT/SIGTERM, then close open connections within SHUTDOWN_TIMEOUT."""
+        start = time.monotonic_ns()
+        runner = web.AppRunner(self.app, shutdown_timeout=SHUTDOWN_TIMEOUT)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        ready = time.monotonic_ns()
+        STARTUP["bind_ms"] = (ready - start) / 1e6
+        if self.spawned_ns is not None:
+            STARTUP["ready_ms"] = (ready - self.spawned_ns) / 1e6
         print(f"\033[92mServer starting at http://{self.host}:{self.port}", flush=True)
         print(f"Main page at http://{self.host}:{self.port} \033[0m", flush=True)
-        web.run_app(self.app, host=self.host, port=self.port)
-        print("Web server stopped")
 
+        self.warmup = asyncio.create_task(self.warm_up())
+        lag_monitor = asyncio.create_task(metrics.monitor_loop_lag(self.metrics, "server")) if self.metrics is not None else None
+        if self.profile_cfg.get("slow_callback") is not None:
+            self.watchdog = profiler.loopWatchdog("server", self.profile_cfg["slow_callback"])
+            self.watchdog.start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows : terminate() arrête le processus directement
+        try:
+            await stop.wait()
+        finally:
+            self.warmup.cancel()
+            if lag_monitor is not None:
+                lag_monitor.cancel()
+            if self.watchdog is not None:
+                self.watchdog.stop()
+            if self.video is not None:
+                for viewer in list(self.video.viewers):
+                    viewer.stop()
+            await runner.cleanup()
+
+    async def warm_up(self):
+        """Import WARMUP_MODULES (and the video modules if video is enabled) off the event loop."""
+        names = WARMUP_MODULES + (("videoFanout", "mjpegStreamer") if self.video_cfg is not None else ())
+        for name in names:
+            try:
+                await lazy_import_async(name)
+            except ImportError as e:
+                traceLog.warning("startup", "Warm-up import of %s failed: %r", name, e)
 
     async def ws_command(self, request : web.Request) -> web.Response:
-        self.ws = web.WebSocketResponse()
-        await self.ws.prepare(request)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
 
-        print('websocket connection established')
+        session = self.sessions.open(
+            "ws",
+            ws.send_str,
+            lambda: request.transport.get_write_buffer_size() if request.transport is not None else 0,
+            name=f"ws:{request.remote}",
+            close=lambda: asyncio.ensure_future(ws.close()),
+        )
+        traceLog.info("session", "websocket connection established (session %d, %s)", session.id, request.remote)
 
-        async for msg in self.ws:
-            if msg.type == web.WSMsgType.TEXT:
-                try:
-                    self.command(json.loads(msg.data))
-                except Exception:
-                    print("Failed to treat message as command")
-                    pass
-            elif msg.type == web.WSMsgType.ERROR:
-                print('ws connection closed with exception %s' %
-                    self.ws.exception())
-
-        del self.ws
-        print('websocket connection closed')
-        return self.ws
-
-    async def toggle_commands(self):
+        try:
+            async for msg in ws:
+                recv_ns = time.monotonic_ns()
+                if msg.type in (web.WSMsgType.BINARY, web.WSMsgType.TEXT):
+                    try:
+                        self.receive(session, msg.data, recv_ns)
+                    except Exception as e:
+                        self.count_parse_failure(session)
+                        traceLog.warning("command", "Failed to treat message as command (session %d): %r", session.id, e)
+                elif msg.type == web.WSMsgType.ERROR:
+                    traceLog.warning("session", "ws connection closed with exception %s", ws.exception())
+        finally:
+            self.close_session(session)
+        traceLog.info("session", "websocket connection closed (session %d)", session.id)
+        return ws
+
+    def toggle_commands(self, transport_id=0, session_id=0):
         #print("Toggling commands")
-        if self.toggle_queue is not None:
-            self.toggle_queue.put(True)
+        if self.recorder is not None:
+            self.recorder.toggle(transport_id, session_id)
+        if self.toggle_mailbox is not None:
+            self.toggle_mailbox.put()
         else:
-            warnings.warn("No toggle queue defined; cannot toggle commands")
+            traceLog.warning("toggle", "No toggle mailbox defined; cannot toggle commands")
 
     async def rtcOffer_command(self, request : web.Request) -> web.Response:
         params = await request.json()
+        rtc = await lazy_import_async("aiortc")
         offer = rtc.RTCSessionDescription(sdp=params["sdp"], type=params["type"])
 
-        self.pc = rtc.RTCPeerConnection()
-
+        pc = rtc.RTCPeerConnection()
 
-        @self.pc.on("datachannel")
+        @pc.on("datachannel")
         def on_datachannel(channel):
-            print("DataChannel received:", channel.label)
-            self.dc = channel
+            session = self.sessions.open(
+                "webrtc",
+                channel.send,
+                lambda: channel.bufferedAmount,
+                name=f"dc:{request.remote}:{channel.label}",
+                close=lambda: asyncio.ensure_future(pc.close()),
+            )
+            traceLog.info("session", "DataChannel received: %s (session %d, %s)", channel.label, session.id, request.remote)
+
+            @channel.on("close")
+            def on_close():
+                self.close_session(session)
 
             @channel.on("open")
             def on_open():
-                print("DataChannel opened:", channel.label)
+                traceLog.info("session", "DataChannel opened: %s", channel.label)
 
             @channel.on("message")
             def on_message(message):
+                recv_ns = time.monotonic_ns()
                 try:
-                    msg = json.loads(message)
-                    match msg['type']:
-                        case "command":
-                            self.command((msg['x'], msg['y']))
-                        case "toggle_commands":
-                            self.toggle_commands()
-                except Exception:
-                    print("Failed to treat message as command")
-                    pass
-
-        @self.pc.on("iceconnectionstatechange")
+                    self.receive(session, message, recv_ns)
+                except Exception as e:
+                    self.count_parse_failure(session)
+                    traceLog.warning("command", "Failed to treat message as command (session %d): %r", session.id, e)
+
+        @pc.on("iceconnectionstatechange")
         async def on_iceconnectionstatechange():
-            ICEState = self.pc.iceConnectionState
-            print("ICE connection state is %s" % ICEState)
+            ICEState = pc.iceConnectionState
+            traceLog.info("webrtc", "ICE connection state is %s", ICEState)
             match ICEState:
                 case "failed":
-                    await self.pc.close()
-                    del self.pc
+                    await pc.close()
                 case "completed":
-                    print("WebRTC connection established")
+                    traceLog.info("webrtc", "WebRTC connection established")
                 case "closed":
-                    print("WebRTC connection closed")
+                    traceLog.info("webrtc", "WebRTC connection closed")
+
+        await pc.setRemoteDescription(offer)
+
+        # le client a demandé la vidéo (transceiver recvonly dans l'offre)
+        if any(t.kind == "video" for t in pc.getTransceivers()):
+            video_track = self.add_video_viewer(f"{request.remote}:{id(pc):x}")
+            if video_track is not None:
+                video_track.sender = pc.addTrack(video_track)
 
-        await self.pc.setRemoteDescription(offer)
-        answer = await self.pc.createAnswer()
-        await self.pc.setLocalDescription(answer)
+                @pc.on("connectionstatechange")
+                async def on_connectionstatechange():
+                    if pc.connectionState in ("failed", "closed"):
+                        video_track.stop()
+
+        answer = await pc.createAnswer()
+        await pc.setLocalDescription(answer)
 
         return web.Response(
             content_type="application/json",
             text=json.dumps(
-                {"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type}
+                {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
             ),
         )
 
+    def get_video_source(self):
+        """Return the shared videoFanout (created on first use), or None if video is disabled."""
+        if self.video_cfg is None:
+            return None
+        if self.video is None:
+            cfg = self.video_cfg
+            videoFanout = lazy_import("videoFanout")
+            self.video = videoFanout.videoFanout(cfg["source"], cfg.get("width"), cfg.get("height"), cfg.get("fps", 30), cfg.get("max_viewers", videoFanout.MAX_VIEWERS), cfg.get("ladder"), cfg.get("fourcc"))
+        return self.video
+
+    def get_mjpeg_streamer(self):
+        if self.mjpeg is None and self.get_video_source() is not None:
+            cfg = self.video_cfg
+            mjpegStreamer = lazy_import("mjpegStreamer")
+            self.mjpeg = mjpegStreamer.mjpegStreamer(self.video, cfg.get("jpeg_quality", mjpegStreamer.JPEG_QUALITY), cfg.get("mjpeg_fps"))
+        return self.mjpeg
+
+    def add_video_viewer(self, name : str):
+        """Return a relayed video track for a new peer, or None if video is disabled or the viewer cap is reached."""
+        video = self.get_video_source()
+        if video is None:
+            return None
+        return video.add_viewer(name)
+
+    async def get_video_stats_handler(self, request : web.Request) -> web.Response:
+        """Frames delivered vs dropped per peer."""
+        if self.video is None:
+            return web.json_response(None)
+        stats = self.video.stats()
+        if self.mjpeg is not None:
+            stats["mjpeg"] = self.mjpeg.stats()
+        return web.json_response(stats)
+
+    async def get_mjpeg_handler(self, request : web.Request) -> web.StreamResponse:
+        """multipart/x-mixed-replace stream of JPEG frames, encoded once and shared by every viewer."""
+        streamer = self.get_mjpeg_streamer()
+        if streamer is None:
+            raise web.HTTPNotFound(text="video disabled")
+        mjpegStreamer = lazy_import("mjpegStreamer")
+        response = web.StreamResponse(headers={
+            "Content-Type": f"multipart/x-mixed-replace; boundary={mjpegStreamer.BOUNDARY}",
+            "Cache-Control": "no-store",
+        })
+        await response.prepare(request)
+        client = streamer.subscribe(f"mjpeg:{request.remote}:{id(response):x}")
+        try:
+            while True:
+                jpeg = await client.next()
+                if jpeg is None:
+                    break
+                # write() attend que la socket se vide : pendant ce temps les images suivantes sont sautées
+                await response.write(b"--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % (mjpegStreamer.BOUNDARY.encode(), len(jpeg)))
+                await response.write(jpeg)
+                await response.write(b"\r\n")
+        except (ConnectionResetError, ConnectionError):
+            pass
+        finally:
+            streamer.unsubscribe(client)
+        return response
+
+    async def get_snapshot_handler(self, request : web.Request) -> web.Response:
+        """Latest encoded frame as a single JPEG."""
+        streamer = self.get_mjpeg_streamer()
+        if streamer is None:
+            raise web.HTTPNotFound(text="video disabled")
+        jpeg = await streamer.snapshot()
+        if jpeg is None:
+            raise web.HTTPServiceUnavailable(text="no frame available")
+        return web.Response(body=jpeg, content_type="image/jpeg", headers={"Cache-Control": "no-store"})
+
     async def get_energy_handler(self, request : web.Request) -> web.Response:
-        txt = self.shared.get("energy_data")
-        return web.Response(text=txt if txt is not None else json.dumps(None))
+        data = self.telemetry.read("energy_data")
+        return web.Response(body=data if data is not None else b"null", content_type="application/json")
     
     async def get_movement_status_handler(self, request : web.Request) -> web.Response:
-        txt = self.shared.get("movement_status")
-        return web.Response(text=txt if txt is not None else json.dumps(None))
+        data = self.telemetry.read("movement_status")
+        return web.Response(body=data if data is not None else b"null", content_type="application/json")
        
-    async def get_main_page_handler(self, request : web.Request) -> web.Response:
-        return web.FileResponse(self.main_page)
+    async def get_telemetry_history_handler(self, request : web.Request) -> web.Response:
+        """Recent samples of one metric: /telemetry/history?metric=energy_data&since=<epoch s>&step=<s>&fields=a,b"""
+        if self.history is None:
+            raise web.HTTPNotFound(text="no telemetry history")
+        metric = request.query.get("metric")
+        if metric not in self.history.metrics:
+            raise web.HTTPBadRequest(text=f"metric must be one of {', '.join(self.history.metrics)}")
+        try:
+            since = float(request.query.get("since", 0))
+            step = float(request.query.get("step", 0))
+        except ValueError:
+            raise web.HTTPBadRequest(text="since and step must be numbers")
+        fields = request.query["fields"].split(",") if "fields" in request.query else None
+        return web.json_response(self.history.query(metric, since, step, fields))
+
+    async def get_metrics_handler(self, request : web.Request) -> web.Response:
+        """Prometheus text exposition of both processes' metrics."""
+        if self.metrics is None:
+            raise web.HTTPNotFound(text="no metrics block")
+        by_transport = {t: sum(1 for s in self.sessions.sessions.values() if s.transport == t) for t in metrics.TRANSPORTS}
+        extra = metrics.gauge("sessions_active", "Open client sessions per transport", by_transport, "transport")
+        extra += metrics.counter("sessions_opened_total", "Client sessions opened since start", self.sessions.opened)
+        extra += metrics.counter("sessions_reaped_total", "Idle client sessions closed since start", self.sessions.reaped)
+        extra += metrics.gauge("telemetry_subscribers", "Sessions subscribed to telemetry pushes", len(self.telemetry_hub.subscribers))
+        if self.command_mailbox is not None:
+            read = self.metrics.get(self.metrics.index("command_mailbox_read_version"))
+            extra += metrics.gauge("command_mailbox_depth", "Commands put in the mailbox and not yet read by command_worker", max(0, self.command_mailbox.version - read))
+        if self.latency is not None:
+            extra += metrics.latency_summaries(self.latency)
+        return web.Response(text=self.metrics.render(extra), content_type="text/plain", headers={"Cache-Control": "no-store"})
 
-    async def get_main_js_handler(self, request : web.Request) -> web.Response:
-        return web.FileResponse(f"{self.js_path}main.js")
+    async def get_profile_handler(self, request : web.Request) -> web.Response:
+        """Sample both processes' stacks: /debug/profile?seconds=5&interval_ms=5&process=both|api|server
 
-    async def get_web_rtc_client_js_handler(self, request : web.Request) -> web.Response:
-        return web.FileResponse(f"{self.js_path}WebRTCClient.js")
+        Needs the token (?token= or "Authorization: Bearer"). Returns collapsed stacks,
+        one "frame;frame;... count" per line, for flamegraph.pl or speedscope.
+        """
+        token = self.profile_cfg.get("token")
+        supplied = request.query.get("token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+            raise web.HTTPUnauthorized(text="profile token required")
+        try:
+            seconds = float(request.query.get("seconds", 5))
+            interval = float(request.query.get("interval_ms", profiler.SAMPLE_INTERVAL * 1000)) / 1000
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds and interval_ms must be numbers")
+        process = request.query.get("process", "both")
+        if not 0 < seconds <= profiler.MAX_SECONDS or interval <= 0 or process not in ("both", "api", "server"):
+            raise web.HTTPBadRequest(text=f"seconds must be in ]0, {profiler.MAX_SECONDS}], process one of both, api, server")
+        if self.profiling:
+            raise web.HTTPConflict(text="a profile is already running")
+        self.profiling = True
+        try:
+            loop = asyncio.get_running_loop()
+            api_request = None
+            if process != "server" and self.profile_mailbox is not None:
+                self.profile_mailbox.put(seconds, interval)
+                api_request = self.profile_mailbox.version
+            text = ""
+            if process != "api":
+                traceLog.info("profile", "Profiling web server for %.1f s", seconds)
+                counts = await loop.run_in_executor(None, profiler.stackSampler(interval).sample, seconds)
+                text += profiler.collapse(counts, "server")
+            if api_request is not None:
+                deadline = loop.time() + seconds + 5.0
+                while (api_text := self.profile_buffer.read(api_request)) is None and loop.time() < deadline:
+                    await asyncio.sleep(0.05)
+                if api_text is None:
+                    traceLog.warning("profile", "webAPI profile not received")
+                else:
+                    text += api_text
+        finally:
+            self.profiling = False
+        filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        return web.Response(text=text, content_type="text/plain", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
-    async def get_web_socket_client_js_handler(self, request : web.Request) -> web.Response:
-        return web.FileResponse(f"{self.js_path}WebSocketClient.js")
+    async def get_trace_handler(self, request : web.Request) -> web.Response:
+        """Most recent trace records of both processes: /debug/trace?n=200&level=info&category=command"""
+        if self.trace is None:
+            raise web.HTTPNotFound(text="no trace buffer")
+        try:
+            n = int(request.query.get("n", 200))
+            level = traceLog.level_value(request.query.get("level", "DEBUG"))
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response(self.trace.query(n, level, request.query.get("category")))
 
+    async def get_sessions_handler(self, request : web.Request) -> web.Response:
+        """Active sessions, their role and per-session message counters."""
+        return web.json_response(self.sessions.stats())
 
+    async def get_startup_handler(self, request : web.Request) -> web.Response:
+        """Server process startup breakdown in ms: spawn, imports, init, bind, and lazy imports done so far."""
+        return web.json_response(STARTUP)
 
-    
\ No newline at end of file
+    async def get_latency_handler(self, request : web.Request) -> web.Response:
+        """p50/p95/p99/max per stage and per transport, in milliseconds, merged from both processes."""
+        if self.latency is None:
+            return web.json_response(None)
+        return web.json_response(self.latency.report())
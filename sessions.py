@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import json
+import time
+import telemetryHub
+import commandProtocol
+import latency
+import traceLog
+
+CONTROL_TIMEOUT = 2.0  # s sans commande après lesquelles le contrôle peut être pris par une autre session
+IDLE_TIMEOUT = 30.0  # s sans aucun message avant qu'une session soit fermée
+REAP_INTERVAL = 5.0  # période de recherche des sessions inactives (s)
+
+ROLE_CONTROLLER = "controller"
+ROLE_OBSERVER = "observer"
+
+
+class clientSession:
+    """État d'une connexion cliente (WebSocket ou DataChannel).
+
+    `send` envoie un message texte (fonction ou coroutine), `buffered` renvoie le
+    nombre d'octets en attente sur le transport, `close` ferme le transport.
+    """
+    def __init__(self, session_id : int, transport : str, send, buffered, name : str, close=None) -> None:
+        self.id = session_id
+        self.transport = transport
+        self.transport_id = latency.TRANSPORTS.index(transport)
+        self.name = name
+        self.subscriber = telemetryHub.telemetrySubscriber(send, buffered, name)
+        self.protocol = commandProtocol.PROTOCOL_JSON
+        self.filter = commandProtocol.commandFilter()
+        self._close = close
+        self.role = ROLE_OBSERVER
+        self.created = time.monotonic()
+        self.last_seen = self.created
+        self.last_command = 0.0
+        self.messages = 0
+        self.bytes_in = 0
+        self.commands = 0
+        self.rejected = 0  # commandes refusées car la session n'a pas le contrôle
+
+    def touch(self, now : float, size : int = 0):
+        self.last_seen = now
+        self.messages += 1
+        self.bytes_in += size
+
+    def send(self, text : str):
+        self.subscriber.send(text)
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+    def info(self, now : float) -> dict:
+        return {
+            "id": self.id,
+            "transport": self.transport,
+            "name": self.name,
+            "role": self.role,
+            "protocol": self.protocol,
+            "age_s": round(now - self.created, 1),
+            "idle_s": round(now - self.last_seen, 1),
+            "messages": self.messages,
+            "bytes_in": self.bytes_in,
+            "commands": self.commands,
+            "rejected": self.rejected,
+            "out_of_order": self.filter.out_of_order,
+            "stale": self.filter.stale,
+        }
+
+
+class sessionRegistry:
+    """Toutes les sessions clientes du serveur, indexées par identifiant.
+
+    Une seule session pilote le robot à la fois (le contrôleur) ; les autres sont
+    des observateurs en lecture seule (télémétrie, vidéo). Une session prend le
+    contrôle en envoyant une commande quand personne ne l'a, ou quand le contrôleur
+    n'a rien envoyé depuis `control_timeout` secondes ; `claim(force=True)` le prend
+    dans tous les cas. Avec `shared_control`, toutes les sessions pilotent.
+    Les sessions muettes depuis `idle_timeout` sont fermées.
+    broadcast() sérialise le message une seule fois pour toutes les sessions.
+    """
+    def __init__(self, control_timeout=CONTROL_TIMEOUT, idle_timeout=IDLE_TIMEOUT, reap_interval=REAP_INTERVAL, shared_control=False):
+        self.control_timeout = control_timeout
+        self.shared_control = shared_control
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.sessions = {}
+        self.controller = None
+        self._ids = itertools.count(1)
+        self.opened = 0
+        self.reaped = 0
+        self.rejected = 0
+        self.task = None
+
+    def open(self, transport : str, send, buffered, name : str, close=None) -> clientSession:
+        session = clientSession(next(self._ids), transport, send, buffered, name, close)
+        self.sessions[session.id] = session
+        self.opened += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.reap())
+        return session
+
+    def close(self, session : clientSession):
+        if self.sessions.pop(session.id, None) is None:
+            return
+        if self.controller is session:
+            self._set_controller(None)
+
+    def get(self, session_id : int):
+        return self.sessions.get(session_id)
+
+    def _set_controller(self, session):
+        if self.controller is not None:
+            self.controller.role = ROLE_OBSERVER
+        self.controller = session
+        if session is not None:
+            session.role = ROLE_CONTROLLER
+            session.last_command = time.monotonic()
+        self.broadcast({"type": "control", "controller": session.id if session is not None else None})
+
+    def claim(self, session : clientSession, force : bool = False) -> bool:
+        """Give control to `session` if it is free, abandoned, or `force` is set."""
+        if self.controller is session:
+            return True
+        current = self.controller
+        if force or current is None or time.monotonic() - current.last_command > self.control_timeout:
+            self._set_controller(session)
+            return True
+        return False
+
+    def release(self, session : clientSession):
+        if self.controller is session:
+            self._set_controller(None)
+
+    def may_command(self, session : clientSession, now : float) -> bool:
+        """True if `session` holds (or just took) control; counts the command either way."""
+        if not self.shared_control and self.controller is not session and not self.claim(session):
+            session.rejected += 1
+            self.rejected += 1
+            return False
+        session.commands += 1
+        session.last_command = now
+        return True
+
+    def broadcast(self, msg : dict, role : str = None):
+        """Send `msg` to every session (or only those with `role`), serialized once."""
+        text = json.dumps(msg)
+        for session in list(self.sessions.values()):
+            if role is not None and session.role != role:
+                continue
+            try:
+                session.send(text)
+            except Exception:
+                traceLog.warning("session", "Broadcast to session %d failed", session.id)
+
+    async def reap(self):
+        while self.sessions:
+            await asyncio.sleep(self.reap_interval)
+            limit = time.monotonic() - self.idle_timeout
+            for session in [s for s in self.sessions.values() if s.last_seen < limit]:
+                traceLog.info("session", "Closing idle session %d (%s)", session.id, session.name)
+                self.reaped += 1
+                self.close(session)
+                session.close()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "active": len(self.sessions),
+            "opened": self.opened,
+            "reaped": self.reaped,
+            "rejected": self.rejected,
+            "controller": self.controller.id if self.controller is not None else None,
+            "sessions": [s.info(now) for s in self.sessions.values()],
+        }
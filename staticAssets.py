@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+from aiohttp import web
+import traceLog
+
+try:
+    import brotli  # facultatif : variante br en plus de gzip
+except ImportError:
+    brotli = None
+
+ASSET_EXTENSIONS = (".html", ".js", ".css", ".json", ".svg", ".png", ".ico")
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_SIZE = 256  # en dessous, la compression ne rapporte rien
+CACHE_CONTROL = "no-cache"  # le navigateur garde la ressource mais revalide (304) à chaque chargement
+RELOAD_CHECK_INTERVAL = 1.0  # en mode rechargement, délai minimal entre deux vérifications d'un fichier (s)
+
+
+def parse_accept_encoding(header : str) -> dict:
+    """Content-coding -> q-value of an Accept-Encoding header (codings in lower case)."""
+    weights = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    return weights
+
+
+class staticAsset:
+    """Un fichier servi depuis la mémoire, avec ses variantes compressées et son ETag."""
+    def __init__(self, path : str) -> None:
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.load()
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            body = f.read()
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.checked = time.monotonic()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {"identity": body}
+        if len(body) >= MIN_COMPRESS_SIZE and self.content_type.startswith(COMPRESSIBLE):
+            self.variants["gzip"] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body)
+        # ETag fort : un par représentation (chaque encodage a ses propres octets)
+        self.etags = {encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"' for encoding in self.variants}
+
+    def refresh(self, now : float):
+        """Reload the file if its mtime changed (checked at most every RELOAD_CHECK_INTERVAL)."""
+        if now - self.checked < RELOAD_CHECK_INTERVAL:
+            return
+        self.checked = now
+        try:
+            if os.stat(self.path).st_mtime_ns != self.mtime:
+                traceLog.info("static", "Reloading static asset %s", self.path)
+                self.load()
+        except OSError:
+            pass  # fichier en cours de remplacement : on garde la version en mémoire
+
+    def encoding_for(self, accept_encoding : str) -> str:
+        """The variant with the highest q-value in `accept_encoding` (br before gzip when equal), else identity."""
+        weights = parse_accept_encoding(accept_encoding)
+        default = weights.get("*", 0.0)  # "*" : tout codage non cité
+        best, best_q = "identity", 0.0
+        for encoding in ("br", "gzip"):
+            q = weights.get(encoding, default)
+            if encoding in self.variants and q > best_q:
+                best, best_q = encoding, q
+        return best
+
+
+class staticAssets:
+    """Pages et scripts du tableau de bord, chargés en mémoire au démarrage.
+
+    Chaque fichier est lu une fois, compressé à l'avance (gzip, et brotli si le
+    module est installé) et identifié par un ETag fort : une requête avec
+    If-None-Match à jour reçoit un 304 sans corps, les autres la variante
+    acceptée par le navigateur, sans accès disque. `reload=True` relit un
+    fichier modifié sur le disque (pratique pendant le développement).
+    Usage :
+      assets = staticAssets("indexV2.html", "javaScript/")
+      app.router.add_get("/", assets.handler)
+      app.router.add_get(assets.prefix + "{name}", assets.handler)
+    """
+    def __init__(self, main_page : str, js_path : str, reload : bool = False) -> None:
+        self.reload = reload
+        self.assets = {}
+        self.hits = 0
+        self.not_modified = 0
+        self.add("/", main_page)
+        self.prefix = "/" + js_path.strip("/") + "/"  # URL des scripts, à utiliser pour la route
+        for name in sorted(os.listdir(js_path)):
+            path = os.path.join(js_path, name)
+            if os.path.isfile(path) and name.endswith(ASSET_EXTENSIONS):
+                self.add(self.prefix + name, path)
+
+    def add(self, url : str, path : str):
+        self.assets[url] = staticAsset(path)
+
+    async def handler(self, request : web.Request) -> web.Response:
+        asset = self.assets.get(request.path)
+        if asset is None:
+            raise web.HTTPNotFound()
+        if self.reload:
+            asset.refresh(time.monotonic())
+        self.hits += 1
+        encoding = asset.encoding_for(request.headers.get("Accept-Encoding", ""))
+        headers = {"ETag": asset.etags[encoding], "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if asset.etags[encoding] in request.headers.get("If-None-Match", ""):
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return web.Response(body=asset.variants[encoding], content_type=asset.content_type, headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            "assets": {url: {k: len(v) for k, v in a.variants.items()} for url, a in self.assets.items()},
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+        }
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from aiohttp import web
+
+# Simulateur local du serveur de suivi (proj103.r2.enst.fr) pour tester et
+# mesurer clientInServer.webClient sans réseau.
+#   py suiviSimulator.py --port 8081 --latency 0.02 --error-503 0.05
+# Latence, taux d'erreurs (400/401/503) et débit maximal sont configurables ;
+# GET /sim/stats renvoie les compteurs de requêtes.
+
+HOST = "127.0.0.1"
+PORT = 8081
+FLAG_PATTERNS = [
+    [{"id": i, "sector": i % 4, "inner": i % 2} for i in range(8)],
+    [{"id": i, "sector": (i * 3) % 4, "inner": (i + 1) % 2} for i in range(12)],
+]
+
+
+class suiviSimulator:
+    def __init__(self, latency=0.0, jitter=0.0, error_400=0.0, error_401=0.0, error_503=0.0, max_rps=None, require_race=False, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = ((400, error_400), (401, error_401), (503, error_503))
+        self.max_rps = max_rps
+        self.require_race = require_race
+        self.random = random.Random(seed)
+        self.race_running = False
+        self.pattern = 0
+        self.captured = set()
+        self.registers = {}
+        self.positions = {}
+        self.stats = {"requests": 0, "throttled": 0, "status": {}, "endpoints": {}}
+        self._tokens = float(max_rps) if max_rps else 0.0
+        self._tokens_at = time.monotonic()
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.router.add_post("/api/pos", self.pos)
+        self.app.router.add_get("/api/list", self.list_flags)
+        self.app.router.add_post("/api/marker", self.marker)
+        self.app.router.add_get("/api/status", self.status)
+        self.app.router.add_get("/api/udta", self.read_register)
+        self.app.router.add_post("/api/udta", self.write_register)
+        self.app.router.add_post("/api/start", self.start)
+        self.app.router.add_post("/api/stop", self.stop)
+        self.app.router.add_get("/api/pattern", self.get_pattern)
+        self.app.router.add_post("/api/pattern", self.select_pattern)
+        self.app.router.add_get("/sim/stats", self.get_stats)
+
+    def _take_token(self):
+        if not self.max_rps:
+            return True
+        now = time.monotonic()
+        self._tokens = min(float(self.max_rps), self._tokens + (now - self._tokens_at) * self.max_rps)
+        self._tokens_at = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        if request.path.startswith("/sim/"):
+            return await handler(request)
+        self.stats["requests"] += 1
+        self.stats["endpoints"][request.path] = self.stats["endpoints"].get(request.path, 0) + 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        if not self._take_token():
+            self.stats["throttled"] += 1
+            response = web.Response(status=503, text="throughput cap reached")
+        else:
+            response = None
+            for status, rate in self.errors:
+                if rate and self.random.random() < rate:
+                    response = web.Response(status=status, text=f"simulated {status}")
+                    break
+            if response is None:
+                response = await handler(request)
+        self.stats["status"][response.status] = self.stats["status"].get(response.status, 0) + 1
+        return response
+
+    def _race_required(self):
+        if self.require_race and not self.race_running:
+            return web.Response(status=503, text="no exam is running")
+        return None
+
+    async def pos(self, request):
+        if (resp := self._race_required()) is not None:
+            return resp
+        try:
+            self.positions[request.query.get("t")] = (float(request.query["x"]), float(request.query["y"]))
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="x and y are required")
+        return web.Response(text="OK")
+
+    async def list_flags(self, request):
+        flags = [dict(f, captured=f["id"] in self.captured) for f in FLAG_PATTERNS[self.pattern]]
+        return web.json_response(flags)
+
+    async def marker(self, request):
+        if (resp := self._race_required()) is not None:
+            return resp
+        try:
+            self.captured.add(int(request.query["id"]))
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="id is required")
+        return web.Response(text="OK")
+
+    async def status(self, request):
+        return web.json_response({"running": self.race_running, "pattern": self.pattern, "captured": len(self.captured)})
+
+    async def read_register(self, request):
+        try:
+            idx = int(request.query["idx"])
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="idx is required")
+        return web.json_response(self.registers.get((request.query.get("t"), idx), 0))
+
+    async def write_register(self, request):
+        try:
+            idx, val = int(request.query["idx"]), int(request.query["all"])
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="idx and all are required")
+        self.registers[(request.query.get("t"), idx)] = val
+        return web.Response(text="OK")
+
+    async def start(self, request):
+        self.race_running = True
+        self.captured.clear()
+        return web.Response(text="OK")
+
+    async def stop(self, request):
+        self.race_running = False
+        return web.Response(text="OK")
+
+    async def get_pattern(self, request):
+        return web.json_response(self.pattern)
+
+    async def select_pattern(self, request):
+        try:
+            idx = int(request.query["idx"])
+            FLAG_PATTERNS[idx]
+        except (KeyError, ValueError, IndexError):
+            return web.Response(status=400, text="unknown pattern")
+        self.pattern = idx
+        self.captured.clear()
+        return web.Response(text="OK")
+
+    async def get_stats(self, request):
+        return web.Response(text=json.dumps(self.stats, default=str), content_type="application/json")
+
+    async def start_server(self, host=HOST, port=PORT):
+        """Run the simulator on the current loop; returns the AppRunner to clean up."""
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the tracking server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per request (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform latency jitter (s)")
+    parser.add_argument("--error-400", type=float, default=0.0, help="fraction of requests answered 400")
+    parser.add_argument("--error-401", type=float, default=0.0, help="fraction of requests answered 401")
+    parser.add_argument("--error-503", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--max-rps", type=float, default=None, help="throughput cap, excess requests get 503")
+    parser.add_argument("--require-race", action="store_true", help="answer 503 to positions and captures while no race runs")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def simulator_from_args(args):
+    return suiviSimulator(args.latency, args.jitter, args.error_400, args.error_401, args.error_503, args.max_rps, args.require_race, args.seed)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"Tracking server simulator at http://{args.host}:{args.port}")
+    web.run_app(simulator_from_args(args).app, host=args.host, port=args.port)
@@ -0,0 +1,182 @@
+import bisect
+import json
+import math
+import struct
+import time
+from multiprocessing import shared_memory
+
+CAPACITY = 3600  # échantillons gardés par métrique
+MAX_FIELDS = 16  # champs numériques suivis par métrique
+NAMES_SIZE = 1024  # place réservée à la liste JSON des noms de champs
+NAMES_READ_RETRIES = 100  # relectures des noms tant que l'écrivain les réécrit
+
+
+def flatten(document, prefix=""):
+    """Numeric fields of a JSON-like document, nested keys joined with '.'."""
+    fields = {}
+    if isinstance(document, dict):
+        for key, value in document.items():
+            fields.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(document, (bool, int, float)):
+        fields[prefix[:-1] or "value"] = float(document)
+    return fields
+
+
+class telemetryHistory:
+    """Historique récent de chaque métrique de télémétrie, en mémoire partagée.
+
+    Par métrique, un anneau de CAPACITY enregistrements float64 :
+    horodatage (time.monotonic(), donc croissant même si l'horloge murale est
+    recalée) puis jusqu'à MAX_FIELDS champs numériques (NaN si absent) ; `query`
+    convertit en heure murale à la lecture.
+    Les noms de champs sont ajoutés au fil des échantillons, sans changer la place
+    des champs déjà connus. Écrivain unique (boucle de webAPI) ; le processus
+    serveur lit sans verrou : un compteur d'écritures relu après la copie écarte
+    les enregistrements écrasés pendant la lecture, et la version des noms est
+    impaire pendant leur réécriture (relue après la copie, comme un seqlock).
+    """
+    _HEADER = struct.Struct("<QQI")  # enregistrements écrits, version des noms, longueur des noms
+
+    def __init__(self, metrics=("energy_data", "movement_status"), capacity=CAPACITY, max_fields=MAX_FIELDS):
+        self.metrics = tuple(metrics)
+        self.capacity = capacity
+        self.max_fields = max_fields
+        self.shm = shared_memory.SharedMemory(create=True, size=self._stride() * len(self.metrics))
+        self.shm.buf[:] = bytes(self.shm.size)
+        self._attach()
+
+    def _stride(self):
+        return self._HEADER.size + NAMES_SIZE + 8 * self.capacity * (1 + self.max_fields)
+
+    def __getstate__(self):
+        return {"metrics": self.metrics, "capacity": self.capacity, "max_fields": self.max_fields, "shm": self.shm}
+
+    def __setstate__(self, state):
+        self.metrics = state["metrics"]
+        self.capacity = state["capacity"]
+        self.max_fields = state["max_fields"]
+        self.shm = state["shm"]
+        self._attach()
+
+    def _attach(self):
+        stride = self._stride()
+        records_offset = self._HEADER.size + NAMES_SIZE
+        self._offsets = {m: i * stride for i, m in enumerate(self.metrics)}
+        self._records = {
+            m: self.shm.buf[offset + records_offset:offset + stride].cast("d")
+            for m, offset in self._offsets.items()
+        }
+        self._names = {m: [] for m in self.metrics}
+        self._names_version = {m: 0 for m in self.metrics}
+        self._row = [math.nan] * (1 + self.max_fields)
+
+    def _read_names(self, metric):
+        offset = self._offsets[metric]
+        start = offset + self._HEADER.size
+        for _ in range(NAMES_READ_RETRIES):
+            _, version, length = self._HEADER.unpack_from(self.shm.buf, offset)
+            if version == self._names_version[metric]:
+                break
+            if version % 2:
+                continue  # réécriture en cours
+            data = bytes(self.shm.buf[start:start + length])
+            if self._HEADER.unpack_from(self.shm.buf, offset)[1] == version:
+                self._names[metric] = json.loads(data)
+                self._names_version[metric] = version
+                break
+        # sinon : l'écrivain est toujours en train d'écrire, on garde la dernière liste cohérente
+        return self._names[metric]
+
+    def append(self, metric, timestamp, document):
+        """Record the numeric fields of `document` at `timestamp` (time.monotonic() seconds)."""
+        offset = self._offsets[metric]
+        count, version, length = self._HEADER.unpack_from(self.shm.buf, offset)
+        names = self._names[metric]
+        row = self._row
+        row[0] = timestamp
+        for i in range(1, len(row)):
+            row[i] = math.nan
+        for name, value in flatten(document).items():
+            try:
+                i = names.index(name)
+            except ValueError:
+                if len(names) >= self.max_fields:
+                    continue
+                names.append(name)
+                encoded = json.dumps(names).encode()
+                if len(encoded) > NAMES_SIZE:
+                    names.pop()
+                    continue
+                start = offset + self._HEADER.size
+                self._HEADER.pack_into(self.shm.buf, offset, count, version + 1, length)  # impaire : noms en cours d'écriture
+                self.shm.buf[start:start + len(encoded)] = encoded
+                version, length = version + 2, len(encoded)
+                self._HEADER.pack_into(self.shm.buf, offset, count, version, length)
+                self._names_version[metric] = version
+                i = len(names) - 1
+            row[1 + i] = value
+        records = self._records[metric]
+        slot = (count % self.capacity) * len(row)
+        for i, value in enumerate(row):
+            records[slot + i] = value
+        self._HEADER.pack_into(self.shm.buf, offset, count + 1, version, length)
+
+    def query(self, metric, since=0.0, step=0.0, fields=None):
+        """Samples of `metric` newer than `since`, averaged over `step`-second buckets if step > 0.
+
+        `since` and the returned times are seconds since the epoch, converted from the
+        stored monotonic times with the current clock offset.
+        Returns {"fields": [...], "t": [...], "values": {field: [...]}} (NaN written as None).
+        """
+        wall_offset = time.time() - time.monotonic()
+        since -= wall_offset
+        names = self._read_names(metric)
+        wanted = [n for n in names if fields is None or n in fields]
+        columns = [1 + names.index(n) for n in wanted]
+        width = 1 + self.max_fields
+        records = self._records[metric]
+        offset = self._offsets[metric]
+        count = self._HEADER.unpack_from(self.shm.buf, offset)[0]
+        first = max(0, count - self.capacity)
+
+        def timestamp(i):
+            return records[(i % self.capacity) * width]
+        # enregistrements triés par horodatage : recherche dichotomique du premier après `since`
+        start = bisect.bisect_right(range(first, count), since, key=timestamp) + first
+        rows = []
+        for i in range(start, count):
+            slot = (i % self.capacity) * width
+            rows.append((records[slot] + wall_offset, [records[slot + c] for c in columns]))
+        # l'écrivain a pu recouvrir le début de l'anneau pendant la copie (écriture en cours comprise)
+        overwritten = self._HEADER.unpack_from(self.shm.buf, offset)[0] + 1 - self.capacity
+        if overwritten > start:
+            rows = rows[overwritten - start:]
+
+        if step > 0 and rows:
+            buckets = []
+            for t, values in rows:
+                key = math.floor(t / step)
+                if not buckets or buckets[-1][0] != key:
+                    buckets.append([key, [0.0] * len(values), [0] * len(values)])
+                sums, counts = buckets[-1][1], buckets[-1][2]
+                for j, v in enumerate(values):
+                    if not math.isnan(v):
+                        sums[j] += v
+                        counts[j] += 1
+            rows = [((key + 0.5) * step, [s / c if c else math.nan for s, c in zip(sums, counts)]) for key, sums, counts in buckets]
+
+        return {
+            "metric": metric,
+            "fields": wanted,
+            "t": [t for t, _ in rows],
+            "values": {name: [None if math.isnan(values[j]) else values[j] for _, values in rows] for j, name in enumerate(wanted)},
+        }
+
+    def close(self):
+        for view in self._records.values():
+            view.release()
+        self._records = {}
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import time
+import tool
+import traceLog
+
+POLL_INTERVAL = 0.01  # période de scrutation des versions du bloc de télémétrie (s)
+MAX_BUFFERED = 64 * 1024  # au-delà, un abonné est considéré trop lent et abandonné
+DEFAULT_MAX_RATE = 10.0  # mises à jour par seconde et par abonné
+
+
+class telemetrySubscriber:
+    """Un abonné télémétrie attaché à une connexion (WebSocket ou DataChannel).
+
+    `send` envoie un message texte (fonction ou coroutine),
+    `buffered` renvoie le nombre d'octets encore en attente d'envoi sur le transport.
+    Seule la dernière poussée de télémétrie (`push`) compte pour `busy()` : les
+    autres réponses (hello, claim...) passent par `send` sans rendre l'abonné occupé.
+    """
+    def __init__(self, send, buffered, name=""):
+        self._send = send
+        self.buffered = buffered
+        self.name = name
+        self.metrics = ()
+        self.min_interval = 1.0 / DEFAULT_MAX_RATE
+        self.next_send = 0.0
+        self.last_sent = {}
+        self._pending_push = None
+        self._sending = set()
+
+    def busy(self):
+        return self._pending_push is not None and not self._pending_push.done()
+
+    def send(self, text):
+        res = self._send(text)
+        if asyncio.iscoroutine(res):
+            future = asyncio.ensure_future(res)
+            self._sending.add(future)
+            future.add_done_callback(self._sent)
+            return future
+
+    def push(self, text):
+        """Send a telemetry update; busy() stays true until it is sent."""
+        self._pending_push = self.send(text)
+
+    def _sent(self, future):
+        self._sending.discard(future)
+        # transport fermé pendant l'envoi : la fermeture de la session suit, on ne fait que tracer
+        if not future.cancelled() and future.exception() is not None:
+            traceLog.debug("session", "Send to %s failed: %r", self.name, future.exception())
+
+
+def _delta(previous, current):
+    """Champs modifiés entre deux documents ; le document entier s'il ne s'agit pas de dicts."""
+    if not isinstance(previous, dict) or not isinstance(current, dict):
+        return current
+    return {k: v for k, v in current.items() if k not in previous or previous[k] != v}
+
+
+class telemetryHub:
+    """Pousse la télémétrie aux abonnés, seulement quand elle change.
+
+    Une seule tâche scrute les versions du tool.TelemetryBlock (lecture mémoire,
+    pas d'appel système) ; chaque nouvelle version est décodée une fois puis
+    envoyée en delta à chaque abonné, au plus à `max_rate` messages/s par abonné
+    (les changements intermédiaires sont fusionnés). Un abonné dont le transport
+    n'arrive pas à suivre est désabonné au lieu d'accumuler des messages.
+    """
+    def __init__(self, telemetry : tool.TelemetryBlock, metrics=("energy_data", "movement_status"), poll_interval=POLL_INTERVAL, max_buffered=MAX_BUFFERED):
+        self.telemetry = telemetry
+        self.metrics = metrics
+        self.poll_interval = poll_interval
+        self.max_buffered = max_buffered
+        self.subscribers = set()
+        self.versions = {m: 0 for m in metrics}
+        self.documents = {}
+        self.task = None
+
+    def subscribe(self, sub : telemetrySubscriber, metrics=None, max_rate=None):
+        sub.metrics = tuple(m for m in (metrics or self.metrics) if m in self.versions)
+        if max_rate:
+            sub.min_interval = 1.0 / float(max_rate)
+        sub.next_send = 0.0
+        sub.last_sent = {}
+        self.subscribers.add(sub)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def unsubscribe(self, sub : telemetrySubscriber):
+        self.subscribers.discard(sub)
+
+    def _refresh(self):
+        for metric in self.metrics:
+            version = self.telemetry.version(metric)
+            if version != self.versions[metric]:
+                self.versions[metric] = version
+                data = self.telemetry.read(metric)
+                self.documents[metric] = json.loads(data) if data is not None else None
+
+    def _push(self, sub, now):
+        if now < sub.next_send:
+            return
+        if sub.busy() or sub.buffered() > self.max_buffered:
+            traceLog.warning("telemetry", "Telemetry subscriber %s too slow, dropping subscription", sub.name)
+            self.unsubscribe(sub)
+            return
+        changes = {}
+        for metric in sub.metrics:
+            if metric not in self.documents:
+                continue
+            current = self.documents[metric]
+            if metric in sub.last_sent:
+                if sub.last_sent[metric] is current:
+                    continue
+                delta = _delta(sub.last_sent[metric], current)
+                if delta == {}:
+                    sub.last_sent[metric] = current
+                    continue
+            else:
+                delta = current
+            changes[metric] = delta
+            sub.last_sent[metric] = current
+        if changes:
+            try:
+                sub.push(json.dumps({"type": "telemetry", "data": changes}))
+            except Exception:
+                traceLog.warning("telemetry", "Telemetry push to %s failed, dropping subscription", sub.name)
+                self.unsubscribe(sub)
+                return
+            sub.next_send = now + sub.min_interval
+
+    async def run(self):
+        while self.subscribers:
+            self._refresh()
+            now = time.monotonic()
+            for sub in list(self.subscribers):
+                self._push(sub, now)
+            await asyncio.sleep(self.poll_interval)
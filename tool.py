@@ -1,27 +1,220 @@
 import asyncio
-from multiprocessing import SimpleQueue
-import threading
+import os
+import struct
+import sys
+from multiprocessing import reduction, shared_memory
+import traceLog
 
-class Queue:
-    def __init__(self, loop=None):
+# Windows : pas de pipe non bloquant avant Python 3.12, et la boucle Proactor n'a pas
+# add_reader ; la boucle lectrice scrute alors la version (cf. Mailbox.attach)
+WAKEUP_PIPE = sys.platform != "win32"
+POLL_INTERVAL = 0.002  # période de scrutation de la version quand add_reader n'est pas disponible (s)
+READ_RETRIES = 10000  # lectures déchirées tolérées par Mailbox.get avant d'abandonner (écrivain mort en pleine écriture)
+
+
+class Mailbox:
+    """Boîte aux lettres inter-processus qui ne garde que la dernière valeur.
+
+    La valeur est écrite dans un segment `multiprocessing.shared_memory` protégé
+    par un seqlock (compteur impair pendant l'écriture), donc ni pickling ni
+    thread relais. Un pipe non bloquant sert de réveil : le processus lecteur
+    l'enregistre avec `loop.add_reader` et `event` est levé à chaque nouvelle
+    valeur. Sans add_reader (Windows, boucle Proactor), une tâche de la boucle
+    scrute la version toutes les POLL_INTERVAL secondes à la place.
+    Les valeurs intermédiaires non lues sont écrasées, jamais mises en file.
+
+    `fmt` est un format `struct` décrivant la valeur (ex. "dd" pour x, y).
+    Un format vide donne un simple compteur d'évènements (cf. `version`).
+    Un seul processus écrivain par boîte.
+    Se transmet aussi à un processus démarré en spawn/forkserver (le segment est
+    rouvert par son nom, les descripteurs du pipe sont dupliqués au lancement).
+    """
+    _SEQ = struct.Struct("<Q")
+
+    def __init__(self, fmt=""):
+        self._fmt = fmt
+        self._struct = struct.Struct("<" + fmt)
+        self.shm = shared_memory.SharedMemory(create=True, size=self._SEQ.size + max(self._struct.size, 1))
+        self._SEQ.pack_into(self.shm.buf, 0, 0)
+        self._rfd = self._wfd = None
+        if WAKEUP_PIPE:
+            self._rfd, self._wfd = os.pipe()
+            os.set_blocking(self._rfd, False)
+            os.set_blocking(self._wfd, False)
+        self.event = None
+        self.loop = None
+        self._poller = None
+
+    def __getstate__(self):
+        # uniquement pendant le lancement d'un processus enfant (DupFd)
+        state = {"fmt": self._fmt, "shm": self.shm, "rfd": None, "wfd": None}
+        if self._rfd is not None:
+            state["rfd"], state["wfd"] = reduction.DupFd(self._rfd), reduction.DupFd(self._wfd)
+        return state
+
+    def __setstate__(self, state):
+        self._fmt = state["fmt"]
+        self._struct = struct.Struct("<" + self._fmt)
+        self.shm = state["shm"]
+        self._rfd = state["rfd"].detach() if state["rfd"] is not None else None
+        self._wfd = state["wfd"].detach() if state["wfd"] is not None else None
+        self.event = None
+        self.loop = None
+        self._poller = None
+
+    def put(self, *values):
+        buf = self.shm.buf
+        seq = self._SEQ.unpack_from(buf, 0)[0]
+        self._SEQ.pack_into(buf, 0, seq + 1)
+        self._struct.pack_into(buf, self._SEQ.size, *values)
+        self._SEQ.pack_into(buf, 0, seq + 2)
+        if self._wfd is None:
+            return
+        try:
+            os.write(self._wfd, b"\0")
+        except BlockingIOError:
+            # pipe plein : le lecteur a déjà un réveil en attente
+            pass
+
+    @property
+    def version(self):
+        """Nombre de valeurs publiées depuis la création."""
+        return self._SEQ.unpack_from(self.shm.buf, 0)[0] >> 1
+
+    def get(self):
+        """Return (version, values) for the latest value, or None if nothing was put yet (or no consistent read after READ_RETRIES)."""
+        buf = self.shm.buf
+        for _ in range(READ_RETRIES):
+            s1 = self._SEQ.unpack_from(buf, 0)[0]
+            if s1 & 1:
+                continue
+            values = self._struct.unpack_from(buf, self._SEQ.size)
+            if self._SEQ.unpack_from(buf, 0)[0] == s1:
+                return None if s1 == 0 else (s1 >> 1, values)
+        traceLog.warning("mailbox", "Mailbox read gave up after %d torn reads (writer stopped mid-write?)", READ_RETRIES)
+        return None
+
+    def fileno(self):
+        return self._rfd
+
+    def attach(self, loop):
+        """Watch for new values from `loop`; `event` is set on each new value. Thread-safe."""
+        self.loop = loop
         self.event = asyncio.Event()
-        self.mp_q = SimpleQueue()
-        self.latest_val = None
-        self.running = True
-        self.thread = threading.Thread(target=self.thread_target, daemon=True)
-        self.loop = loop if loop is not None else asyncio.get_event_loop()
-        self.thread.start()
-    
-    def thread_target(self):
-        while self.running:
-            item = self.mp_q.get()
-            def _set():
-                self.latest_val = item
+        loop.call_soon_threadsafe(self._watch)
+
+    def _watch(self):
+        if self._rfd is not None:
+            try:
+                self.loop.add_reader(self._rfd, self._on_wakeup)
+                return
+            except NotImplementedError:
+                pass
+        traceLog.info("mailbox", "add_reader unavailable, polling the mailbox every %.0f ms", POLL_INTERVAL * 1000)
+        self._poller = self.loop.create_task(self._poll())
+
+    async def _poll(self):
+        seen = self._SEQ.unpack_from(self.shm.buf, 0)[0]
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            seq = self._SEQ.unpack_from(self.shm.buf, 0)[0]
+            if seq != seen and not seq & 1:
+                seen = seq
                 self.event.set()
-            self.loop.call_soon_threadsafe(_set)
 
+    def _on_wakeup(self):
+        try:
+            while os.read(self._rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.event.set()
+
+    def close(self):
+        if self.loop is not None and not self.loop.is_closed():
+            if self._poller is not None:
+                self.loop.call_soon_threadsafe(self._poller.cancel)
+            elif self._rfd is not None:
+                self.loop.call_soon_threadsafe(self.loop.remove_reader, self._rfd)
+        self.loop = None
+        self._poller = None
+        for fd in (self._rfd, self._wfd):
+            if fd is None:
+                continue
+            try: os.close(fd)
+            except OSError: pass
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class TelemetryBlock:
+    """Bloc de télémétrie en mémoire partagée, à disposition fixe.
+
+    Chaque slot nommé contient un document JSON déjà sérialisé (bytes) précédé
+    d'un compteur de version (seqlock) et de sa longueur. L'écrivain (boucle de
+    webAPI) publie avec `write`, le lecteur (processus serveur) lit avec `read`
+    sans appel système ni aller-retour IPC : une version impaire ou modifiée
+    pendant la copie signale une lecture déchirée et la lecture est refaite.
+    Le lecteur garde en cache les bytes de la dernière version lue.
+    """
+    _HEADER = struct.Struct("<QI")  # seq, length
+
+    def __init__(self, slots=("energy_data", "movement_status"), slot_size=4096):
+        self.slot_size = slot_size
+        stride = self._HEADER.size + slot_size
+        self._offsets = {name: i * stride for i, name in enumerate(slots)}
+        self.shm = shared_memory.SharedMemory(create=True, size=stride * len(slots))
+        for offset in self._offsets.values():
+            self._HEADER.pack_into(self.shm.buf, offset, 0, 0)
+        self._cache = {}
+
+    def __getstate__(self):
+        return {"slot_size": self.slot_size, "offsets": self._offsets, "shm": self.shm}
+
+    def __setstate__(self, state):
+        self.slot_size = state["slot_size"]
+        self._offsets = state["offsets"]
+        self.shm = state["shm"]
+        self._cache = {}
+
+    def write(self, name, data : bytes):
+        if len(data) > self.slot_size:
+            raise ValueError(f"Telemetry '{name}' is {len(data)} bytes, slot holds {self.slot_size}")
+        buf = self.shm.buf
+        offset = self._offsets[name]
+        seq = self._HEADER.unpack_from(buf, offset)[0]
+        self._HEADER.pack_into(buf, offset, seq + 1, len(data))
+        start = offset + self._HEADER.size
+        buf[start:start + len(data)] = data
+        self._HEADER.pack_into(buf, offset, seq + 2, len(data))
+
+    def version(self, name):
+        return self._HEADER.unpack_from(self.shm.buf, self._offsets[name])[0] >> 1
 
-        
+    def read(self, name):
+        """Return the latest bytes written to `name`, or None if nothing was written yet."""
+        buf = self.shm.buf
+        offset = self._offsets[name]
+        start = offset + self._HEADER.size
+        while True:
+            seq, length = self._HEADER.unpack_from(buf, offset)
+            if seq & 1:
+                continue
+            cached = self._cache.get(name)
+            if cached is not None and cached[0] == seq:
+                return cached[1]
+            data = bytes(buf[start:start + length])
+            if self._HEADER.unpack_from(buf, offset)[0] == seq:
+                if seq == 0:
+                    return None
+                self._cache[name] = (seq, data)
+                return data
 
+    def close(self):
+        self._cache.clear()
+        self.shm.close()
 
-    
\ No newline at end of file
+    def unlink(self):
+        self.shm.unlink()
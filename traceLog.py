@@ -0,0 +1,259 @@
+import collections
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+LEVEL = INFO  # niveau minimal enregistré
+CONSOLE_LEVEL = WARNING  # niveau minimal recopié sur la console (par le thread d'écriture)
+SAMPLING = {"command": 50}  # catégorie -> une trace gardée sur N (DEBUG/INFO seulement)
+CAPACITY = 1024  # traces gardées par processus dans l'anneau partagé
+FLUSH_INTERVAL = 0.2  # période du thread d'écriture (s)
+QUEUE_LIMIT = 8192  # traces en attente au-delà desquelles les nouvelles sont perdues (comptées)
+FILE_MAX_BYTES = 5 * 1024 * 1024  # taille d'un fichier de trace avant rotation (un fichier .1 gardé)
+
+_SLOT = 256
+_ENTRY = struct.Struct("<qB15sH")  # date (ns depuis l'epoch), niveau, catégorie, longueur du message
+_MESSAGE_SIZE = _SLOT - _ENTRY.size
+_HEADER = struct.Struct("<QQQ")  # traces écrites, perdues (file pleine), écartées par échantillonnage
+
+
+def level_value(level) -> int:
+    """Level number from a name ("info") or a number."""
+    if isinstance(level, str):
+        for value, name in LEVELS.items():
+            if name == level.upper():
+                return value
+        raise ValueError(f"unknown trace level {level!r}")
+    return int(level)
+
+
+class traceBuffer:
+    """Dernières traces de chaque processus, en mémoire partagée.
+
+    Un anneau de `capacity` emplacements de 256 octets par source ("api",
+    "server") ; chaque anneau n'est écrit que par le thread d'écriture du
+    processus correspondant, et lu sans verrou par les deux (un compteur relu
+    après la copie écarte les emplacements écrasés pendant la lecture).
+    """
+    def __init__(self, sources=("api", "server"), capacity=CAPACITY):
+        self.sources = tuple(sources)
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=self._stride() * len(self.sources))
+        self.shm.buf[:] = bytes(self.shm.size)
+
+    def _stride(self):
+        return _HEADER.size + _SLOT * self.capacity
+
+    def __getstate__(self):
+        return {"sources": self.sources, "capacity": self.capacity, "shm": self.shm}
+
+    def __setstate__(self, state):
+        self.sources = state["sources"]
+        self.capacity = state["capacity"]
+        self.shm = state["shm"]
+
+    def _offset(self, source):
+        return self.sources.index(source) * self._stride()
+
+    def write(self, source, entries, dropped, sampled):
+        """Append formatted (t_ns, level, category, message) entries to the ring of `source`."""
+        offset = self._offset(source)
+        buf = self.shm.buf
+        count = _HEADER.unpack_from(buf, offset)[0]
+        for t_ns, level, category, message in entries:
+            encoded = message.encode(errors="replace")[:_MESSAGE_SIZE]
+            slot = offset + _HEADER.size + (count % self.capacity) * _SLOT
+            _ENTRY.pack_into(buf, slot, t_ns, level, category.encode()[:15], len(encoded))
+            buf[slot + _ENTRY.size:slot + _ENTRY.size + len(encoded)] = encoded
+            count += 1
+            _HEADER.pack_into(buf, offset, count, dropped, sampled)
+
+    def read(self, source, n=CAPACITY):
+        """Up to `n` most recent entries of `source`, oldest first."""
+        offset = self._offset(source)
+        buf = self.shm.buf
+        count = _HEADER.unpack_from(buf, offset)[0]
+        start = max(0, count - min(n, self.capacity))
+        entries = []
+        for i in range(start, count):
+            slot = offset + _HEADER.size + (i % self.capacity) * _SLOT
+            t_ns, level, category, length = _ENTRY.unpack_from(buf, slot)
+            message = bytes(buf[slot + _ENTRY.size:slot + _ENTRY.size + min(length, _MESSAGE_SIZE)])
+            entries.append({
+                "t": t_ns / 1e9,
+                "source": source,
+                "level": LEVELS.get(level, str(level)),
+                "category": category.rstrip(b"\0").decode(errors="replace"),
+                "message": message.decode(errors="replace"),
+            })
+        # l'écrivain a pu recouvrir le début de l'anneau pendant la copie (écriture en cours comprise)
+        overwritten = _HEADER.unpack_from(buf, offset)[0] + 1 - self.capacity
+        return entries[max(0, overwritten - start):]
+
+    def query(self, n=200, level=DEBUG, category=None) -> dict:
+        """Most recent `n` entries of every source at or above `level`, merged by date."""
+        entries = []
+        for source in self.sources:
+            entries += [e for e in self.read(source) if level_value(e["level"]) >= level and (category is None or e["category"] == category)]
+        entries.sort(key=lambda e: e["t"])
+        counters = {}
+        for source in self.sources:
+            count, dropped, sampled = _HEADER.unpack_from(self.shm.buf, self._offset(source))
+            counters[source] = {"written": count, "dropped": dropped, "sampled_out": sampled}
+        return {"counters": counters, "records": entries[-n:]}
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class traceLogger:
+    """Journal d'un processus, sans entrée-sortie sur le chemin appelant.
+
+    Un appel (debug/info/warning/error) filtre sur le niveau et l'échantillonnage
+    de sa catégorie (`sampling` : une trace DEBUG/INFO gardée sur N), puis ajoute
+    (date, niveau, catégorie, format, arguments) à une deque : le message n'est
+    formaté que par le thread d'écriture, qui toutes les `flush_interval`
+    secondes l'ajoute à l'anneau partagé (`buffer`), au fichier `path` s'il est
+    donné et, au-dessus de `console_level`, à la console.
+    """
+    def __init__(self, buffer : traceBuffer, source : str, path : str = None, level=LEVEL, sampling=None, console_level=CONSOLE_LEVEL, flush_interval=FLUSH_INTERVAL, queue_limit=QUEUE_LIMIT) -> None:
+        self.buffer = buffer
+        self.source = source
+        self.path = path
+        self.level = level_value(level)
+        self.console_level = level_value(console_level)
+        self.sampling = dict(SAMPLING if sampling is None else sampling)
+        self._sample_counts = collections.Counter()
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        self.queue = collections.deque()
+        self.dropped = 0
+        self.sampled = 0
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"traceLog-{source}", daemon=True)
+        self.thread.start()
+
+    def log(self, level, category, fmt, *args):
+        if level < self.level:
+            return
+        every = self.sampling.get(category)
+        if every and level < WARNING:
+            self._sample_counts[category] += 1
+            if self._sample_counts[category] % every != 1 % every:
+                self.sampled += 1
+                return
+        if len(self.queue) >= self.queue_limit:
+            self.dropped += 1
+            return
+        self.queue.append((time.time_ns(), level, category, fmt, args))
+
+    def debug(self, category, fmt, *args):
+        self.log(DEBUG, category, fmt, *args)
+
+    def info(self, category, fmt, *args):
+        self.log(INFO, category, fmt, *args)
+
+    def warning(self, category, fmt, *args):
+        self.log(WARNING, category, fmt, *args)
+
+    def error(self, category, fmt, *args):
+        self.log(ERROR, category, fmt, *args)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        entries = []
+        queue = self.queue
+        while queue:
+            t_ns, level, category, fmt, args = queue.popleft()
+            try:
+                message = fmt % args if args else fmt
+            except (TypeError, ValueError):
+                message = f"{fmt} {args!r}"
+            entries.append((t_ns, level, category, message))
+        if not entries:
+            return
+        if self.buffer is not None:
+            self.buffer.write(self.source, entries, self.dropped, self.sampled)
+        lines = [f"{time.strftime('%H:%M:%S', time.localtime(t_ns / 1e9))}.{t_ns // 1000000 % 1000:03d} {self.source} {LEVELS.get(level, level)} [{category}] {message}" for t_ns, level, category, message in entries]
+        if self._file is not None:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            if self._file.tell() > FILE_MAX_BYTES:
+                self._rotate()
+        for (_, level, _, _), line in zip(entries, lines):
+            if level >= self.console_level:
+                print(line)
+
+    def _rotate(self):
+        self._file.close()
+        os.replace(self.path, self.path + ".1")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self._stop.set()
+        self.thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_logger = None
+
+
+def configure(buffer : traceBuffer, source : str, path : str = None, level=LEVEL, sampling=None, console_level=CONSOLE_LEVEL) -> traceLogger:
+    """Install the process-wide logger used by the module-level functions."""
+    global _logger
+    _logger = traceLogger(buffer, source, path, level, sampling, console_level)
+    return _logger
+
+
+def shutdown():
+    global _logger
+    if _logger is not None:
+        _logger.close()
+        _logger = None
+
+
+def log(level, category, fmt, *args):
+    logger = _logger
+    if logger is not None:
+        if level >= logger.level:
+            logger.log(level, category, fmt, *args)
+    elif level >= CONSOLE_LEVEL:
+        # pas encore configuré (scripts, tests) : seuls les avertissements s'affichent
+        print(f"{LEVELS.get(level, level)} [{category}] {fmt % args if args else fmt}")
+
+
+def debug(category, fmt, *args):
+    log(DEBUG, category, fmt, *args)
+
+
+def info(category, fmt, *args):
+    log(INFO, category, fmt, *args)
+
+
+def warning(category, fmt, *args):
+    log(WARNING, category, fmt, *args)
+
+
+def error(category, fmt, *args):
+    log(ERROR, category, fmt, *args)
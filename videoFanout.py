@@ -0,0 +1,158 @@
+import asyncio
+import time
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+from videoSender import videoSender, frameGrabber
+import adaptiveVideo
+import traceLog
+
+MAX_VIEWERS = 4  # nombre maximal de pairs recevant la vidéo
+GRABBER_RING_SIZE = 4  # deux consommateurs possibles : la piste WebRTC et l'encodeur MJPEG
+
+
+class fanoutTrack(MediaStreamTrack):
+	"""
+	Piste vidéo d'un pair, alimentée par videoFanout.
+	Ne garde que la dernière frame : si le pair n'a pas encore lu la précédente
+	quand une nouvelle arrive, l'ancienne est comptée comme perdue pour ce pair
+	seulement, sans ralentir les autres.
+	"""
+	kind = "video"
+
+	def __init__(self, fanout, name):
+		super().__init__()
+		self.fanout = fanout
+		self.name = name
+		self._frame = None
+		self._ready = asyncio.Event()
+		self.frames_delivered = 0
+		self.frames_dropped = 0
+		self.sender = None  # RTCRtpSender du pair, pour lire ses rapports RTCP
+		# aiortc encode et envoie la frame entre deux appels à recv() :
+		# cet intervalle (moyenne glissante) sert d'estimation du temps d'encodage
+		self.encode_time = 0.0
+		self._returned_at = None
+
+	def push(self, frame):
+		if self._frame is not None:
+			self.frames_dropped += 1
+		self._frame = frame
+		self._ready.set()
+
+	async def recv(self):
+		if self._returned_at is not None:
+			self.encode_time += 0.2 * ((time.monotonic() - self._returned_at) - self.encode_time)
+		while self._frame is None:
+			if self.readyState != "live":
+				raise MediaStreamError
+			await self._ready.wait()
+			self._ready.clear()
+		frame, self._frame = self._frame, None
+		self.frames_delivered += 1
+		self._returned_at = time.monotonic()
+		return frame
+
+	def stop(self):
+		super().stop()
+		self._ready.set()
+		self.fanout.remove(self)
+
+	def stats(self):
+		return {"delivered": self.frames_delivered, "dropped": self.frames_dropped, "encode_ms": round(self.encode_time * 1000.0, 2)}
+
+
+class videoFanout:
+	"""
+	Une seule capture caméra pour tous les pairs WebRTC.
+	La caméra (videoSender) n'est ouverte qu'à l'arrivée du premier spectateur et
+	refermée au départ du dernier ; chaque frame est convertie une fois puis
+	remise à la piste de chaque pair (fanoutTrack). Tant qu'elle tourne, un
+	adaptiveVideo.videoQualityController ajuste résolution et cadence selon `ladder`.
+	Le frameGrabber est partagé avec les autres consommateurs (mjpegStreamer) via
+	acquire()/release() : la caméra reste ouverte tant que quelqu'un la lit.
+	Usage :
+	  fanout = videoFanout(source=0, width=640, height=480, fps=30)
+	  track = fanout.add_viewer("peer-1")  # None si le nombre maximal est atteint
+	  pc.addTrack(track)
+	"""
+	def __init__(self, source, width=None, height=None, fps=30, max_viewers=MAX_VIEWERS, ladder=None, fourcc=None):
+		self.source = source
+		self.fourcc = fourcc
+		self.max_viewers = max_viewers
+		if ladder is None:
+			# échelle par défaut plafonnée au profil configuré
+			top = (width or 640, height or 480, fps or 30)
+			ladder = [r for r in adaptiveVideo.DEFAULT_LADDER if r[0] * r[1] <= top[0] * top[1] and r[2] <= top[2] and r != top] + [top]
+		self.controller = adaptiveVideo.videoQualityController(self, ladder)
+		self.width, self.height, self.fps = self.controller.profile
+		self.viewers = set()
+		self.grabber = None
+		self._grabber_users = 0
+		self.track = None
+		self.task = None
+		self.control_task = None
+		self.frames_produced = 0
+
+	def add_viewer(self, name):
+		if len(self.viewers) >= self.max_viewers:
+			traceLog.warning("video", "Video viewer limit reached (%d), refusing %s", self.max_viewers, name)
+			return None
+		viewer = fanoutTrack(self, name)
+		self.viewers.add(viewer)
+		if self.task is None or self.task.done():
+			self.task = asyncio.ensure_future(self._run())
+			self.control_task = asyncio.ensure_future(self.controller.run())
+		return viewer
+
+	def remove(self, viewer):
+		self.viewers.discard(viewer)
+		if not self.viewers and self.task is not None:
+			self.task.cancel()
+			self.task = None
+			self.control_task.cancel()
+			self.control_task = None
+
+	def acquire(self):
+		"""Return the shared frameGrabber, opening the camera for the first user."""
+		if self.grabber is None:
+			self.grabber = frameGrabber(self.source, self.width, self.height, self.fps, ring_size=GRABBER_RING_SIZE, fourcc=self.fourcc)
+		self._grabber_users += 1
+		return self.grabber
+
+	def release(self):
+		self._grabber_users -= 1
+		if self._grabber_users <= 0 and self.grabber is not None:
+			self.grabber.stop()
+			self.grabber = None
+			self._grabber_users = 0
+
+	def set_profile(self, width, height, fps):
+		self.width, self.height, self.fps = width, height, fps
+		if self.grabber is not None:
+			self.grabber.set_profile(width, height, fps)
+
+	async def _run(self):
+		track = self.track = videoSender(self.acquire(), self.width, self.height, self.fps)
+		try:
+			while self.viewers:
+				frame = await track.recv()
+				self.frames_produced += 1
+				for viewer in self.viewers:
+					viewer.push(frame)
+		except MediaStreamError:
+			pass
+		finally:
+			track.stop()
+			self.release()
+			if self.track is track:
+				self.track = None
+
+	def stats(self):
+		stats = {"viewers": len(self.viewers), "max_viewers": self.max_viewers, "frames_produced": self.frames_produced, "profile": self.controller.stats(), "peers": {v.name: v.stats() for v in self.viewers}}
+		if self.grabber is not None:
+			stats["capture"] = {
+				"frames_captured": self.grabber.frames_captured,
+				"frames_dropped": self.grabber.frames_dropped,
+				"read_failures": self.grabber.read_failures,
+			}
+		return stats
@@ -1,26 +1,58 @@
 import asyncio
+import sys
+import threading
+import time
 import cv2
 import av
 from aiortc import VideoStreamTrack
-from aiortc.mediastreams import MediaStreamError
+from aiortc.mediastreams import MediaStreamError, VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
 import numpy as np
+import traceLog
 
+RING_SIZE = 3  # nombre de buffers de frames préalloués
+FRAME_POOL_SIZE = 4  # av.VideoFrame yuv420p réutilisées par videoSender
+READ_FAILURE_LOG_EVERY = 100  # une trace pour N échecs de lecture (caméra débranchée : un échec par frame)
 
-class videoSender(VideoStreamTrack):
+
+class frameGrabber:
 	"""
-	VideoStreamTrack qui lit depuis OpenCV (cv2.VideoCapture).
+	Thread de capture dédié : lit la caméra en continu dans un petit anneau de
+	buffers numpy préalloués et publie toujours la dernière frame lue.
 	Usage :
-	  track = videoSender(source=0, width=640, height=480, fps=30)
-	  pc.addTrack(track)
+	  grabber = frameGrabber(source=0, width=640, height=480, fps=30)
+	  seq, frame = grabber.latest()
 	Paramètres :
 	  source : int (index de la caméra) ou cv2.VideoCapture déjà ouvert
 	  width/height/fps : facultatifs (essayés d'être appliqués au capture si possible)
+	  fourcc : format demandé à la caméra, ex. "MJPG" (moins de bande passante USB, cadences plus hautes)
+	Le buffer renvoyé par latest() n'est pas réécrit par le thread de capture avant
+	l'appel suivant à latest() avec le même `consumer` (ou release(consumer)) ; il
+	faut le copier pour le garder plus longtemps. Avec plusieurs consommateurs,
+	prévoir ring_size >= 2 + leur nombre : si la frame publiée et les frames prêtées
+	occupent tout l'anneau, la frame lue ensuite est jetée (comptée dans frames_dropped).
 	"""
-	def __init__(self, source, width=None, height=None, fps=30):
-		super().__init__()  # initialise VideoStreamTrack
-		
-		self.capture = source
-		
+	def __init__(self, source, width=None, height=None, fps=30, ring_size=RING_SIZE, fourcc=None):
+		self._capture = source if isinstance(source, cv2.VideoCapture) else cv2.VideoCapture(source)
+		if fourcc is not None:
+			try: self._capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+			except Exception: pass
+
+		self._ring_size = max(ring_size, 3)
+		self._raw = None  # buffer de lecture quand la caméra ne donne pas la taille demandée
+		self._lock = threading.Lock()
+		self._apply_profile(width, height, fps)
+
+		self.seq = 0
+		self._taken_seq = 0
+		self.frames_captured = 0
+		self.frames_dropped = 0  # publiées puis remplacées sans avoir été lues, ou jetées faute de buffer libre
+		self.read_failures = 0
+
+		self.running = True
+		self._thread = threading.Thread(target=self._run, daemon=True, name="frameGrabber")
+		self._thread.start()
+
+	def _apply_profile(self, width, height, fps):
 		# essayer d'appliquer les paramètres si fournis
 		if width is not None:
 			try: self._capture.set(cv2.CAP_PROP_FRAME_WIDTH, int(width))
@@ -31,36 +63,243 @@ class videoSender(VideoStreamTrack):
 		if fps is not None:
 			try: self._capture.set(cv2.CAP_PROP_FPS, float(fps))
 			except Exception: pass
+		self.fps = fps or 30
+
+		h = int(height or self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT) or 480)
+		w = int(width or self._capture.get(cv2.CAP_PROP_FRAME_WIDTH) or 640)
+		self.width, self.height = w, h
+		self._ring = [np.zeros((h, w, 3), dtype=np.uint8) for _ in range(self._ring_size)]
+		# frame noire allouée une seule fois (par profil), servie tant qu'aucune lecture n'a réussi
+		self._black = np.zeros((h, w, 3), dtype=np.uint8)
+		self._latest = None  # index dans l'anneau de la dernière frame publiée
+		self._leased = {}  # consommateur -> index de la frame qui lui a été rendue
+
+	def set_profile(self, width, height, fps):
+		"""Change la résolution et la cadence de capture ; les frames sont redimensionnées si la caméra ne suit pas."""
+		with self._lock:
+			previous = self._ring[self._latest] if self._latest is not None else None
+			self._apply_profile(width, height, fps)
+			self._raw = None
+			if previous is not None:
+				# en attendant la première frame au nouveau format, on sert l'ancienne redimensionnée
+				cv2.resize(previous, (self.width, self.height), dst=self._black, interpolation=cv2.INTER_AREA)
+
+	def _next_slot(self, idx):
+		# jamais la frame publiée ni celles en cours d'utilisation par les consommateurs ;
+		# None si aucun buffer n'est libre
+		for _ in range(len(self._ring)):
+			if idx != self._latest and idx not in self._leased.values():
+				return idx
+			idx = (idx + 1) % len(self._ring)
+		return None
+
+	def _run(self):
+		idx = 0
+		while self.running:
+			with self._lock:
+				ring = self._ring
+				slot = self._next_slot(idx % len(ring))
+			if slot is None:
+				# anneau entièrement occupé : la frame est lue puis jetée, sans attendre les consommateurs
+				try: grabbed = self._capture.grab()
+				except Exception: grabbed = False
+				if not grabbed:
+					time.sleep(1.0 / self.fps)
+				self.frames_dropped += 1
+				continue
+			idx = slot
+			buf = ring[idx]
+			try:
+				ret, frame = self._capture.read(self._raw if self._raw is not None else buf)
+			except Exception as e:
+				if self.read_failures % READ_FAILURE_LOG_EVERY == 0:
+					traceLog.warning("camera", "Camera read failed (failure %d): %r", self.read_failures + 1, e)
+				ret, frame = False, None
+			if not ret or frame is None:
+				self.read_failures += 1
+				time.sleep(1.0 / self.fps)
+				continue
+			if frame.shape != buf.shape:
+				# la caméra n'a pas pris la taille demandée : on lit dans un buffer à part et on réduit
+				self._raw = frame
+				cv2.resize(frame, (buf.shape[1], buf.shape[0]), dst=buf, interpolation=cv2.INTER_AREA)
+			elif frame is not buf:
+				np.copyto(buf, frame)
+				self._raw = None
+			with self._lock:
+				if ring is not self._ring:
+					continue  # profil changé pendant la lecture
+				if self.seq > self._taken_seq:
+					self.frames_dropped += 1
+				self._latest = idx
+				self.seq += 1
+			self.frames_captured += 1
+			idx = (idx + 1) % len(self._ring)
+
+	def latest(self, consumer=None):
+		"""Return (seq, frame) for the newest frame without waiting; the frame is black before the first read."""
+		with self._lock:
+			if self._latest is None:
+				return self.seq, self._black
+			self._leased[consumer] = self._latest
+			self._taken_seq = self.seq
+			return self.seq, self._ring[self._latest]
+
+	def release(self, consumer=None):
+		"""Give back the frame leased to `consumer` (a consumer that stops must call this)."""
+		with self._lock:
+			self._leased.pop(consumer, None)
+
+	def stop(self):
+		self.running = False
+		if self._thread.is_alive() and self._thread is not threading.current_thread():
+			self._thread.join(timeout=1.0)
+		self._capture.release()
+
+
+class yuvFramePool:
+	"""
+	Réserve d'av.VideoFrame yuv420p (format natif des encodeurs VP8/H264 d'aiortc)
+	réutilisées d'une image à l'autre : la conversion BGR -> I420 est faite par
+	OpenCV dans un buffer préalloué puis recopiée dans les plans d'une frame libre.
+	Une frame est réutilisée quand plus aucun objet Python ne la référence en dehors
+	de la réserve (sys.getrefcount, CPython comme PyAV) ; avant de la réécrire,
+	make_writable() vérifie que libavcodec ne garde pas non plus ses buffers (encodeur
+	avec délai ou matériel) et lui en donne de nouveaux sinon (comptés dans `reallocated`).
+	Usage :
+	  pool = yuvFramePool(640, 480)
+	  video_frame = pool.convert(bgr)
+	"""
+	def __init__(self, width, height, size=FRAME_POOL_SIZE):
+		self.width, self.height = width, height
+		self.size = size
+		self._i420 = np.empty((height * 3 // 2, width), dtype=np.uint8)
+		flat = self._i420.reshape(-1)
+		y, c = width * height, (width // 2) * (height // 2)
+		self._src = (
+			flat[:y].reshape(height, width),
+			flat[y:y + c].reshape(height // 2, width // 2),
+			flat[y + c:y + 2 * c].reshape(height // 2, width // 2),
+		)
+		self._frames = []  # [frame, vues numpy (y, u, v) sur ses plans, nombre de références au repos]
+		self.allocated = 0
+		self.reused = 0
+		self.reallocated = 0  # frames dont libavcodec gardait encore les buffers
+
+	@staticmethod
+	def supports(width, height):
+		return width % 2 == 0 and height % 2 == 0
+
+	@staticmethod
+	def _views(frame):
+		# les plans peuvent être plus larges que l'image (alignement) : vues sur la partie utile
+		return tuple(np.frombuffer(p, np.uint8).reshape(p.height, p.line_size)[:, :p.width] for p in frame.planes)
+
+	def _new(self):
+		frame = av.VideoFrame(self.width, self.height, "yuv420p")
+		self.allocated += 1
+		return frame, self._views(frame)
+
+	def _make_writable(self, entry):
+		"""Ensure libav holds no other reference to the buffers of `entry`'s frame before they are overwritten."""
+		frame = entry[0]
+		buffers = [p.buffer_ptr for p in frame.planes]
+		frame.make_writable()  # av_frame_make_writable : nouveaux buffers si les actuels sont partagés
+		if [p.buffer_ptr for p in frame.planes] != buffers:
+			entry[1] = self._views(frame)
+			self.reallocated += 1
+
+	def _take(self):
+		for entry in self._frames:
+			if sys.getrefcount(entry[0]) == entry[2]:
+				self._make_writable(entry)
+				self.reused += 1
+				return entry[0], entry[1]
+		frame, views = self._new()
+		if len(self._frames) < self.size:
+			self._frames.append([frame, views, 0])
+			self._frames[-1][2] = sys.getrefcount(self._frames[-1][0]) - 1  # sans la variable locale `frame`
+		return frame, views
 
-		# boucle/executor
-		self._loop = asyncio.get_event_loop()
+	def convert(self, bgr):
+		"""Return a pooled yuv420p av.VideoFrame holding `bgr`; valid until the caller drops it."""
+		frame, views = self._take()
+		cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420, dst=self._i420)
+		for dst, src in zip(views, self._src):
+			np.copyto(dst, src)
+		return frame
+
+
+class videoSender(VideoStreamTrack):
+	"""
+	VideoStreamTrack qui lit depuis OpenCV (cv2.VideoCapture) via un frameGrabber.
+	Usage :
+	  track = videoSender(source=0, width=640, height=480, fps=30)
+	  pc.addTrack(track)
+	Paramètres :
+	  source : int (index de la caméra), cv2.VideoCapture déjà ouvert ou frameGrabber partagé
+	  width/height/fps : facultatifs (essayés d'être appliqués au capture si possible)
+	"""
+	def __init__(self, source, width=None, height=None, fps=30, fourcc=None):
+		super().__init__()  # initialise VideoStreamTrack
+
+		self._owns_grabber = not isinstance(source, frameGrabber)
+		self.grabber = frameGrabber(source, width, height, fps, fourcc=fourcc) if self._owns_grabber else source
+		self._last_seq = 0
+		self.frames_sent = 0
+		self.frames_repeated = 0  # pas de nouvelle frame caméra depuis le dernier envoi
+		self.frames_dropped = 0  # frames caméra jamais envoyées sur cette piste
+		self._pool = None
 
 	async def recv(self):
 		"""
 		Appelé par aiortc pour obtenir la prochaine frame.
-		La lecture cv2 est faite via run_in_executor pour éviter de bloquer.
+		Renvoie immédiatement la dernière frame publiée par le thread de capture.
 		"""
+		if self.readyState != "live":
+			raise MediaStreamError
 
 		# obtenir pts/time_base attendus par aiortc
 		pts, time_base = await self.next_timestamp()
 
-		# lire frame dans thread pool
-		try:
-			ret, frame = await self._loop.run_in_executor(None, self._capture.read)
-		except Exception as e:
-			# erreur de lecture -> lever pour terminer la piste
-			raise MediaStreamError from e
-
-		if not ret or frame is None:
-			# retourner une frame noire si impossible de lire
-			h = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT) or 480)
-			w = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH) or 640)
-			frame = (0 * (np.zeros((h, w, 3), dtype='uint8')))
-
-		# convertir BGR (OpenCV) en av.VideoFrame en spécifiant format 'bgr24'
-		video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+		seq, frame = self.grabber.latest()
+		if seq == self._last_seq:
+			self.frames_repeated += 1
+		elif self._last_seq and seq > self._last_seq + 1:
+			self.frames_dropped += seq - self._last_seq - 1
+		self._last_seq = seq
+
+		# convertir BGR (OpenCV) en av.VideoFrame yuv420p réutilisée : l'encodeur n'a plus rien à convertir
+		height, width = frame.shape[:2]
+		if self._pool is None or (self._pool.width, self._pool.height) != (width, height):
+			self._pool = yuvFramePool(width, height) if yuvFramePool.supports(width, height) else None
+		if self._pool is not None:
+			video_frame = self._pool.convert(frame)
+		else:
+			video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
 		# définir pts/time_base fournis par next_timestamp
 		video_frame.pts = pts
 		video_frame.time_base = time_base
+		self.frames_sent += 1
 		return video_frame
 
+	async def next_timestamp(self):
+		"""Comme VideoStreamTrack.next_timestamp, mais cadencé sur la fréquence courante du frameGrabber."""
+		if self.readyState != "live":
+			raise MediaStreamError
+
+		if hasattr(self, "_timestamp"):
+			self._timestamp += int(VIDEO_CLOCK_RATE / self.grabber.fps)
+			wait = self._start + (self._timestamp / VIDEO_CLOCK_RATE) - time.time()
+			await asyncio.sleep(wait)
+		else:
+			self._start = time.time()
+			self._timestamp = 0
+		return self._timestamp, VIDEO_TIME_BASE
+
+	def stop(self):
+		super().stop()
+		if self._owns_grabber:
+			self.grabber.stop()
+		else:
+			self.grabber.release()